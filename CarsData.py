@@ -1,18 +1,37 @@
 from __future__ import annotations
 
+import itertools
 import json
+import multiprocessing
 import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from enum import IntFlag
+from typing import Dict, List, Optional
 
-import cv2
 import numpy as np
 import pandas as pd
 import tqdm.auto as tqdm
 
-import drawingUtil
 import mathUtil
-from VideoReader import VideoReader
-from drawingUtil import draw_rectangle_normalized, draw_dot_normalized, random_color
+import metrics
+from mathUtil import Line
+from roi import Polygon
+
+
+"""
+Colors of the lines and gates drawn by save_video, in order.
+"""
+COUNTER_COLORS = [(0, 0, 255), (255, 0, 0), (0, 200, 0), (0, 200, 255), (255, 0, 255), (255, 255, 0)]
+
+"""
+Files whose name ends with this extension are saved in the binary format (see CarsData.save_binary).
+"""
+BINARY_EXTENSION = ".carsdata"
+_BINARY_METADATA_FILE = "metadata.json"
+_BINARY_INDEX_PREFIX = "index."
 
 
 class ObjectMarker(IntFlag):
@@ -41,15 +60,36 @@ class CarsData:
     frame_jump: int
     video_path: str
 
-    def __init__(self, df: pd.DataFrame, fps: int, video_path: str, frame_jump: int, start_frame: int):
+    """
+    The wall clock time (as given by time.time()) that each frame was read at, for data of a live stream, whose frames
+    are dropped unevenly so that fps and frame_jump are only averages. None when the frames are evenly spaced.
+    """
+    timestamps: Optional[np.ndarray]
+
+    def __init__(self, df: pd.DataFrame, fps: int, video_path: str, frame_jump: int, start_frame: int,
+                 timestamps: Optional[np.ndarray] = None):
         self.df = df
         self.fps = fps
         self.video_path = video_path
         self.frame_jump = frame_jump
         self.start_frame = start_frame
+        self.timestamps = None if timestamps is None else np.asarray(timestamps, dtype=np.float64)
+        self._frame_index: Optional[FrameIndex] = None
 
-    def by_frame(self, frame: int) -> pd.DataFrame:
-        return self.df.loc[frame]
+    @property
+    def frame_index(self) -> FrameIndex:
+        """
+        Built from the DataFrame the first time it's needed.
+        """
+        if self._frame_index is None:
+            self._frame_index = FrameIndex(self.df)
+        return self._frame_index
+
+    def by_frame(self, frame: int) -> FrameView:
+        """
+        :return: The detections of the frame, as views of numpy arrays. Frames without detections give an empty view.
+        """
+        return self.frame_index.by_frame(frame)
 
     def num_frames(self):
         """
@@ -58,144 +98,389 @@ class CarsData:
         return self.df.iloc[-1]["frame_num"]
 
     def save_video(self, out_path, object_marker: ObjectMarker = ObjectMarker.ALL, display_frame=False,
-                   pass_line_times: np.array = None, line_to_draw=None, highlight_ids=None):
+                   pass_line_times: np.array = None, line_to_draw=None, highlight_ids=None, prefetch=0,
+                   counting_lines: Optional[Dict[str, Line]] = None, counting_gates: Optional[Dict[str, Polygon]] = None,
+                   crossings: Optional[Dict[str, pd.DataFrame]] = None, processes=1, video_backend="opencv",
+                   encode_queue_size=0):
+        """
+        :param prefetch: The number of frames to decode ahead on a background thread, see VideoReader.
+        :param counting_lines: Lines by name to draw, each with a counter of the objects that crossed it so far.
+        :param counting_gates: Polygons by name to draw, each with a counter of the objects that entered and left it.
+        :param crossings: The result of count_crossings for the lines and gates, if it was already computed.
+        :param processes: Split the video into this many parts that are rendered by separate processes at once, and join
+        them at the end (see concat_videos).
+        :param video_backend: The backend of the VideoWriter, "opencv" or "ffmpeg".
+        :param encode_queue_size: Encode the frames on a background thread while the next ones are drawn, see VideoWriter.
+        """
         if highlight_ids is None:
             highlight_ids = {}
+        if counting_lines is None:
+            counting_lines = {}
+        if counting_gates is None:
+            counting_gates = {}
+        if crossings is None and (counting_lines or counting_gates):
+            crossings = self.count_crossings(counting_lines, counting_gates)
+        render_options = {
+            "object_marker": object_marker,
+            "display_frame": display_frame,
+            "pass_line_times": pass_line_times,
+            "line_to_draw": line_to_draw,
+            "highlight_ids": highlight_ids,
+            "counting_lines": counting_lines,
+            "counting_gates": counting_gates,
+            "crossings": crossings,
+            "video_backend": video_backend,
+            "encode_queue_size": encode_queue_size,
+        }
+        num_frames = int(self.num_frames())
+        # every process renders at least one frame, since empty parts can't be joined
+        processes = min(processes, num_frames)
+        if processes > 1:
+            self._save_video_parallel(out_path, num_frames, processes, prefetch, render_options)
+        else:
+            self._render_video(out_path, 0, num_frames, prefetch, show_progress=True, **render_options)
+
+    def _save_video_parallel(self, out_path: str, num_frames: int, processes: int, prefetch: int,
+                             render_options: dict):
+        from VideoReader import concat_videos
 
-        video_reader = VideoReader(self.video_path, frame_jump=self.frame_jump, start_frame=self.start_frame)
+        bounds = np.linspace(0, num_frames, processes + 1).astype(int)
+        segments_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_path)))
+        extension = os.path.splitext(out_path)[1]
+        segment_paths = [os.path.join(segments_dir, f"{i}{extension}") for i in range(processes)]
+        try:
+            # processes are spawned like in sharded.py, so that rendering works the same after a model was loaded
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+                # every process only gets the data of its own frames
+                futures = {executor.submit(_render_segment, self.frames_between(first_frame, end_frame), segment_path,
+                                           first_frame, end_frame, prefetch, render_options): end_frame - first_frame
+                           for segment_path, first_frame, end_frame in zip(segment_paths, bounds[:-1], bounds[1:])}
+                with tqdm.tqdm(total=num_frames, desc="Saving Video") as pbar:
+                    for future in as_completed(futures):
+                        future.result()
+                        pbar.update(futures[future])
+            concat_videos(segment_paths, out_path)
+        finally:
+            shutil.rmtree(segments_dir)
+
+    def _render_video(self, out_path: str, first_frame: int, end_frame: int, prefetch: int, object_marker: ObjectMarker,
+                      display_frame: bool, pass_line_times: Optional[np.array], line_to_draw, highlight_ids,
+                      counting_lines: Dict[str, Line], counting_gates: Dict[str, Polygon],
+                      crossings: Optional[Dict[str, pd.DataFrame]], video_backend: str, encode_queue_size: int,
+                      show_progress=False):
+        """
+        Draws the frames from first_frame up to end_frame, and saves them as a video.
+        """
+        # opencv is only imported to draw, so that counting and the other analyses start faster
+        import cv2
+        import drawingUtil
+        from VideoReader import VideoReader, VideoWriter
+        from drawingUtil import draw_rectangle_normalized, draw_dot_normalized, id_color
+
+        # the sorted crossing times of each direction, to count the crossings up to a frame with a binary search
+        counter_times = {
+            name: (np.sort(crossings[name]["frame_num"].to_numpy()[crossings[name]["direction"].to_numpy() == 1]),
+                   np.sort(crossings[name]["frame_num"].to_numpy()[crossings[name]["direction"].to_numpy() == -1]))
+            for name in itertools.chain(counting_lines, counting_gates)
+        }
+        counter_colors = dict(zip(itertools.chain(counting_lines, counting_gates), itertools.cycle(COUNTER_COLORS)))
+
+        video_reader = VideoReader(self.video_path, frame_jump=self.frame_jump,
+                                   start_frame=self.start_frame + first_frame * self.frame_jump, prefetch=prefetch,
+                                   max_frames=end_frame - first_frame)
         video_size = (video_reader.frame_width, video_reader.frame_height)
-        video_writer = cv2.VideoWriter(out_path,
-                                       cv2.VideoWriter_fourcc(*'mp4v'),
-                                       self.fps,
-                                       video_size
-                                       )
-        if not video_writer.isOpened():
-            raise Exception("Cannot write to video.")
+        video_writer = VideoWriter(out_path, self.fps, video_size, backend=video_backend, queue_size=encode_queue_size)
+        # prefetched frames are reused buffers, so they have to be copied if they are encoded later
+        copy_frames = prefetch > 0 and encode_queue_size > 0
 
         # Show progress bar
-        pbar = tqdm.tqdm(total=self.num_frames(), desc="Saving Video")
+        pbar = tqdm.tqdm(total=end_frame - first_frame, desc="Saving Video", disable=not show_progress)
         pbar.set_postfix({
             "Video Frame Rate": f"{video_reader.fps:.2f} fps",
             "Frame Jump": f"{self.frame_jump}",
             "Duration": f"{video_reader.duration:.2f} seconds"
         })
-        frame_num = 0
+        frame_num = first_frame
         marker_colors = {}  # A dicitnary which asigns a unique color to each object based on its id.
 
         frame_width = video_reader.frame_width
         frame_height = video_reader.frame_height
 
-        for frame in video_reader.iter_frames():
-            if frame_num >= self.num_frames():
-                break
-
-            if line_to_draw is not None:
-                drawingUtil.draw_line_normalized(frame,
-                         pt1=line_to_draw[0],
-                         pt2=line_to_draw[1],
-                         color=(0,0,255),
-                         thickness=2
-                )
-
-            detected_objects = self.by_frame(frame_num)
-            for _, detected_object in detected_objects.iterrows():
-                # Choose a color for the current object based on its id
-                object_id = detected_object["object_id"]
-                is_highlighted =  object_id in highlight_ids
-                marker_color = marker_colors.get(object_id)
-                # If no color was chosen for an object with this id, then choose a random color yourself.
-                if marker_color is None:
-                    marker_color = random_color()
-                    marker_colors[object_id] = marker_color
-
-                object_center = (detected_object["x_center"], detected_object["y_center"])
-                object_top_left_corner = (detected_object["x_center"] - detected_object["width"] / 2,
-                                          detected_object["y_center"] - detected_object["height"] / 2)
-                if object_marker & ObjectMarker.RECTANGLE:
-                    draw_rectangle_normalized(frame,
-                                              object_center,
-                                              (detected_object["width"], detected_object["height"]),
-                                              color=marker_color,
-                                              thickness=2
-                                              )
-                if object_marker & ObjectMarker.DOT:
-                    draw_dot_normalized(image=frame, center=object_center, radius=16 if is_highlighted else 6, color=marker_color)
-                if object_marker & ObjectMarker.TEXT:
-                    cv2.putText(
-                        img=frame,
-                        text=str(int(object_id)),
-                        org=(
-                            int(object_top_left_corner[0] * frame_width),
-                            int(object_top_left_corner[1] * frame_height)),
-                        fontFace=cv2.QT_FONT_NORMAL,
-                        fontScale=2,
-                        color=marker_color,
-                        thickness=2,
-                        bottomLeftOrigin=False)
-
-            caption = ""
-            if display_frame:
-                # draws the frame number in the top left corner
-                caption += f"Frame: {frame_num}\n"
-            if pass_line_times is not None:
-                cars_past_line = np.sum(pass_line_times <= frame_num)
-                caption += f"Cars Past Line: {cars_past_line}\n"
-            caption = caption.rstrip("\n")
-            add_caption(frame, caption)
-
-            pbar.update()
-            video_writer.write(frame)
-            frame_num += 1
-        video_writer.release()
+        # closed even if drawing fails, so that the encoding thread and the ffmpeg process are stopped
+        with video_writer:
+            for frame in video_reader.iter_frames():
+                if frame_num >= end_frame:
+                    break
+                render_start_time = time.perf_counter()
+
+                if line_to_draw is not None:
+                    drawingUtil.draw_line_normalized(frame,
+                             pt1=line_to_draw[0],
+                             pt2=line_to_draw[1],
+                             color=(0,0,255),
+                             thickness=2
+                    )
+                for name, (pt1, pt2) in counting_lines.items():
+                    drawingUtil.draw_line_normalized(frame, pt1=pt1, pt2=pt2, color=counter_colors[name], thickness=2)
+                    drawingUtil.draw_text(frame, text=name, uv_top_left=(pt1[0] * frame_width, pt1[1] * frame_height),
+                                          color=counter_colors[name])
+                for name, polygon in counting_gates.items():
+                    drawingUtil.draw_polygon_normalized(frame, polygon, color=counter_colors[name], thickness=2)
+                    drawingUtil.draw_text(frame, text=name,
+                                          uv_top_left=(polygon[0][0] * frame_width, polygon[0][1] * frame_height),
+                                          color=counter_colors[name])
+
+                detected_objects = self.by_frame(frame_num)
+                # python numbers are faster to work with one by one than numpy scalars
+                for object_id, x_center, y_center, width, height in zip(detected_objects.object_id.tolist(),
+                                                                         detected_objects.x_center.tolist(),
+                                                                         detected_objects.y_center.tolist(),
+                                                                         detected_objects.width.tolist(),
+                                                                         detected_objects.height.tolist()):
+                    # Choose a color for the current object based on its id
+                    is_highlighted =  object_id in highlight_ids
+                    marker_color = marker_colors.get(object_id)
+                    # The color is a hash of the id, so that it's the same in every part of a video that is rendered in parallel.
+                    if marker_color is None:
+                        marker_color = id_color(object_id)
+                        marker_colors[object_id] = marker_color
+                    object_center = (x_center, y_center)
+                    object_top_left_corner = (x_center - width / 2, y_center - height / 2)
+                    if object_marker & ObjectMarker.RECTANGLE:
+                        draw_rectangle_normalized(frame,
+                                                  object_center,
+                                                  (width, height),
+                                                  color=marker_color,
+                                                  thickness=2
+                                                  )
+                    if object_marker & ObjectMarker.DOT:
+                        draw_dot_normalized(image=frame, center=object_center, radius=16 if is_highlighted else 6, color=marker_color)
+                    if object_marker & ObjectMarker.TEXT:
+                        cv2.putText(
+                            img=frame,
+                            text=str(int(object_id)),
+                            org=(
+                                int(object_top_left_corner[0] * frame_width),
+                                int(object_top_left_corner[1] * frame_height)),
+                            fontFace=cv2.QT_FONT_NORMAL,
+                            fontScale=2,
+                            color=marker_color,
+                            thickness=2,
+                            bottomLeftOrigin=False)
+
+                caption = ""
+                if display_frame:
+                    # draws the frame number in the top left corner
+                    caption += f"Frame: {frame_num}\n"
+                if pass_line_times is not None:
+                    cars_past_line = np.sum(pass_line_times <= frame_num)
+                    caption += f"Cars Past Line: {cars_past_line}\n"
+                for name, (forward_times, backward_times) in counter_times.items():
+                    forward = np.searchsorted(forward_times, frame_num, side="right")
+                    backward = np.searchsorted(backward_times, frame_num, side="right")
+                    if name in counting_gates:
+                        caption += f"{name}: {forward} in, {backward} out\n"
+                    else:
+                        caption += f"{name}: {forward + backward} ({forward} forward, {backward} backward)\n"
+                caption = caption.rstrip("\n")
+                add_caption(frame, caption)
+                metrics.observe("render_seconds", time.perf_counter() - render_start_time)
+                metrics.count("frames_rendered")
+
+                pbar.update()
+                video_writer.write_bgr(frame.copy() if copy_frames else frame)
+                frame_num += 1
         pbar.close()
 
+    def frames_between(self, first_frame: int, end_frame: int) -> CarsData:
+        """
+        Returns a CarsData with only the detections of the frames from first_frame up to end_frame. The frame numbers
+        stay the same.
+        """
+        frames = self.df.index.get_level_values("frame")
+        return CarsData(
+            df=self.df[(frames >= first_frame) & (frames < end_frame)],
+            fps=self.fps,
+            frame_jump=self.frame_jump,
+            start_frame=self.start_frame,
+            video_path=self.video_path,
+            timestamps=self.timestamps
+        )
+
+    def _metadata(self) -> dict:
+        metadata = {
+            "fps": self.fps,
+            "frame_jump": self.frame_jump,
+            "video_path": os.path.abspath(self.video_path),
+            "start_frame": self.start_frame
+        }
+        if self.timestamps is not None:
+            metadata["timestamps"] = self.timestamps.tolist()
+        return metadata
+
+    @metrics.timed("save_data")
     def save_data(self, filename: str):
+        """
+        Saves the data as a json line of metadata followed by a csv, or in the binary format if filename ends with
+        BINARY_EXTENSION.
+        """
+        if filename.endswith(BINARY_EXTENSION):
+            self.save_binary(filename)
+            return
         with open(filename, "w", newline="") as file:
-            metadata = {
-                "fps": self.fps,
-                "frame_jump": self.frame_jump,
-                "video_path": os.path.abspath(self.video_path),
-                "start_frame": self.start_frame
-            }
-            json.dump(metadata, file)
+            json.dump(self._metadata(), file)
             file.write("\n")
             self.df.to_csv(file)
 
+    def save_binary(self, dirname: str):
+        """
+        Saves the data as a directory with the metadata in a json file, and every column (and index level) in its own
+        .npy file, so that columns can be loaded separately and memory mapped.
+        """
+        os.makedirs(dirname, exist_ok=True)
+        for level in self.df.index.names:
+            np.save(os.path.join(dirname, f"{_BINARY_INDEX_PREFIX}{level}.npy"),
+                    self.df.index.get_level_values(level).to_numpy())
+        for column in self.df.columns:
+            np.save(os.path.join(dirname, f"{column}.npy"), self.df[column].to_numpy())
+        # the metadata is written last, so its modification time is the time the save finished
+        with open(os.path.join(dirname, _BINARY_METADATA_FILE), "w") as file:
+            json.dump({**self._metadata(), "columns": list(self.df.columns)}, file)
+
     @staticmethod
-    def from_file(filename: str):
+    @metrics.timed("load_data")
+    def from_file(filename: str, columns: Optional[List[str]] = None, use_binary_cache=False):
+        """
+        Loads data saved by save_data, in either format.
+        :param columns: Only load these columns. Loads all of them by default.
+        :param use_binary_cache: When loading a csv, convert it to the binary format next to it the first time, and
+        load the binary copy from then on (until the csv is modified).
+        """
+        if os.path.isdir(filename):
+            return CarsData.from_binary(filename, columns)
+        if use_binary_cache:
+            binary_filename = filename + BINARY_EXTENSION
+            # the directory's own modification time doesn't change when the files in it are overwritten
+            metadata_filename = os.path.join(binary_filename, _BINARY_METADATA_FILE)
+            if not os.path.exists(metadata_filename) or os.path.getmtime(metadata_filename) < os.path.getmtime(filename):
+                CarsData.convert_to_binary(filename, binary_filename)
+            return CarsData.from_binary(binary_filename, columns)
         with open(filename) as file:
             first_line = file.readline()
             metadata = json.loads(first_line)
-            df = pd.read_csv(file, index_col=[0, 1])
+            usecols = None if columns is None else lambda column: column in columns or column in ("frame", "index")
+            df = pd.read_csv(file, index_col=[0, 1], usecols=usecols)
             return CarsData(
                 df=df,
                 fps=metadata["fps"],
                 frame_jump=metadata["frame_jump"],
                 video_path=metadata["video_path"],
-                start_frame=metadata["start_frame"]
+                start_frame=metadata["start_frame"],
+                timestamps=metadata.get("timestamps")
             )
 
+    @staticmethod
+    def from_binary(dirname: str, columns: Optional[List[str]] = None, mmap=True):
+        """
+        Loads data saved by save_binary.
+        :param columns: Only load these columns. Loads all of them by default.
+        :param mmap: Memory map the columns instead of reading them, so only the parts that are used are read from disk.
+        """
+        with open(os.path.join(dirname, _BINARY_METADATA_FILE)) as file:
+            metadata = json.load(file)
+        mmap_mode = "r" if mmap else None
+        if columns is None:
+            columns = metadata["columns"]
+        index_levels = [np.load(os.path.join(dirname, f"{_BINARY_INDEX_PREFIX}{level}.npy"), mmap_mode=mmap_mode)
+                        for level in ("frame", "index")]
+        index = pd.MultiIndex.from_arrays(index_levels, names=["frame", "index"])
+        df = pd.DataFrame({column: np.load(os.path.join(dirname, f"{column}.npy"), mmap_mode=mmap_mode)
+                           for column in columns}, index=index, copy=False)
+        return CarsData(
+            df=df,
+            fps=metadata["fps"],
+            frame_jump=metadata["frame_jump"],
+            video_path=metadata["video_path"],
+            start_frame=metadata["start_frame"],
+            timestamps=metadata.get("timestamps")
+        )
+
+    @staticmethod
+    def convert_to_binary(csv_filename: str, binary_filename: Optional[str] = None) -> str:
+        """
+        Converts a file saved in the csv format to the binary format.
+        :return: The name of the binary file, which is csv_filename + BINARY_EXTENSION by default.
+        """
+        if binary_filename is None:
+            binary_filename = csv_filename + BINARY_EXTENSION
+        CarsData.from_file(csv_filename).save_binary(binary_filename)
+        return binary_filename
+
     def pass_line_times(self, line):
         """Returns the times, in frames, that cars pass a given line.
-        line should be given in ((x1, y1), (x2, y2)) format."""
+        line should be given in ((x1, y1), (x2, y2)) format.
+        :return: The sorted times, and the ids of the objects that passed the line in increasing order."""
+        crossings = self.count_crossings(lines={"line": line})["line"]
+        pass_line_times = crossings["frame_num"].to_numpy()
+        pass_line_ids = np.sort(crossings["object_id"].to_numpy())
+        return pass_line_times, pass_line_ids.tolist()
+
+    def count_crossings(self, lines: Optional[Dict[str, Line]] = None,
+                        gates: Optional[Dict[str, Polygon]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        Finds when objects cross each of several lines, or enter or leave polygon gates.
+        The paths of the objects are only built once for all of them.
+        :param lines: Lines in ((x1, y1), (x2, y2)) format by name.
+        :param gates: Polygons by name.
+        :return: A table by name of the crossings, sorted by time, with the columns frame_num, object_id and direction.
+        For lines, only the first crossing of every object is kept. Its direction is 1 if the object moved to the right
+        of the line as seen in the image when looking from (x1, y1) to (x2, y2), and -1 if it moved to its left.
+        For gates, the first time every object entered the polygon (direction 1) and the first time it left it
+        (direction -1) are kept, so that an object that drives through the gate is counted both in and out.
+        """
+        if lines is None:
+            lines = {}
+        if gates is None:
+            gates = {}
+        if not set(lines).isdisjoint(gates):
+            raise ValueError("Lines and gates must have different names")
+        object_ids, frame_nums, x, y, same_object = self._track_segments()
+        # the segment from row i - 1 to row i ends at row i
+        end_x, end_y = x[1:], y[1:]
+
+        crossings = {}
+        if len(lines) > 0:
+            # every line against every segment at once, in an array of shape (lines, segments)
+            all_crosses = mathUtil.lines_cross(list(lines.values()), end_x, end_y, x[:-1], y[:-1])
+            all_crosses &= same_object
+            for (name, line), crosses in zip(lines.items(), all_crosses):
+                (x1, y1), (x2, y2) = line
+                right_side = (x2 - x1) * (end_y - y1) - (y2 - y1) * (end_x - x1) > 0
+                crossings[name] = _first_crossings(object_ids, frame_nums, crosses, np.where(right_side, 1, -1))
+        for name, polygon in gates.items():
+            inside = mathUtil.points_in_polygon(polygon, x, y)
+            crosses = (inside[1:] != inside[:-1]) & same_object
+            crossings[name] = _first_crossings(object_ids, frame_nums, crosses, np.where(inside[1:], 1, -1),
+                                               per_direction=True)
+        return crossings
+
+    def _track_segments(self):
+        """
+        :return: The object ids, frame numbers, x and y of all the rows, sorted by object and frame so that the path of
+        every object is a contiguous run of rows.
+        And a mask of the segments from row i - 1 to row i that are part of the path of a single object.
+        """
         df = self.df
-        pass_line_times = []
-        pass_line_ids = []
-        for object_id, object_path in df.groupby("object_id"):
-            object_path_shifted = object_path.shift()
-            x1 = object_path["x_center"]
-            y1 = object_path["y_center"]
-            x2 = object_path_shifted["x_center"]
-            y2 = object_path_shifted["y_center"]
-            object_pass_times = object_path[mathUtil.lines_cross(line, x1, y1, x2, y2)]
-            if len(object_pass_times.index) != 0:
-                pass_line_times.append(object_pass_times["frame_num"].iloc[0])
-                pass_line_ids.append(object_id)
-
-        pass_line_times = np.array(pass_line_times)
-        pass_line_times = np.sort(pass_line_times)
-
-        return pass_line_times, pass_line_ids
+        object_ids = df["object_id"].to_numpy()
+        frame_nums = df["frame_num"].to_numpy()
+        order = np.lexsort((frame_nums, object_ids))
+        object_ids = object_ids[order]
+        frame_nums = frame_nums[order]
+        x = df["x_center"].to_numpy()[order]
+        y = df["y_center"].to_numpy()[order]
+        same_object = object_ids[1:] == object_ids[:-1]
+        return object_ids, frame_nums, x, y, same_object
 
     def head(self, frame: int) -> CarsData:
         """
@@ -209,7 +494,8 @@ class CarsData:
             fps=self.fps,
             frame_jump=self.frame_jump,
             start_frame=self.start_frame,
-            video_path=self.video_path
+            video_path=self.video_path,
+            timestamps=None if self.timestamps is None else self.timestamps[:frame + 1]
         )
 
     def head_by_time(self, time_seconds: float) -> CarsData:
@@ -217,9 +503,153 @@ class CarsData:
         Returns a shortened version of this instance, containing only the first [time_seconds] seconds.
         Does not modify the current instance.
         """
+        if self.timestamps is not None:
+            return self.head(int(np.searchsorted(self.timestamps - self.timestamps[0], time_seconds, side="right")) - 1)
         return self.head(int(time_seconds * self.fps))
 
+    def frame_seconds(self, frame_nums: np.ndarray) -> np.ndarray:
+        """
+        The time of frames in seconds since the first frame, e.g. of the result of pass_line_times.
+        Uses the timestamps of the frames when there are some, since then fps is only an average.
+        """
+        frame_nums = np.asarray(frame_nums)
+        if self.timestamps is not None:
+            return self.timestamps[frame_nums] - self.timestamps[0]
+        return frame_nums / self.fps
+
+
+def _render_segment(cars_data: CarsData, out_path: str, first_frame: int, end_frame: int, prefetch: int,
+                    render_options: dict):
+    cars_data._render_video(out_path, first_frame, end_frame, prefetch, **render_options)
+
+
+def _first_crossings(object_ids: np.ndarray, frame_nums: np.ndarray, crosses: np.ndarray,
+                     directions: np.ndarray, per_direction=False) -> pd.DataFrame:
+    """
+    :param crosses: For every segment from row i - 1 to row i (sorted by object and frame), whether it crosses.
+    :param directions: The direction of every segment.
+    :param per_direction: Keep the first crossing of every object in each direction, instead of only its first one.
+    """
+    crossing_rows = np.flatnonzero(crosses) + 1
+    keys = object_ids[crossing_rows]
+    if per_direction:
+        keys = np.stack((keys, directions[crossing_rows - 1]), axis=1)
+    # the first row of each object (and direction) is its first crossing
+    _, first_crossings = np.unique(keys, return_index=True, axis=0)
+    rows = crossing_rows[first_crossings]
+    order = np.argsort(frame_nums[rows], kind="stable")
+    rows = rows[order]
+    return pd.DataFrame({
+        "frame_num": frame_nums[rows],
+        "object_id": object_ids[rows],
+        "direction": directions[rows - 1].astype(np.int8),
+    })
+
+
+class FrameView:
+    """
+    The detections of a single frame, as views into the columns of a FrameIndex.
+    Each column is an attribute, e.g. view.x_center.
+    """
+    def __init__(self, frame: int, columns: Dict[str, np.ndarray]):
+        self.frame = frame
+        self.columns = columns
+        self.__dict__.update(columns)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+
+class FrameIndex:
+    """
+    The columns of a CarsData as contiguous numpy arrays sorted by frame, together with the offsets of every frame
+    (like a CSR matrix): the detections of frame i are the rows offsets[i] to offsets[i + 1].
+    Finding the detections of a frame is then just two lookups and a slice, instead of a search of the DataFrame's index.
+    """
+    def __init__(self, df: pd.DataFrame):
+        frames = df.index.get_level_values("frame").to_numpy()
+        order = None
+        if len(frames) > 1 and np.any(frames[1:] < frames[:-1]):
+            order = np.argsort(frames, kind="stable")
+            frames = frames[order]
+        self.columns = {}
+        for column in df.columns:
+            values = df[column].to_numpy()
+            self.columns[column] = np.ascontiguousarray(values if order is None else values[order])
+        num_frames = int(frames[-1]) + 1 if len(frames) > 0 else 0
+        self.offsets = np.zeros(num_frames + 1, dtype=np.int64)
+        np.cumsum(np.bincount(frames, minlength=num_frames), out=self.offsets[1:])
+
+    def by_frame(self, frame: int) -> FrameView:
+        if 0 <= frame < len(self.offsets) - 1:
+            rows = slice(self.offsets[frame], self.offsets[frame + 1])
+        else:
+            rows = slice(0, 0)
+        return FrameView(frame, {name: column[rows] for name, column in self.columns.items()})
+
+
+class DetectionBuffer:
+    """
+    Accumulates the detections of a video frame by frame, as a growable numpy array per column, and turns them into the
+    DataFrame of a CarsData once at the end.
+    """
+    COLUMNS = {
+        "object_id": np.int32,
+        "x_center": np.float32,
+        "y_center": np.float32,
+        "width": np.float32,
+        "height": np.float32,
+        "frame_num": np.int32,
+    }
+
+    def __init__(self, capacity: int = 4096):
+        self._size = 0
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        # the position of each detection within its frame, the second level of the DataFrame's index
+        self._index = np.empty(capacity, dtype=np.int32)
+
+    def __len__(self):
+        return self._size
+
+    def append(self, frame_num: int, boxes: np.ndarray, object_ids: np.ndarray, frame_width: int, frame_height: int):
+        """
+        Adds the detections of a single frame.
+        :param boxes: rows of x_min, y_min, x_max, y_max in pixels.
+        """
+        count = len(boxes)
+        if count == 0:
+            return
+        self._reserve(self._size + count)
+        rows = slice(self._size, self._size + count)
+        columns = self._columns
+        columns["object_id"][rows] = object_ids
+        columns["x_center"][rows] = (boxes[:, 0] + boxes[:, 2]) / (2 * frame_width)
+        columns["y_center"][rows] = (boxes[:, 1] + boxes[:, 3]) / (2 * frame_height)
+        columns["width"][rows] = (boxes[:, 2] - boxes[:, 0]) / frame_width
+        columns["height"][rows] = (boxes[:, 3] - boxes[:, 1]) / frame_height
+        columns["frame_num"][rows] = frame_num
+        self._index[rows] = np.arange(count)
+        self._size += count
+
+    def _reserve(self, size: int):
+        capacity = len(self._index)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, column in self._columns.items():
+            self._columns[name] = np.resize(column, capacity)
+        self._index = np.resize(self._index, capacity)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        frame_nums = self._columns["frame_num"][:self._size]
+        index = pd.MultiIndex.from_arrays([frame_nums, self._index[:self._size]], names=["frame", "index"])
+        return pd.DataFrame({name: column[:self._size] for name, column in self._columns.items()}, index=index)
+
+
 def add_caption(image: np.array, text: str):
+    import drawingUtil
+
     if text == "":
         return
     height, width = image.shape[:2]
@@ -47,6 +47,55 @@ def select_line(image: np.array, description="", normalize=False):
             else:
                 return start_point, end_point
 
+def select_polygon(image: np.array, description="", normalize=False):
+    """
+    Lets the user click the vertices of a polygon. Right click removes the last vertex, space finishes.
+    :return: The list of vertices, or None if less than 3 were selected.
+    """
+    img_h, img_w = image.shape[:2]
+    points = []
+
+    def redraw(mouse_point=None):
+        modified_image = image.copy()
+        polygon_points = points + [mouse_point] if mouse_point is not None else points
+        if len(polygon_points) > 1:
+            cv2.polylines(modified_image, [np.array(polygon_points, dtype=np.int32)], isClosed=True,
+                          color=(0, 0, 255), thickness=2, lineType=cv2.LINE_AA)
+        for point in points:
+            cv2.circle(modified_image, center=point, radius=4, color=(0, 0, 255), thickness=cv2.FILLED)
+        cv2.imshow("select_polygon", modified_image)
+
+    def on_mouse_click(event, x, y, flags, param):
+        if event == cv2.EVENT_LBUTTONDOWN:
+            points.append((x, y))
+            redraw()
+        elif event == cv2.EVENT_RBUTTONDOWN:
+            if len(points) > 0:
+                points.pop()
+            redraw()
+        elif event == cv2.EVENT_MOUSEMOVE and len(points) > 0:
+            redraw(mouse_point=(x, y))
+
+    if description != "":
+        image = image.copy()
+        drawingUtil.draw_text(image, text=description, uv_top_left=(img_w / 2, 10), font_scale=1)
+
+    cv2.namedWindow("select_polygon", cv2.WINDOW_NORMAL)
+    cv2.setMouseCallback("select_polygon", on_mouse_click)
+    cv2.imshow("select_polygon", image)
+    while True:
+        key = cv2.waitKey()
+        if key == -1 or key == ord(" "):
+            # user closed the window
+            cv2.destroyWindow("select_polygon")
+            if len(points) < 3:
+                # the user has not selected a full polygon
+                return None
+            elif normalize:
+                return [drawingUtil.normalize(point, (img_w, img_h)) for point in points]
+            else:
+                return points
+
 if __name__ == "__main__":
     import paths
     img = cv2.imread(paths.image_path)
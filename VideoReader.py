@@ -1,11 +1,38 @@
+from __future__ import annotations
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from typing import List
+
 import PIL
 import cv2
 import numpy as np
 from PIL import Image
 
+import metrics
+
+
+"""
+Skips of at least this many frames are done by seeking instead of grabbing frame by frame.
+Seeking jumps to the closest keyframe and decodes forward from it, so it is only worth it for long skips.
+"""
+DEFAULT_SEEK_THRESHOLD = 300
+
 
 class VideoReader:
-    def __init__(self, filename: str, frame_jump = 1, duration_cutoff = None, start_frame = 0):
+    def __init__(self, filename: str, frame_jump = 1, duration_cutoff = None, start_frame = 0,
+                 seek_threshold = DEFAULT_SEEK_THRESHOLD, prefetch = 0, max_frames = None):
+        """
+        :param max_frames: Read at most this many frames (after frame jumps), e.g. to read one part of a video.
+        :param prefetch: The number of frames that are decoded ahead on a background thread, while the caller is
+        busy with the current frame. 0 decodes on the caller's thread.
+        When prefetching, the yielded frames are reused buffers: a frame is only valid until the next one is requested,
+        so it should be copied if it's needed for longer.
+        """
         self.filename = filename
         self._capture = cv2.VideoCapture(filename)
         video_frame_count = self._capture.get(cv2.CAP_PROP_FRAME_COUNT)
@@ -20,42 +47,151 @@ class VideoReader:
         else:
             self.num_frames = int(video_frame_count // frame_jump)
             self.duration = video_duration
+        if max_frames is not None and max_frames < self.num_frames:
+            self.num_frames = max_frames
+            self.duration = max_frames / self.fps
 
         self.frame_width = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
         self.start_frame = start_frame
+        self.seek_threshold = seek_threshold
+        self.prefetch = prefetch
 
+    def _skip_frames(self, n: int) -> bool:
+        """
+        Advances the video by n frames without decoding them into images.
+        Long skips seek to the target position, short skips only grab the frames.
+        :return: False if the video ended while skipping.
+        """
+        if n <= 0:
+            return True
+        if n >= self.seek_threshold and self._seek(n):
+            return True
+        capture = self._capture
+        for _ in range(n):
+            if not capture.isOpened() or not capture.grab():
+                return False
+        return True
 
+    def _seek(self, n: int) -> bool:
+        """
+        Tries to move the video n frames forward by setting its position.
+        Some sources (like live streams) can't seek, or seek inaccurately.
+        In that case the position is restored, and False is returned so that the caller can grab the frames instead.
+        """
+        capture = self._capture
+        position = capture.get(cv2.CAP_PROP_POS_FRAMES)
+        target = position + n
+        if capture.set(cv2.CAP_PROP_POS_FRAMES, target) and capture.get(cv2.CAP_PROP_POS_FRAMES) == target:
+            return True
+        capture.set(cv2.CAP_PROP_POS_FRAMES, position)
+        return False
 
     def iter_frames(self):
+        if self.prefetch > 0:
+            return self._iter_frames_prefetched(convert_rgb=False)
+        return self._iter_frames()
+
+    def release(self):
+        """
+        Closes the video without reading it. Reading the frames closes it when they run out.
+        """
+        self._capture.release()
+
+    def _iter_frames(self, next_buffer=None):
+        """
+        Decodes the frames on the current thread.
+        :param next_buffer: Called before each frame is decoded. It may return an array of the right size to decode into,
+        or None to allocate a new one.
+        """
         capture = self._capture
         try:
             # skip the first n frames
-            for i in range(self.start_frame):
-                if not capture.isOpened():
-                    return
-                found_frame, frame = capture.read()
-                if not found_frame:
-                    return
+            if not capture.isOpened() or not self._skip_frames(self.start_frame):
+                return
             # iterate through the frames
             for i in range(self.num_frames):
                 if not capture.isOpened():
                     return
                 # skip (frame_jump - 1) frames
-                for _ in range(self.frame_jump - 1):
-                    found_frame, frame = capture.read()
-                    if not found_frame:
-                        return
+                if not self._skip_frames(self.frame_jump - 1):
+                    return
                 # yield the next frame
-                found_frame, frame = capture.read()
+                with metrics.timer("decode"):
+                    found_frame, frame = capture.read(next_buffer() if next_buffer is not None else None)
                 if not found_frame:
                     return
+                metrics.count("frames_decoded")
                 yield frame
         finally:
             capture.release()
 
+    def _iter_frames_prefetched(self, convert_rgb: bool):
+        """
+        Yields frames that are decoded (and optionally converted to RGB) on a background thread.
+        The frames are decoded into a ring of prefetch + 1 buffers. A buffer goes back into the ring once the next frame is
+        requested, and the decoding thread waits when there are no free buffers.
+        """
+        ready_frames = queue.Queue()
+        free_buffers = queue.Queue()
+        for _ in range(self.prefetch + 1):
+            # buffers are allocated by the first decode into them
+            free_buffers.put(None)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._prefetch_frames,
+                                  args=(ready_frames, free_buffers, stop, convert_rgb),
+                                  name="VideoReader prefetch",
+                                  daemon=True)
+        thread.start()
+        try:
+            while True:
+                frame = ready_frames.get()
+                if frame is _END_OF_VIDEO:
+                    return
+                if isinstance(frame, BaseException):
+                    raise frame
+                yield frame
+                free_buffers.put(frame)
+        finally:
+            # the consumer may stop early, in which case the decoding thread has to be stopped as well.
+            stop.set()
+            thread.join()
+
+    def _prefetch_frames(self, ready_frames: queue.Queue, free_buffers: queue.Queue, stop: threading.Event,
+                         convert_rgb: bool):
+        def take_free_buffer():
+            while not stop.is_set():
+                try:
+                    return free_buffers.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise _PrefetchStopped()
+
+        if convert_rgb:
+            # decode into a single scratch buffer, and convert from it into the ring
+            bgr_frame = None
+            frames = self._iter_frames(next_buffer=lambda: bgr_frame)
+        else:
+            frames = self._iter_frames(next_buffer=take_free_buffer)
+        try:
+            for frame in frames:
+                if convert_rgb:
+                    bgr_frame = frame
+                    frame = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB, dst=take_free_buffer())
+                ready_frames.put(frame)
+            ready_frames.put(_END_OF_VIDEO)
+        except _PrefetchStopped:
+            pass
+        except BaseException as e:
+            ready_frames.put(e)
+        finally:
+            frames.close()
+
     def iter_frames_rgb(self):
+        if self.prefetch > 0:
+            yield from self._iter_frames_prefetched(convert_rgb=True)
+            return
         for frame in self.iter_frames():
             yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
@@ -66,23 +202,380 @@ class VideoReader:
 
 
     def to_array(self):
-        return np.stack(list(self.iter_frames()), axis=0)
+        # prefetched frames are reused buffers, so they need to be copied
+        return np.stack([frame.copy() if self.prefetch > 0 else frame for frame in self.iter_frames()], axis=0)
+
+
+class _PrefetchStopped(Exception):
+    pass
+
+
+_END_OF_VIDEO = object()
+
+
+"""
+Live streams that don't give a frame for this many seconds are reopened.
+"""
+DEFAULT_STALL_TIMEOUT = 10.0
+
+
+class LiveVideoReader:
+    """
+    Reads a live stream (like an HLS playlist or an rtsp url) with the same interface as VideoReader, without downloading
+    it first.
+    A background thread reads the stream as it arrives and keeps only the latest frame. When the caller is slower than the
+    stream, the frames it didn't get to are dropped, so it always gets a recent frame instead of falling further and further
+    behind. Because of that frame_jump and fps are measured rather than fixed, and the wall clock time of every frame that
+    was given to the caller is recorded in timestamps.
+    If the stream stalls or ends, it's reopened.
+    """
+    def __init__(self, filename: str, duration_cutoff = None, stall_timeout = DEFAULT_STALL_TIMEOUT,
+                 reconnect_delay = 1.0, max_reconnects = None, pace = False):
+        """
+        :param duration_cutoff: Stop after this many seconds. By default, reads until the stream can't be reopened.
+        :param stall_timeout: Seconds without a frame after which the stream is reopened.
+        :param max_reconnects: The number of times the stream may be reopened. None reopens it forever.
+        :param pace: Read at most the stream's frame rate. A live stream is paced by its source, but a local file standing
+        in for one (for testing) would otherwise be read as fast as it can be decoded.
+        """
+        self.filename = filename
+        self.duration = duration_cutoff
+        self.stall_timeout = stall_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnects = max_reconnects
+        self.pace = pace
+
+        self._capture = self._open()
+        if not self._capture.isOpened():
+            raise IOError(f"Cannot open the stream {filename}")
+        self.source_fps = self._capture.get(cv2.CAP_PROP_FPS)
+        if not self.source_fps > 0:
+            self.source_fps = 30
+        self.frame_width = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frame_height = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # the number of frames isn't known in advance
+        self.num_frames = None
+        self.start_frame = 0
+        # the frames are never reused buffers
+        self.prefetch = 0
+
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.reconnects = 0
+        self.timestamps = []
+
+    @property
+    def frame_jump(self) -> int:
+        """
+        The average number of frames of the stream per frame that was given to the caller, so far.
+        """
+        if len(self.timestamps) == 0:
+            return 1
+        return max(1, round(self.frames_read / len(self.timestamps)))
+
+    @property
+    def fps(self) -> int:
+        return int(self.source_fps / self.frame_jump)
+
+    def _open(self):
+        timeout = int(self.stall_timeout * 1000)
+        return cv2.VideoCapture(self.filename, cv2.CAP_FFMPEG,
+                                [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout, cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout])
+
+    def iter_timestamped_frames(self):
+        """
+        Yields the wall clock time that each frame was read at (as given by time.time()), and the frame.
+        """
+        latest_frame = _LatestFrame()
+        stop = threading.Event()
+        thread = threading.Thread(target=self._read_stream, args=(latest_frame, stop), name="LiveVideoReader",
+                                  daemon=True)
+        thread.start()
+        start_time = time.monotonic()
+        try:
+            while self.duration is None or time.monotonic() - start_time < self.duration:
+                item = latest_frame.take()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                timestamp, frame = item
+                self.timestamps.append(timestamp)
+                yield timestamp, frame
+        finally:
+            stop.set()
+            # a read that is stuck on the network times out after stall_timeout
+            thread.join(self.stall_timeout)
+            self.frames_dropped = latest_frame.dropped
+
+    def _read_stream(self, latest_frame: _LatestFrame, stop: threading.Event):
+        capture = self._capture
+        frame_interval = 1 / self.source_fps
+        next_frame_time = time.monotonic()
+        try:
+            while not stop.is_set():
+                with metrics.timer("decode"):
+                    found_frame, frame = capture.read()
+                if not found_frame:
+                    # the stream stalled or ended
+                    capture.release()
+                    if self.max_reconnects is not None and self.reconnects >= self.max_reconnects:
+                        break
+                    self.reconnects += 1
+                    stop.wait(self.reconnect_delay)
+                    capture = self._capture = self._open()
+                    next_frame_time = time.monotonic()
+                    continue
+                self.frames_read += 1
+                metrics.count("frames_decoded")
+                latest_frame.put((time.time(), frame))
+                if self.pace:
+                    next_frame_time += frame_interval
+                    stop.wait(max(0.0, next_frame_time - time.monotonic()))
+        except BaseException as e:
+            latest_frame.put(e)
+        finally:
+            capture.release()
+            latest_frame.close()
+
+    def iter_frames(self):
+        for _, frame in self.iter_timestamped_frames():
+            yield frame
+
+    def iter_frames_rgb(self):
+        for frame in self.iter_frames():
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def iter_frames_pil(self):
+        for frame in self.iter_frames_rgb():
+            yield Image.fromarray(frame)
+
+
+class _LatestFrame:
+    """
+    Holds only the newest item, which the reading thread replaces and the caller takes.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def take(self):
+        """
+        Waits for an item that wasn't taken yet.
+        :return: None once there are no more items.
+        """
+        with self._condition:
+            while self._item is None and not self._closed:
+                self._condition.wait()
+            item, self._item = self._item, None
+            return item
+
 
 class VideoWriter:
+    """
+    Writes frames to a video file, with one of two backends:
+    "opencv" encodes with cv2.VideoWriter as mp4v.
+    "ffmpeg" pipes the raw frames to an ffmpeg process, which can use better codecs (like h264) and settings.
+    Can be used as a context manager, which closes it even if writing the frames fails, so that the encoding thread and
+    the ffmpeg process are stopped.
+    """
+    def __init__(self, filename, fps, frame_size, backend = "opencv", codec = "libx264", crf = 23, preset = "veryfast",
+                 queue_size = 0):
+        """
+        :param frame_size: (width, height)
+        :param codec: The ffmpeg codec, only used by the ffmpeg backend, like crf and preset. crf and preset are skipped if
+        they are None, for codecs that don't have them.
+        :param queue_size: If more than 0, frames are encoded on a background thread while the caller prepares the next
+        ones, with up to queue_size frames waiting. The frames must not be changed after they are written.
+        """
+        if backend == "opencv":
+            encoder = _OpenCvEncoder(filename, fps, frame_size)
+        elif backend == "ffmpeg":
+            encoder = _FfmpegEncoder(filename, fps, frame_size, codec, crf, preset)
+        else:
+            raise ValueError(f"Unknown video writer backend: {backend}")
+        self.frame_size = tuple(frame_size)
+        self._encoder = _AsyncEncoder(encoder, queue_size) if queue_size > 0 else encoder
+
+    def write(self, image):
+        """
+        :param image: An RGB PIL image or numpy array, which is converted to BGR.
+        """
+        self.write_bgr(cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR))
+
+    def write_bgr(self, frame: np.ndarray):
+        """
+        Writes a frame as opencv reads it, without converting or copying it.
+        :param frame: A BGR numpy array.
+        """
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            raise ValueError(f"Expected a frame of size {self.frame_size}, got {(frame.shape[1], frame.shape[0])}")
+        self._encoder.write(frame)
+
+    def close(self):
+        self._encoder.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except Exception:
+            # the error that stopped the writing says more than the error of closing the unfinished video
+            if exc_type is None:
+                raise
+
+
+class _OpenCvEncoder:
     def __init__(self, filename, fps, frame_size):
         self.video_writer = cv2.VideoWriter(filename,
                                        cv2.VideoWriter_fourcc(*'mp4v'),
                                        fps,
                                        frame_size)
-    def write(self, image: PIL.Image):
-        image = np.array(image)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        self.video_writer.write(image)
+        if not self.video_writer.isOpened():
+            raise IOError(f"Cannot write to video {filename}")
 
-    def close(self):
+    @metrics.timed("encode")
+    def write(self, frame: np.ndarray):
+        self.video_writer.write(frame)
+
+    def release(self):
         self.video_writer.release()
 
 
+class _FfmpegEncoder:
+    def __init__(self, filename, fps, frame_size, codec, crf, preset):
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise FileNotFoundError("The ffmpeg video writer backend requires ffmpeg to be installed")
+        width, height = frame_size
+        command = [ffmpeg, "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                   "-c:v", codec]
+        if crf is not None:
+            command += ["-crf", str(crf)]
+        if preset is not None:
+            command += ["-preset", preset]
+        # the pixel format that players support
+        command += ["-pix_fmt", "yuv420p", filename]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    @metrics.timed("encode")
+    def write(self, frame: np.ndarray):
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self.release()
+
+    def release(self):
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        error = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {error.decode(errors='replace')}")
+
+
+class _AsyncEncoder:
+    """
+    Runs another encoder on a background thread, with a bounded queue of frames waiting to be encoded.
+    Errors of the encoder are raised by the next call to write or release.
+    """
+    def __init__(self, encoder, queue_size: int):
+        self.encoder = encoder
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._encode_frames, name="VideoWriter encoder", daemon=True)
+        self._thread.start()
+
+    def _encode_frames(self):
+        while True:
+            frame = self._frames.get()
+            if frame is _END_OF_VIDEO:
+                return
+            if self._error is not None:
+                # keep emptying the queue, so that the caller doesn't wait for room forever
+                continue
+            try:
+                self.encoder.write(frame)
+            except BaseException as e:
+                self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, frame: np.ndarray):
+        self._raise_error()
+        self._frames.put(frame)
+
+    def release(self):
+        if not self._thread.is_alive():
+            return
+        self._frames.put(_END_OF_VIDEO)
+        self._thread.join()
+        try:
+            self._raise_error()
+        finally:
+            self.encoder.release()
+
+
+def concat_videos(filenames: List[str], out_filename: str):
+    """
+    Joins videos of the same size and codec one after the other.
+    If ffmpeg is installed, the encoded frames are copied as they are. Otherwise they are decoded and encoded again with
+    opencv, which is much slower.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        list_filename = out_filename + ".concat.txt"
+        with open(list_filename, "w") as file:
+            for filename in filenames:
+                escaped_filename = os.path.abspath(filename).replace("'", "'\\''")
+                file.write(f"file '{escaped_filename}'\n")
+        try:
+            subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_filename,
+                            "-c", "copy", out_filename], check=True)
+        finally:
+            os.remove(list_filename)
+        return
+
+    video_writer = None
+    try:
+        for filename in filenames:
+            capture = cv2.VideoCapture(filename)
+            if video_writer is None:
+                frame_size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+                video_writer = cv2.VideoWriter(out_filename, cv2.VideoWriter_fourcc(*'mp4v'),
+                                               capture.get(cv2.CAP_PROP_FPS), frame_size)
+            found_frame, frame = capture.read()
+            while found_frame:
+                video_writer.write(frame)
+                found_frame, frame = capture.read(frame)
+            capture.release()
+    finally:
+        if video_writer is not None:
+            video_writer.release()
+
+
 def open_video(filename: str):
     """
     Old method, no longer used
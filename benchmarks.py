@@ -0,0 +1,561 @@
+"""
+Throughput benchmarks for the detection pipeline.
+Run with e.g. `python benchmarks.py batch_size --video media/traffic_cam/ahihud_from_12_00.mp4`, or
+`python benchmarks.py suite --output results.json` for every stage on a synthetic video.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+import paths
+from VideoReader import VideoReader
+
+
+def benchmark_batch_sizes(video_path: str, batch_sizes: Sequence[int] = (1, 4, 8, 16), duration: float = 30,
+                          frame_jump: int = 1, model=None) -> Dict[int, float]:
+    """
+    Runs detect_from_video on the first [duration] seconds of the video with each batch size.
+    :return: The frames per second of every batch size.
+    """
+    from detect_sort import detect_from_video
+    from model import load_model
+    if model is None:
+        model = load_model(confidence_threshold=0.1, iou_threshold=0.3, class_agnostic=True)
+
+    # warm up, so that the first batch size doesn't pay for cuda initialization
+    detect_from_video(model, VideoReader(video_path, frame_jump=frame_jump, duration_cutoff=1))
+
+    frames_per_second = {}
+    for batch_size in batch_sizes:
+        video = VideoReader(video_path, frame_jump=frame_jump, duration_cutoff=duration)
+        start_time = time.perf_counter()
+        detect_from_video(model, video, batch_size=batch_size)
+        elapsed = time.perf_counter() - start_time
+        frames_per_second[batch_size] = video.num_frames / elapsed
+        print(f"batch size {batch_size}: {frames_per_second[batch_size]:.2f} fps")
+    return frames_per_second
+
+
+def compare_onnx(video_path: str, onnx_path: str, model_size: str = "x", num_frames: int = 100, frame_jump: int = 30,
+                 match_iou: float = 0.9) -> Dict[str, float]:
+    """
+    Compares OnnxModel with the torch.hub model it was exported from, on frames sampled from the video.
+    Reports the fraction of torch detections that the onnx model also finds (a box with IoU >= match_iou),
+    and the frames per second of both models.
+    """
+    from model import load_model
+    from onnx_model import OnnxModel
+    from sort import iou_batch
+
+    frames = list(itertools.islice(VideoReader(video_path, frame_jump=frame_jump).iter_frames_rgb(), num_frames))
+    torch_model = load_model(confidence_threshold=0.1, iou_threshold=0.3, class_agnostic=True, model_size=model_size)
+    onnx_model = OnnxModel(onnx_path, confidence_threshold=0.1, iou_threshold=0.3, class_agnostic=True)
+
+    torch_detections, torch_fps = _run_timed(torch_model, frames)
+    onnx_detections, onnx_fps = _run_timed(onnx_model, frames)
+
+    num_torch_boxes = 0
+    num_matched_boxes = 0
+    for torch_boxes, onnx_boxes in zip(torch_detections, onnx_detections):
+        num_torch_boxes += len(torch_boxes)
+        if len(torch_boxes) > 0 and len(onnx_boxes) > 0:
+            ious = iou_batch(torch_boxes[:, :4], onnx_boxes[:, :4])
+            num_matched_boxes += np.sum(ious.max(axis=1) >= match_iou)
+    results = {
+        "matched_fraction": num_matched_boxes / max(num_torch_boxes, 1),
+        "torch_fps": torch_fps,
+        "onnx_fps": onnx_fps,
+    }
+    print(f"{num_matched_boxes}/{num_torch_boxes} torch detections matched by onnx (IoU >= {match_iou})")
+    print(f"torch: {torch_fps:.2f} fps, onnx: {onnx_fps:.2f} fps")
+    return results
+
+
+def _run_timed(model, frames: List[np.ndarray]):
+    """
+    Runs the model on each frame separately.
+    :return: The detections of each frame as numpy arrays, and the frames per second.
+    """
+    from detect_sort import _to_numpy
+    model(frames[0])  # warm up
+    detections = []
+    start_time = time.perf_counter()
+    for frame in frames:
+        detections.append(_to_numpy(model([frame]).pred[0]))
+    elapsed = time.perf_counter() - start_time
+    return detections, len(frames) / elapsed
+
+
+def benchmark_accumulation(num_frames: int = 2000, detections_per_frame: Sequence[int] = (10, 50, 200),
+                           frame_size=(1920, 1080)) -> Dict[int, Dict[str, float]]:
+    """
+    Compares the cost per frame of collecting tracker output into per-frame DataFrames that are concatenated at the end,
+    with appending it to a DetectionBuffer.
+    :return: Microseconds per frame of both methods, for each number of detections per frame.
+    """
+    import pandas as pd
+    from CarsData import DetectionBuffer
+
+    frame_width, frame_height = frame_size
+    rng = np.random.default_rng(0)
+    results = {}
+    for count in detections_per_frame:
+        top_left = rng.uniform(0, 1000, size=(num_frames, count, 2))
+        size = rng.uniform(20, 200, size=(num_frames, count, 2))
+        object_ids = np.broadcast_to(np.arange(count, dtype=float), (num_frames, count))
+        # the output of Sort.update: rows of x_min, y_min, x_max, y_max, object_id
+        tracker_output = np.concatenate((top_left, top_left + size, object_ids[..., None]), axis=2)
+
+        start_time = time.perf_counter()
+        detections_by_frame = []
+        for frame_num, detections in enumerate(tracker_output):
+            detections = pd.DataFrame(detections, columns=["x_min", "y_min", "x_max", "y_max", "object_id"])
+            detections_df = pd.DataFrame.from_dict({
+                "object_id": detections["object_id"],
+                "x_center": (detections["x_min"] + detections["x_max"]) / (2 * frame_width),
+                "y_center": (detections["y_min"] + detections["y_max"]) / (2 * frame_height),
+                "width": (detections["x_max"] - detections["x_min"]) / frame_width,
+                "height": (detections["y_max"] - detections["y_min"]) / frame_height,
+                "frame_num": frame_num
+            })
+            detections_by_frame.append(detections_df.astype({"object_id": int}))
+        pd.concat(detections_by_frame, keys=list(range(len(detections_by_frame))), names=["frame", "index"])
+        pandas_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        detection_buffer = DetectionBuffer()
+        for frame_num, detections in enumerate(tracker_output):
+            detection_buffer.append(frame_num, detections[:, :4], detections[:, 4], frame_width, frame_height)
+        detection_buffer.to_dataframe()
+        buffer_seconds = time.perf_counter() - start_time
+
+        results[count] = {
+            "pandas_us_per_frame": pandas_seconds / num_frames * 1e6,
+            "buffer_us_per_frame": buffer_seconds / num_frames * 1e6,
+        }
+        print(f"{count} detections per frame: pandas {results[count]['pandas_us_per_frame']:.1f} us/frame, "
+              f"buffer {results[count]['buffer_us_per_frame']:.1f} us/frame")
+    return results
+
+
+def synthetic_cars_data(num_frames: int = 18000, detections_per_frame: int = 30, seed: int = 0):
+    """
+    A CarsData with random detections, the size of a 10 minute video at 30 fps.
+    """
+    from CarsData import CarsData, DetectionBuffer
+
+    rng = np.random.default_rng(seed)
+    detection_buffer = DetectionBuffer()
+    for frame_num in range(num_frames):
+        top_left = rng.uniform(0, 1800, size=(detections_per_frame, 2))
+        boxes = np.concatenate((top_left, top_left + rng.uniform(20, 120, size=(detections_per_frame, 2))), axis=1)
+        object_ids = frame_num // 100 * detections_per_frame + np.arange(detections_per_frame)
+        detection_buffer.append(frame_num, boxes, object_ids, 1920, 1080)
+    return CarsData(df=detection_buffer.to_dataframe(), fps=30, video_path="synthetic.mp4", frame_jump=1,
+                    start_frame=0)
+
+
+def benchmark_storage(num_frames: int = 18000, detections_per_frame: int = 30) -> Dict[str, float]:
+    """
+    Compares saving and loading CarsData as csv and in the binary format.
+    :return: Seconds of every operation.
+    """
+    import shutil
+    import tempfile
+    from CarsData import BINARY_EXTENSION, CarsData
+
+    cars_data = synthetic_cars_data(num_frames, detections_per_frame)
+    directory = tempfile.mkdtemp()
+    csv_filename = os.path.join(directory, "data.txt")
+    binary_filename = os.path.join(directory, "data" + BINARY_EXTENSION)
+    operations = {
+        "save_csv": lambda: cars_data.save_data(csv_filename),
+        "save_binary": lambda: cars_data.save_data(binary_filename),
+        "load_csv": lambda: CarsData.from_file(csv_filename),
+        "load_binary": lambda: CarsData.from_file(binary_filename),
+        "load_csv_two_columns": lambda: CarsData.from_file(csv_filename, columns=["object_id", "frame_num"]),
+        "load_binary_two_columns": lambda: CarsData.from_file(binary_filename, columns=["object_id", "frame_num"]),
+    }
+    results = {}
+    try:
+        for name, operation in operations.items():
+            start_time = time.perf_counter()
+            operation()
+            results[name] = time.perf_counter() - start_time
+            print(f"{name}: {results[name]:.3f} seconds")
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def synthetic_tracks(num_tracks: int = 10000, num_frames: int = 18000, seed: int = 0):
+    """
+    A CarsData of objects that move in straight lines across the frame, each for 1 to 5 seconds at 30 fps.
+    """
+    import pandas as pd
+    from CarsData import CarsData
+
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(30, 150, size=num_tracks)
+    start_frames = rng.integers(0, num_frames - lengths)
+    starts = rng.uniform(0, 1, size=(num_tracks, 2))
+    velocities = rng.uniform(-1, 1, size=(num_tracks, 2)) / lengths[:, None]
+
+    object_ids = np.repeat(np.arange(num_tracks), lengths)
+    steps = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    frame_nums = np.repeat(start_frames, lengths) + steps
+    centers = starts[object_ids] + velocities[object_ids] * steps[:, None]
+    order = np.argsort(frame_nums, kind="stable")
+    object_ids, frame_nums, centers = object_ids[order], frame_nums[order], centers[order]
+    # the position of each detection within its frame
+    frame_offsets = np.searchsorted(frame_nums, frame_nums)
+    index = pd.MultiIndex.from_arrays([frame_nums, np.arange(len(frame_nums)) - frame_offsets], names=["frame", "index"])
+    df = pd.DataFrame({
+        "object_id": object_ids.astype(np.int32),
+        "x_center": centers[:, 0].astype(np.float32),
+        "y_center": centers[:, 1].astype(np.float32),
+        "width": np.full(len(object_ids), 0.05, dtype=np.float32),
+        "height": np.full(len(object_ids), 0.05, dtype=np.float32),
+        "frame_num": frame_nums.astype(np.int32),
+    }, index=index)
+    return CarsData(df=df, fps=30, video_path="synthetic.mp4", frame_jump=1, start_frame=0)
+
+
+def _pass_line_times_groupby(cars_data, line):
+    """
+    The previous implementation of CarsData.pass_line_times, which loops over the objects.
+    """
+    import mathUtil
+
+    pass_line_times = []
+    pass_line_ids = []
+    for object_id, object_path in cars_data.df.groupby("object_id"):
+        object_path_shifted = object_path.shift()
+        x1 = object_path["x_center"]
+        y1 = object_path["y_center"]
+        x2 = object_path_shifted["x_center"]
+        y2 = object_path_shifted["y_center"]
+        object_pass_times = object_path[mathUtil.lines_cross(line, x1, y1, x2, y2)]
+        if len(object_pass_times.index) != 0:
+            pass_line_times.append(object_pass_times["frame_num"].iloc[0])
+            pass_line_ids.append(object_id)
+    return np.sort(np.array(pass_line_times)), pass_line_ids
+
+
+def benchmark_pass_line_times(num_tracks: int = 10000, line=((0.2, 0.3), (0.8, 0.6))) -> Dict[str, float]:
+    """
+    Compares the speed of CarsData.pass_line_times with the previous loop over the objects (test_CarsData checks that
+    they agree).
+    :return: Seconds of both implementations.
+    """
+    cars_data = synthetic_tracks(num_tracks)
+
+    start_time = time.perf_counter()
+    times, ids = cars_data.pass_line_times(line)
+    vectorized_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    expected_times, expected_ids = _pass_line_times_groupby(cars_data, line)
+    groupby_seconds = time.perf_counter() - start_time
+
+    print(f"{num_tracks} tracks, {len(ids)} crossings: vectorized {vectorized_seconds:.3f} seconds, "
+          f"groupby {groupby_seconds:.3f} seconds")
+    return {"vectorized_seconds": vectorized_seconds, "groupby_seconds": groupby_seconds}
+
+
+def benchmark_writers(num_frames: int = 300, frame_size: Tuple[int, int] = (1920, 1080), queue_size: int = 8,
+                      draw_milliseconds: float = 0) -> Dict[str, float]:
+    """
+    Compares the frames per second of writing a video with each VideoWriter backend, with and without encoding on a
+    background thread.
+    :param draw_milliseconds: Time spent preparing every frame before it's written (like drawing in save_video), which
+    the background thread can overlap with encoding.
+    """
+    import shutil
+    import tempfile
+    from VideoReader import VideoWriter
+
+    width, height = frame_size
+    # a moving gradient, so that the encoder has some work to do
+    gradient = np.add.outer(np.arange(height), np.arange(width)).astype(np.uint8)
+    frames = [np.repeat(np.roll(gradient, 8 * i, axis=1)[..., None], 3, axis=2) for i in range(16)]
+
+    backends = ["opencv"] + (["ffmpeg"] if shutil.which("ffmpeg") is not None else [])
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        for backend, queue in itertools.product(backends, (0, queue_size)):
+            name = f"{backend}{' async' if queue > 0 else ''}"
+            video_writer = VideoWriter(os.path.join(directory, f"{backend}_{queue}.mp4"), 30, frame_size,
+                                       backend=backend, queue_size=queue)
+            start_time = time.perf_counter()
+            for i in range(num_frames):
+                if draw_milliseconds > 0:
+                    time.sleep(draw_milliseconds / 1000)
+                video_writer.write_bgr(frames[i % len(frames)])
+            video_writer.close()
+            results[name] = num_frames / (time.perf_counter() - start_time)
+            print(f"{name}: {results[name]:.1f} fps")
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def synthetic_traffic(num_frames: int = 900, frame_size: Tuple[int, int] = (1280, 720), num_cars: int = 40,
+                      seed: int = 0) -> List[np.ndarray]:
+    """
+    The boxes of cars that drive across the frame in straight lines, each for 2 to 10 seconds at 30 fps.
+    :param num_cars: The number of cars over the whole video, so the number in each frame grows with it.
+    :return: The boxes of each frame, rows of x_min, y_min, x_max, y_max, object_id in pixels.
+    """
+    width, height = frame_size
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(60, 300, size=num_cars)
+    start_frames = rng.integers(-lengths // 2, num_frames)
+    sizes = rng.uniform(0.04, 0.1, size=(num_cars, 1)) * [width, height]
+    # from one side of the frame to the other, with a random height on both
+    starts = np.stack((np.where(rng.random(num_cars) < 0.5, -sizes[:, 0], width), rng.uniform(0, height, num_cars)), 1)
+    ends = np.stack((width - starts[:, 0] - sizes[:, 0], rng.uniform(0, height, num_cars)), 1)
+    velocities = (ends - starts) / lengths[:, None]
+
+    boxes = []
+    for frame_num in range(num_frames):
+        steps = frame_num - start_frames
+        visible = np.flatnonzero((steps >= 0) & (steps < lengths))
+        top_left = starts[visible] + velocities[visible] * steps[visible, None]
+        boxes.append(np.concatenate((top_left, top_left + sizes[visible], visible[:, None]), axis=1))
+    return boxes
+
+
+def synthetic_detections(boxes: List[np.ndarray], noise: float = 2, miss_rate: float = 0.05,
+                         seed: int = 0) -> List[np.ndarray]:
+    """
+    Detections of the boxes of synthetic_traffic as a model would give them: moved by noise pixels, in a random order,
+    and with a fraction of them missing.
+    :return: The detections of each frame, rows of x_min, y_min, x_max, y_max, confidence, class.
+    """
+    rng = np.random.default_rng(seed)
+    detections = []
+    for frame_boxes in boxes:
+        frame_boxes = frame_boxes[rng.random(len(frame_boxes)) >= miss_rate]
+        coordinates = frame_boxes[:, :4] + rng.normal(0, noise, size=(len(frame_boxes), 4))
+        confidence = rng.uniform(0.3, 1, size=(len(frame_boxes), 1))
+        frame_detections = np.concatenate((coordinates, confidence, np.full_like(confidence, 2)), axis=1)
+        detections.append(frame_detections[rng.permutation(len(frame_detections))].astype(np.float32))
+    return detections
+
+
+def write_synthetic_video(filename: str, boxes: List[np.ndarray], frame_size: Tuple[int, int] = (1280, 720),
+                          fps: float = 30):
+    """
+    Writes a video of the boxes of synthetic_traffic as red rectangles on a gray road, which StubModel can detect.
+    """
+    import cv2
+    from VideoReader import VideoWriter
+
+    width, height = frame_size
+    background = np.empty((height, width, 3), dtype=np.uint8)
+    # a gradient with lane markings, so that the frames aren't trivial to encode
+    background[:] = (60 + 40 * np.arange(height) // height)[:, None, None]
+    for y in range(height // 8, height, height // 4):
+        background[y:y + 2, ::40] = 200
+    video_writer = VideoWriter(filename, fps, frame_size)
+    for frame_boxes in boxes:
+        frame = background.copy()
+        for x_min, y_min, x_max, y_max in frame_boxes[:, :4].astype(int).tolist():
+            cv2.rectangle(frame, (x_min, y_min), (x_max, y_max), (30, 30, 220), thickness=-1)
+        video_writer.write_bgr(frame)
+    video_writer.close()
+
+
+class StubModel:
+    """
+    Finds the red rectangles of write_synthetic_video, instead of running a real model, so that the rest of the
+    pipeline can be benchmarked without torch. Its output has the same format as ImprovedModel.
+    """
+    class Detections:
+        def __init__(self, pred: List[np.ndarray]):
+            self.pred = pred
+
+    def __init__(self, min_area: int = 20):
+        self.min_area = min_area
+        self.description = {"type": "stub", "min_area": min_area}
+
+    def __call__(self, images):
+        """
+        :param images: An RGB image or a list of them.
+        """
+        import cv2
+
+        if not isinstance(images, list):
+            images = [images]
+        pred = []
+        for image in images:
+            mask = ((image[..., 0] > 150) & (image[..., 2] < 100)).astype(np.uint8)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            x, y, w, h, area = stats[1:].T
+            found = area >= self.min_area
+            rows = np.stack((x, y, x + w, y + h, np.ones_like(x), np.full_like(x, 2)), axis=1)[found]
+            pred.append(rows.astype(np.float32))
+        return StubModel.Detections(pred)
+
+
+def benchmark_suite(num_frames: int = 900, frame_size: Tuple[int, int] = (1280, 720), num_cars: int = 40,
+                    seed: int = 0, output: str = None) -> dict:
+    """
+    Times every stage of the pipeline separately on a synthetic video and synthetic detections, which are generated the
+    same way for a given seed, so that runs on different versions can be compared.
+    :param num_cars: The density of the traffic, see synthetic_traffic.
+    :param output: A json file to write the results to.
+    :return: The settings of the run, its environment, and for every stage its seconds and items per second.
+    """
+    import shutil
+    import tempfile
+    import cv2
+    import pandas as pd
+    from CarsData import BINARY_EXTENSION, CarsData, DetectionBuffer, ObjectMarker
+    from sort import Sort, VectorizedSort
+
+    width, height = frame_size
+    boxes = synthetic_traffic(num_frames, frame_size, num_cars, seed)
+    detections = synthetic_detections(boxes, seed=seed)
+    num_detections = sum(len(frame_detections) for frame_detections in detections)
+    stages = {}
+
+    def record(name: str, seconds: float, items: int, unit: str):
+        stages[name] = {"seconds": seconds, unit: items, f"{unit}_per_second": items / seconds}
+        print(f"{name}: {seconds:.3f} seconds, {items / seconds:.1f} {unit}/second")
+
+    directory = tempfile.mkdtemp()
+    try:
+        video_path = os.path.join(directory, "synthetic.mp4")
+        write_synthetic_video(video_path, boxes, frame_size)
+
+        start_time = time.perf_counter()
+        for _ in VideoReader(video_path).iter_frames():
+            pass
+        record("read", time.perf_counter() - start_time, num_frames, "frames")
+
+        # only the model is timed, not the decoding of its frames
+        model = StubModel()
+        inference_seconds = 0
+        for frame in VideoReader(video_path).iter_frames_rgb():
+            start_time = time.perf_counter()
+            model([frame])
+            inference_seconds += time.perf_counter() - start_time
+        record("inference", inference_seconds, num_frames, "frames")
+
+        for name, tracker_class in [("sort", Sort), ("vectorized_sort", VectorizedSort)]:
+            motion_tracker = tracker_class(max_age=10)
+            start_time = time.perf_counter()
+            tracker_output = [motion_tracker.update(frame_detections) for frame_detections in detections]
+            record(name, time.perf_counter() - start_time, num_frames, "frames")
+
+        start_time = time.perf_counter()
+        detection_buffer = DetectionBuffer()
+        for frame_num, tracked_detections in enumerate(tracker_output):
+            detection_buffer.append(frame_num, tracked_detections[:, :4], tracked_detections[:, 4], width, height)
+        df = detection_buffer.to_dataframe()
+        record("accumulation", time.perf_counter() - start_time, num_frames, "frames")
+        cars_data = CarsData(df=df, fps=30, video_path=video_path, frame_jump=1, start_frame=0)
+
+        for extension in [".txt", BINARY_EXTENSION]:
+            filename = os.path.join(directory, "data" + extension)
+            start_time = time.perf_counter()
+            cars_data.save_data(filename)
+            record(f"save_data{extension}", time.perf_counter() - start_time, len(df), "rows")
+            start_time = time.perf_counter()
+            CarsData.from_file(filename)
+            record(f"from_file{extension}", time.perf_counter() - start_time, len(df), "rows")
+
+        start_time = time.perf_counter()
+        cars_data.pass_line_times(((0.5, 0), (0.5, 1)))
+        record("pass_line_times", time.perf_counter() - start_time, len(df), "rows")
+
+        start_time = time.perf_counter()
+        cars_data.save_video(os.path.join(directory, "out.mp4"), object_marker=ObjectMarker.RECTANGLE | ObjectMarker.DOT)
+        record("save_video", time.perf_counter() - start_time, num_frames, "frames")
+    finally:
+        shutil.rmtree(directory)
+
+    results = {
+        "settings": {"num_frames": num_frames, "frame_width": width, "frame_height": height, "num_cars": num_cars,
+                     "seed": seed, "num_detections": num_detections},
+        "environment": {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "platform": platform.platform(),
+                        "python": platform.python_version(), "cpu_count": os.cpu_count(), "numpy": np.__version__,
+                        "pandas": pd.__version__, "opencv": cv2.__version__},
+        "stages": stages,
+    }
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Detection pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    batch_size_parser = subparsers.add_parser("batch_size", help="Frames per second of detect_from_video by batch size")
+    batch_size_parser.add_argument("--video", default=paths.video_path)
+    batch_size_parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    batch_size_parser.add_argument("--duration", type=float, default=30, help="Seconds of video to run on")
+    batch_size_parser.add_argument("--frame_jump", type=int, default=1)
+
+    onnx_parser = subparsers.add_parser("onnx", help="Parity and speed of an onnx model against the torch.hub model")
+    onnx_parser.add_argument("onnx_path")
+    onnx_parser.add_argument("--video", default=paths.video_path)
+    onnx_parser.add_argument("--model_size", default="x", help="The size of the model that was exported")
+    onnx_parser.add_argument("--num_frames", type=int, default=100)
+    onnx_parser.add_argument("--frame_jump", type=int, default=30)
+
+    accumulation_parser = subparsers.add_parser("accumulation", help="Cost per frame of collecting detections")
+    accumulation_parser.add_argument("--num_frames", type=int, default=2000)
+    accumulation_parser.add_argument("--detections_per_frame", type=int, nargs="+", default=[10, 50, 200])
+
+    storage_parser = subparsers.add_parser("storage", help="Saving and loading CarsData as csv and binary")
+    storage_parser.add_argument("--num_frames", type=int, default=18000)
+    storage_parser.add_argument("--detections_per_frame", type=int, default=30)
+
+    pass_line_parser = subparsers.add_parser("pass_line", help="Speed of pass_line_times on synthetic tracks")
+    pass_line_parser.add_argument("--num_tracks", type=int, default=10000)
+
+    writer_parser = subparsers.add_parser("writer", help="Frames per second of the VideoWriter backends")
+    writer_parser.add_argument("--num_frames", type=int, default=300)
+    writer_parser.add_argument("--frame_width", type=int, default=1920)
+    writer_parser.add_argument("--frame_height", type=int, default=1080)
+    writer_parser.add_argument("--queue_size", type=int, default=8)
+    writer_parser.add_argument("--draw_milliseconds", type=float, default=0)
+
+    suite_parser = subparsers.add_parser("suite", help="Every stage of the pipeline on a synthetic video, as json")
+    suite_parser.add_argument("--num_frames", type=int, default=900)
+    suite_parser.add_argument("--frame_width", type=int, default=1280)
+    suite_parser.add_argument("--frame_height", type=int, default=720)
+    suite_parser.add_argument("--num_cars", type=int, default=40, help="Cars over the whole video")
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("--output", help="The json file to write the results to")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.benchmark == "batch_size":
+        benchmark_batch_sizes(args.video, args.batch_sizes, args.duration, args.frame_jump)
+    elif args.benchmark == "onnx":
+        compare_onnx(args.video, args.onnx_path, args.model_size, args.num_frames, args.frame_jump)
+    elif args.benchmark == "accumulation":
+        benchmark_accumulation(args.num_frames, args.detections_per_frame)
+    elif args.benchmark == "storage":
+        benchmark_storage(args.num_frames, args.detections_per_frame)
+    elif args.benchmark == "pass_line":
+        benchmark_pass_line_times(args.num_tracks)
+    elif args.benchmark == "writer":
+        benchmark_writers(args.num_frames, (args.frame_width, args.frame_height), args.queue_size, args.draw_milliseconds)
+    elif args.benchmark == "suite":
+        benchmark_suite(args.num_frames, (args.frame_width, args.frame_height), args.num_cars, args.seed, args.output)
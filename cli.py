@@ -0,0 +1,244 @@
+"""
+Runs the jobs of a camera from its config file, instead of editing main.py and paths.py, e.g.
+`python cli.py detect camera.json`, then `python cli.py count camera.json` and `python cli.py render camera.json`.
+See camera.example.json for the settings of a camera.
+
+The modules of each command are only imported when it runs, so that count and render don't load torch.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from typing import Dict, List, Optional
+
+import paths
+
+
+class CameraConfig:
+    """
+    The settings of a camera and of the jobs that run on its video. Paths are relative to the working directory, like
+    in paths.py, whose paths are the defaults.
+    """
+    def __init__(self, video: str = paths.video_path, roi: Optional[str] = paths.roi_path,
+                 lines: Optional[Dict[str, List[List[float]]]] = None,
+                 gates: Optional[Dict[str, List[List[float]]]] = None, model: Optional[dict] = None,
+                 frame_jump: int = 1, start_frame: int = 0, duration_cutoff: Optional[float] = None,
+                 batch_size: int = 1, workers: int = 1, prefetch: int = 4, tracker: Optional[dict] = None,
+                 data: str = paths.save_data_path, detections: Optional[str] = None,
+                 detection_cache: str = paths.detection_cache_path, output_video: str = paths.save_video_path):
+        """
+        :param roi: A file saved by RegionOfInterest.save. It's skipped if it doesn't exist.
+        :param lines: Counting lines in normalized coordinates by name, as [[x1, y1], [x2, y2]].
+        :param gates: Counting polygons in normalized coordinates by name, as lists of [x, y].
+        :param model: The keyword arguments of load_model (like model_size and device), or of OnnxModel if it has an
+        "onnx_path".
+        :param workers: The number of processes that detect (each tracking a part of the video, see
+        detect_from_video_sharded) and that render the video.
+        :param tracker: The settings of Sort: max_age, min_hits and iou_threshold.
+        :param data: Where the tracked data is saved.
+        :param detections: Where detect keeps the model's raw detections for track. data + ".detections.npz" by
+        default.
+        """
+        self.video = video
+        self.roi = roi
+        self.lines = {name: tuple(map(tuple, line)) for name, line in (lines or {}).items()}
+        self.gates = {name: [tuple(point) for point in polygon] for name, polygon in (gates or {}).items()}
+        self.model = {"confidence_threshold": 0.1, "iou_threshold": 0.3, "class_agnostic": True, **(model or {})}
+        self.frame_jump = frame_jump
+        self.start_frame = start_frame
+        self.duration_cutoff = duration_cutoff
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch
+        self.tracker = {"max_age": 10, "min_hits": 3, "iou_threshold": 0.3, **(tracker or {})}
+        self.data = data
+        self.detections = detections if detections is not None else data + ".detections.npz"
+        self.detection_cache = detection_cache
+        self.output_video = output_video
+
+    @staticmethod
+    def from_file(filename: str) -> CameraConfig:
+        with open(filename) as file:
+            settings = json.load(file)
+        try:
+            return CameraConfig(**settings)
+        except TypeError as e:
+            raise ValueError(f"Invalid camera config {filename}: {e}") from e
+
+    def load_roi(self):
+        from roi import RegionOfInterest
+        if self.roi is None or not os.path.exists(self.roi):
+            return None
+        return RegionOfInterest.from_file(self.roi)
+
+    def model_factory(self, num_threads: Optional[int] = None):
+        """
+        :return: A picklable function that loads the model, for detect_from_video_sharded.
+        """
+        import functools
+        settings = dict(self.model)
+        if num_threads is not None:
+            settings.setdefault("num_threads", num_threads)
+        if "onnx_path" in settings:
+            from onnx_model import OnnxModel
+            return functools.partial(OnnxModel, **settings)
+        from model import load_model
+        return functools.partial(load_model, **settings)
+
+
+def detect(config: CameraConfig):
+    """
+    Runs the model on the video and tracks its detections. The raw detections are kept, so that track can run again with
+    other tracker settings without the model.
+    """
+    from VideoReader import VideoReader
+    from detect_sort import detect_from_video
+    from detection_cache import DetectionCache
+    from sharded import detect_from_video_sharded
+
+    roi = config.load_roi()
+    # before the model runs, so that a missing directory doesn't lose the whole run
+    _make_parent_directory(config.detections)
+    _make_parent_directory(config.data)
+    tracking_settings = {"motion_tracker_max_age": config.tracker["max_age"],
+                         "motion_tracker_min_hits": config.tracker["min_hits"],
+                         "iou_threshold": config.tracker["iou_threshold"],
+                         "vectorized_sort": True, "gated_association": True}
+    if config.workers > 1:
+        # the shards aren't kept as a single entry of raw detections, so track can't run on them
+        model_factory = config.model_factory(num_threads=max(1, os.cpu_count() // config.workers))
+        cars_data = detect_from_video_sharded(model_factory, config.video, config.workers,
+                                              frame_jump=config.frame_jump, duration_cutoff=config.duration_cutoff,
+                                              start_frame=config.start_frame, roi=roi, batch_size=config.batch_size,
+                                              **tracking_settings)
+    else:
+        video = VideoReader(config.video, frame_jump=config.frame_jump, duration_cutoff=config.duration_cutoff,
+                            start_frame=config.start_frame, prefetch=config.prefetch)
+        model = config.model_factory()()
+        cache = DetectionCache(config.detection_cache)
+        cars_data, detections = detect_from_video(model, video, roi=roi, batch_size=config.batch_size, pipelined=True,
+                                                  cache=cache, return_detections=True, **tracking_settings)
+        detections.save(config.detections)
+    cars_data.save_data(config.data)
+
+
+def track(config: CameraConfig):
+    """
+    Tracks the raw detections that detect kept, with the tracker settings of the config.
+    """
+    from VideoReader import VideoReader
+    from detection_cache import RawDetections
+    from retrack import track_detections
+
+    if not os.path.exists(config.detections):
+        raise ValueError(f"{config.detections} doesn't exist, run detect with a single worker first")
+    video = VideoReader(config.video, frame_jump=config.frame_jump, start_frame=config.start_frame)
+    # the video is only opened for its frame rate
+    video.release()
+    cars_data = track_detections(RawDetections.load(config.detections), **config.tracker, gated_association=True,
+                                 fps=video.fps, video_path=config.video, frame_jump=config.frame_jump,
+                                 start_frame=config.start_frame)
+    _make_parent_directory(config.data)
+    cars_data.save_data(config.data)
+
+
+def count(config: CameraConfig, output: Optional[str] = None):
+    """
+    Prints the number of objects that crossed every line and gate, and saves the crossings to output as a csv.
+    """
+    import pandas as pd
+    from CarsData import CarsData
+
+    if not config.lines and not config.gates:
+        raise ValueError("The config has no lines or gates to count")
+    crossings = CarsData.from_file(config.data).count_crossings(config.lines, config.gates)
+    for name, name_crossings in crossings.items():
+        forward = int((name_crossings["direction"] == 1).sum())
+        backward = len(name_crossings) - forward
+        if name in config.gates:
+            print(f"{name}: {forward} in, {backward} out")
+        else:
+            print(f"{name}: {len(name_crossings)} ({forward} forward, {backward} backward)")
+    if output is not None:
+        pd.concat(crossings, names=["name", "index"]).reset_index(level="name").to_csv(output, index=False)
+
+
+def render(config: CameraConfig):
+    """
+    Saves the video with the tracked objects and the counters of the lines and gates drawn on it.
+    """
+    from CarsData import CarsData, ObjectMarker
+
+    cars_data = CarsData.from_file(config.data)
+    _make_parent_directory(config.output_video)
+    cars_data.save_video(config.output_video, object_marker=ObjectMarker.RECTANGLE | ObjectMarker.DOT,
+                         display_frame=True, counting_lines=config.lines, counting_gates=config.gates,
+                         prefetch=config.prefetch, processes=config.workers, encode_queue_size=8)
+
+
+def benchmark(num_frames: int, frame_size, num_cars: int, seed: int, output: Optional[str]):
+    from benchmarks import benchmark_suite
+    benchmark_suite(num_frames, frame_size, num_cars, seed, output)
+
+
+def _make_parent_directory(filename: str):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Count the cars of a traffic camera")
+    parser.add_argument("--metrics", help="Record the time spent in every stage into this file, as json, or in the "
+                                          "Prometheus text format if it ends with .prom")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in [("detect", "Run the model on the video and track the objects"),
+                            ("track", "Track the detections of detect again, with the tracker settings of the config"),
+                            ("render", "Save the video with the tracked objects drawn on it")]:
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("config", help="The json config of the camera")
+
+    count_parser = subparsers.add_parser("count", help="Count the objects that crossed the lines and gates")
+    count_parser.add_argument("config", help="The json config of the camera")
+    count_parser.add_argument("--output", help="A csv file to save every crossing to")
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="Time every stage of the pipeline on a synthetic video")
+    benchmark_parser.add_argument("--num_frames", type=int, default=900)
+    benchmark_parser.add_argument("--frame_width", type=int, default=1280)
+    benchmark_parser.add_argument("--frame_height", type=int, default=720)
+    benchmark_parser.add_argument("--num_cars", type=int, default=40, help="Cars over the whole video")
+    benchmark_parser.add_argument("--seed", type=int, default=0)
+    benchmark_parser.add_argument("--output", help="The json file to write the results to")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.metrics is not None:
+        import metrics
+        metrics.enable()
+
+    if args.command == "benchmark":
+        benchmark(args.num_frames, (args.frame_width, args.frame_height), args.num_cars, args.seed, args.output)
+    else:
+        config = CameraConfig.from_file(args.config)
+        if args.command == "detect":
+            detect(config)
+        elif args.command == "track":
+            track(config)
+        elif args.command == "count":
+            count(config, args.output)
+        elif args.command == "render":
+            render(config)
+
+    if args.metrics is not None:
+        if args.metrics.endswith(".prom"):
+            metrics.current().save_prometheus(args.metrics)
+        else:
+            metrics.current().save_json(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
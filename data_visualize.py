@@ -1,9 +1,11 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
-def graph_passing_line_times(passing_line_times: np.array, fps: int):
-    time_dif = np.diff(passing_line_times, prepend=0)
-    time_dif_seconds = time_dif/fps
+def graph_passing_line_times(passing_line_seconds: np.array):
+    """
+    :param passing_line_seconds: The times that cars passed the line in seconds, see CarsData.frame_seconds.
+    """
+    time_dif_seconds = np.diff(passing_line_seconds, prepend=0)
     print(time_dif_seconds)
     plt.title("Histogram of difference between arrival times of cars")
     plt.xlabel("Time Between arrivals[seconds]")
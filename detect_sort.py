@@ -1,66 +1,186 @@
-import cv2
-import pandas as pd
+import time
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
 import tqdm
 
-from CarsData import CarsData
+import metrics
+from CarsData import CarsData, DetectionBuffer
 from VideoReader import VideoReader
-from sort import Sort
+from detection_cache import DetectionCache, RawDetections
+from line_counter import LineCounter
+from pipeline import Pipeline
+from roi import RegionOfInterest
+from sort import Sort, VectorizedSort
 
 
-def detect_from_video(model, video: VideoReader, motion_tracker_max_age=10, iou_threshold=0.3, use_sort = True) -> CarsData:
-    motion_tracker = Sort(max_age=motion_tracker_max_age, iou_threshold=iou_threshold)
+def detect_from_video(model, video: VideoReader, motion_tracker_max_age=10, iou_threshold=0.3, use_sort = True,
+                      batch_size = 1, roi: Optional[RegionOfInterest] = None, pipelined = False,
+                      queue_size = 4, vectorized_sort = False, gated_association = False,
+                      counter: Optional[LineCounter] = None, cache: Optional[DetectionCache] = None,
+                      motion_tracker_min_hits=3,
+                      return_detections=False) -> Union[CarsData, Tuple[CarsData, RawDetections]]:
+    """
+    :param motion_tracker_min_hits: The number of frames in a row that an object has to be detected in before it's
+    tracked.
+    :param batch_size: The number of frames passed to the model at once.
+    The frames of a batch are still tracked one by one in order, so the output doesn't depend on the batch size.
+    :param roi: If given, only the part of the frame inside the region of interest is passed to the model.
+    The detections are still normalized to the full frame.
+    :param pipelined: Run decoding, the model, and tracking on separate threads connected by queues of queue_size
+    batches, instead of one after the other. The output is the same.
+    :param vectorized_sort: Track with VectorizedSort, which updates all the tracks at once and gives the same output.
+    :param gated_association: Only compare overlapping detections and tracks when matching them, which is faster
+    when there are many of them.
+    :param counter: Counts the objects that cross its lines while tracking, so that the counts are available during
+    the run. Requires use_sort.
+    :param cache: Where the detections of the model are kept between runs. If the video was already run through the same
+    model (with the same settings and region of interest), its detections are read from the cache, and only the tracking
+    runs. Otherwise the detections are added to the cache.
+    :param return_detections: Also return the raw detections that were tracked, from the model or the cache, e.g. to
+    save them for retracking.
+    :return: The tracked data, and the raw detections if return_detections.
+    """
+    if counter is not None and not use_sort:
+        raise ValueError("Counting crossings requires tracking with sort")
+    tracker_class = VectorizedSort if vectorized_sort else Sort
+    motion_tracker = tracker_class(max_age=motion_tracker_max_age, min_hits=motion_tracker_min_hits,
+                                   iou_threshold=iou_threshold, gated=gated_association)
     frame_num = 0
-    detections_by_frame = []
+    detection_buffer = DetectionBuffer()
 
     # Show progress bar
     pbar = tqdm.tqdm(total=video.num_frames, desc="Running model")
     pbar.set_postfix({
         "Video Frame Rate": f"{video.fps:.2f} fps",
         "Frame Jump": f"{video.frame_jump}",
-        "Duration": f"{video.duration:.2f} seconds"
+        # a live stream without a duration cutoff is read until it ends
+        "Duration": "live" if video.duration is None else f"{video.duration:.2f} seconds"
     })
 
-    for frame in video.iter_frames():
-        frame_height, frame_width, _ = frame.shape
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        detections = model(frame)
-        if use_sort:
-            detections = motion_tracker.update(detections.pred[0].cpu().numpy())
-            detections = pd.DataFrame(detections,
-                                         columns=["x_min", "y_min", "x_max", "y_max", "object_id"])
+    def run_model(frames: List[np.ndarray]):
+        """
+        :return: The size of the full frames, and the detections of each frame in pixels of the full frame.
+        """
+        if roi is not None:
+            frame_height, frame_width = video.frame_height, video.frame_width
+        else:
+            frame_height, frame_width, _ = frames[0].shape
+        with metrics.timer("inference"):
+            detections = model(frames)
+        batch_detections = []
+        for i in range(len(frames)):
+            # rows of x_min, y_min, x_max, y_max, confidence, class
+            frame_detections = _to_numpy(detections.pred[i])
+            if roi is not None:
+                frame_detections = roi.to_frame(frame_detections, frame_width, frame_height)
+            batch_detections.append(frame_detections)
+        return frame_width, frame_height, batch_detections
+
+    cache_key = cache.key(video, model, roi) if cache is not None else None
+    cached_detections = cache.load(cache_key) if cache is not None else None
+    # the detections of every frame, to be added to the cache or returned
+    new_detections = [] if (cache is not None or return_detections) and cached_detections is None else None
 
-            detections_df = pd.DataFrame.from_dict({
-                "object_id": detections["object_id"],
-                "x_center": (detections["x_min"] + detections["x_max"]) / (2*frame_width),
-                "y_center": (detections["y_min"] + detections["y_max"]) / (2*frame_height),
-                "width": (detections["x_max"] - detections["x_min"])/frame_width,
-                "height": (detections["y_max"] - detections["y_min"])/frame_height,
-                "frame_num": frame_num
-            })
-            detections_df = detections_df.astype({"object_id": int}, copy=True)
+    video_frames = None
+    if cached_detections is not None:
+        # the video isn't read at all, the cached detections are tracked as a single batch
+        video.release()
+        pipelined = False
+        results = iter([(cached_detections.frame_width, cached_detections.frame_height, list(cached_detections))])
+    else:
+        # prefetched frames are reused buffers, so they must be copied if they are kept after the next one is read
+        copy_frames = video.prefetch > 0 and (batch_size > 1 or pipelined)
+        video_frames = video.iter_frames_rgb()
+        frames = video_frames
+        if roi is not None:
+            frames = (roi.crop(frame) for frame in frames)
+        batches = _iter_batches(frames, batch_size, copy_frames)
+        if pipelined:
+            pipeline = Pipeline(batches, [("detect", run_model)], queue_size=queue_size, source_name="decode")
+            tracking_stats = pipeline.stats.add_stage("track")
+            results = iter(pipeline)
         else:
-            detections_without_tracking = detections.pandas().xywhn[0]
-            detections_df = pd.DataFrame.from_dict({
-                "x_center": detections_without_tracking["xcenter"],
-                "y_center": detections_without_tracking["ycenter"],
-                "width": detections_without_tracking["width"],
-                "height": detections_without_tracking["height"],
-                "object_id": list(range(len(detections_without_tracking["height"]))),
-                "frame_num": frame_num
-            })
+            results = map(run_model, batches)
+    frame_width, frame_height = video.frame_width, video.frame_height
 
-            detections_df = detections_df.astype({"object_id": int}, copy=False)
-        detections_by_frame.append(detections_df)
-        frame_num += 1
-        pbar.update()
+    try:
+        for frame_width, frame_height, batch_detections in results:
+            tracking_start_time = time.perf_counter()
+            for frame_detections in batch_detections:
+                if new_detections is not None:
+                    new_detections.append(frame_detections)
+                metrics.count("frames")
+                metrics.observe("detections_per_frame", len(frame_detections), metrics.COUNT_BUCKETS)
+                if use_sort:
+                    # rows of x_min, y_min, x_max, y_max, object_id
+                    with metrics.timer("tracking"):
+                        tracked_detections = motion_tracker.update(frame_detections)
+                    with metrics.timer("accumulation"):
+                        detection_buffer.append(frame_num, tracked_detections[:, :4], tracked_detections[:, 4],
+                                                frame_width, frame_height)
+                    if metrics.current() is not None:
+                        metrics.gauge("live_tracks", len(motion_tracker.live_ids()))
+                    if counter is not None:
+                        counter.update(frame_num, tracked_detections, frame_width, frame_height,
+                                       live_ids=motion_tracker.live_ids())
+                else:
+                    with metrics.timer("accumulation"):
+                        detection_buffer.append(frame_num, frame_detections[:, :4], np.arange(len(frame_detections)),
+                                                frame_width, frame_height)
+                frame_num += 1
+                pbar.update()
+            if pipelined:
+                tracking_stats.record(time.perf_counter() - tracking_start_time)
+    finally:
+        # stop the pipeline's threads and the video's prefetching thread, even if tracking failed
+        if pipelined:
+            results.close()
+        if video_frames is not None:
+            video_frames.close()
 
-    all_detections_df = pd.concat(detections_by_frame, keys=list(range(len(detections_by_frame))),
-                                  names=["frame", "index"])
     pbar.close()
-    return CarsData(
-        df=all_detections_df,
+    raw_detections = cached_detections
+    if new_detections is not None:
+        raw_detections = RawDetections.from_frames(frame_width, frame_height, new_detections)
+        if cache is not None:
+            cache.save(cache_key, raw_detections)
+    if pipelined:
+        tqdm.tqdm.write(pipeline.stats.summary())
+    with metrics.timer("to_dataframe"):
+        df = detection_buffer.to_dataframe()
+    cars_data = CarsData(
+        df=df,
         fps=video.fps,
         video_path=video.filename,
         frame_jump=video.frame_jump,
-        start_frame=video.start_frame
+        start_frame=video.start_frame,
+        # only a LiveVideoReader has timestamps, since it drops frames unevenly
+        timestamps=getattr(video, "timestamps", None)
     )
+    if return_detections:
+        return cars_data, raw_detections
+    return cars_data
+
+
+def _iter_batches(frames: Iterator[np.ndarray], batch_size: int, copy_frames: bool) -> Iterator[List[np.ndarray]]:
+    """
+    Groups the frames into lists of batch_size frames. The last batch may be shorter.
+    """
+    batch = []
+    for frame in frames:
+        batch.append(frame.copy() if copy_frames else frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def _to_numpy(predictions) -> np.ndarray:
+    """
+    Models may return their predictions either as torch tensors (ImprovedModel) or as numpy arrays (OnnxModel).
+    """
+    if isinstance(predictions, np.ndarray):
+        return predictions
+    return predictions.cpu().numpy()
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+"""
+The extension of the files of the cache.
+"""
+CACHE_EXTENSION = ".npz"
+
+
+def file_fingerprint(filename: str, chunk_size: int = 1 << 20, num_chunks: int = 4) -> str:
+    """
+    A hash of the size of a file and of a few chunks spread over it. It's fast even for long videos, and still changes
+    when a file is replaced by a different one.
+    """
+    size = os.path.getsize(filename)
+    sha = hashlib.sha256(str(size).encode())
+    with open(filename, "rb") as file:
+        for i in range(num_chunks):
+            file.seek(max(0, (size - chunk_size) * i // max(1, num_chunks - 1)))
+            sha.update(file.read(chunk_size))
+    return sha.hexdigest()
+
+
+class RawDetections:
+    """
+    The detections of every frame of a video before tracking, as given to Sort.update: rows of x_min, y_min, x_max, y_max,
+    confidence, class in pixels of the full frame.
+    Like CarsData's FrameIndex, the rows of all the frames are stored together, and the rows of frame i are
+    rows[offsets[i]:offsets[i + 1]].
+    """
+    def __init__(self, frame_width: int, frame_height: int, rows: np.ndarray, offsets: np.ndarray):
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.rows = rows
+        self.offsets = offsets
+
+    @staticmethod
+    def from_frames(frame_width: int, frame_height: int, frames: List[np.ndarray]):
+        offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+        np.cumsum([len(frame_detections) for frame_detections in frames], out=offsets[1:])
+        rows = np.concatenate(frames).astype(np.float32) if len(frames) > 0 else np.empty((0, 6), dtype=np.float32)
+        return RawDetections(frame_width, frame_height, rows, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.rows[start:end]
+
+    def save(self, file):
+        np.savez(file, rows=self.rows, offsets=self.offsets,
+                 frame_size=np.array([self.frame_width, self.frame_height]))
+
+    @staticmethod
+    def load(file):
+        with np.load(file) as data:
+            frame_width, frame_height = data["frame_size"].tolist()
+            return RawDetections(frame_width, frame_height, data["rows"], data["offsets"])
+
+
+class DetectionCache:
+    """
+    Stores the raw detections of videos on disk, so that a video only has to go through the model once, no matter how
+    many times it's tracked with different tracking settings.
+    A video's detections are stored under a key that depends on the content of the video, the frames that are read, the
+    model and its settings, and the region of interest.
+    The least recently used entries are deleted when the cache grows beyond max_bytes.
+    """
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, video, model, roi=None) -> str:
+        """
+        :param model: The model must have a description attribute with all of its settings, like ImprovedModel.
+        """
+        if not os.path.isfile(video.filename):
+            raise ValueError("Only the detections of video files can be cached")
+        model_description = getattr(model, "description", None)
+        if model_description is None:
+            raise ValueError(f"{type(model).__name__} has no description, so its detections can't be cached")
+        description = {
+            "video": file_fingerprint(video.filename),
+            "start_frame": video.start_frame,
+            "frame_jump": video.frame_jump,
+            "num_frames": video.num_frames,
+            "model": model_description,
+            "roi": None if roi is None else roi.polygons,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def load(self, key: str) -> Optional[RawDetections]:
+        """
+        :return: The detections that were saved under key, or None if there are none.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            detections = RawDetections.load(path)
+        except (OSError, ValueError, KeyError):
+            # a damaged file is treated like a missing one
+            os.remove(path)
+            return None
+        # the modification time is the time of last use, for evicting the least recently used entries
+        os.utime(path)
+        return detections
+
+    def save(self, key: str, detections: RawDetections):
+        # written to a temporary file first, so that an interrupted save doesn't leave a partial entry
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                detections.save(file)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._evict(keep=self._path(key))
+
+    def _evict(self, keep: str):
+        """
+        Deletes the least recently used entries until the cache fits in max_bytes, except for the entry keep.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_EXTENSION):
+                path = os.path.join(self.directory, name)
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total_bytes -= size
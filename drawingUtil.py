@@ -3,9 +3,9 @@ from typing import Tuple
 import cv2
 import numpy as np
 
+from mathUtil import Line, Point
+
 Size = Tuple[float, float]
-Point = Tuple[float, float]
-Line = Tuple[Tuple[float, float], Tuple[float, float]]
 
 
 def draw_rectangle_normalized(image, center: Point, size: Size, color, thickness=None):
@@ -39,12 +39,31 @@ def draw_line_normalized(img, pt1, pt2, color, thickness = None):
              lineType=cv2.LINE_AA
              )
 
+def draw_polygon_normalized(img, polygon, color, thickness = None):
+    h, w = img.shape[:2]
+    points = np.array([(int(x * w), int(y * h)) for x, y in polygon], dtype=np.int32)
+    cv2.polylines(img, [points], isClosed=True, color=color, thickness=thickness, lineType=cv2.LINE_AA)
+
 def random_color():
     color = np.random.randint(0, 255, size=3)
     # we need to convert to a tuple and use the python's int datatype, or else it won't work with openCV
     return int(color[0]), int(color[1]), int(color[2])
 
 
+def id_color(object_id: int):
+    """
+    A color that is chosen by hashing the id, so the same object gets the same color every time (and in every process),
+    unlike random_color.
+    """
+    # the splitmix64 hash, which spreads consecutive ids to unrelated colors
+    mask = (1 << 64) - 1
+    x = (int(object_id) + 0x9E3779B97F4A7C15) & mask
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & mask
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & mask
+    x ^= x >> 31
+    return x & 255, (x >> 8) & 255, (x >> 16) & 255
+
+
 def draw_text(
         img,
         *,
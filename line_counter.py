@@ -0,0 +1,143 @@
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import mathUtil
+from mathUtil import Line
+from roi import Polygon
+
+
+class Crossing:
+    """
+    An object crossing a line or a gate, with the same meaning of direction as CarsData.count_crossings.
+    """
+    def __init__(self, name: str, frame_num: int, object_id: int, direction: int):
+        self.name = name
+        self.frame_num = frame_num
+        self.object_id = object_id
+        self.direction = direction
+
+    def __repr__(self):
+        return f"Crossing({self.name!r}, frame_num={self.frame_num}, object_id={self.object_id}, " \
+               f"direction={self.direction})"
+
+
+class LineCounter:
+    """
+    Counts the objects that cross lines and polygon gates while they are tracked, from the output of Sort.update,
+    instead of from the saved data afterwards.
+    Only the last position of every live track is kept, and only the segment from it to the new position is tested.
+    A track is forgotten when the tracker drops it, so the memory is bounded by the number of live tracks.
+    The crossings are the same as those of CarsData.count_crossings on the data of the whole video.
+    """
+    def __init__(self, lines: Optional[Dict[str, Line]] = None, gates: Optional[Dict[str, Polygon]] = None,
+                 max_age: int = 10, on_crossing: Optional[Callable[[Crossing], None]] = None):
+        """
+        :param max_age: Should be the max_age of the tracker. Used to forget tracks when update isn't given live_ids.
+        :param on_crossing: Called with every crossing as soon as it's found.
+        """
+        if lines is None:
+            lines = {}
+        if gates is None:
+            gates = {}
+        if not set(lines).isdisjoint(gates):
+            raise ValueError("Lines and gates must have different names")
+        self.lines = lines
+        self.gates = gates
+        self._line_array = np.array(list(lines.values()), dtype=float).reshape(-1, 2, 2)
+        self.max_age = max_age
+        self.on_crossing = on_crossing
+        # the number of crossings of every line and gate so far, by direction (1 or -1)
+        self.counts: Dict[str, Dict[int, int]] = {name: {1: 0, -1: 0} for name in [*lines, *gates]}
+
+        # the state of the live tracks, by object id
+        self._positions: Dict[int, tuple] = {}
+        self._last_seen: Dict[int, int] = {}
+        # the lines, and the gates and directions, that each object already crossed, since only the first crossing of an
+        # object is counted for a line, and its first crossing in each direction for a gate (see count_crossings)
+        self._crossed: Dict[int, set] = {}
+
+    def __len__(self):
+        """
+        :return: The number of tracks that are remembered.
+        """
+        return len(self._positions)
+
+    def update(self, frame_num: int, tracked_detections: np.ndarray, frame_width: int, frame_height: int,
+               live_ids: Optional[np.ndarray] = None) -> List[Crossing]:
+        """
+        :param tracked_detections: The output of Sort.update, rows of x_min, y_min, x_max, y_max, object_id in pixels.
+        :param live_ids: The ids of the tracks that the tracker still keeps (Sort.live_ids()). Tracks that are not in it
+        are forgotten.
+        Without it, tracks are forgotten once they weren't output for more than max_age frames, which can be too early:
+        Sort keeps tracks that were detected but not output because they don't have min_hits hits in a row.
+        :return: The crossings in this frame.
+        """
+        # the centers are normalized and rounded the same way as in DetectionBuffer, so that they match the saved data
+        x = ((tracked_detections[:, 0] + tracked_detections[:, 2]) / (2 * frame_width)).astype(np.float32)
+        y = ((tracked_detections[:, 1] + tracked_detections[:, 3]) / (2 * frame_height)).astype(np.float32)
+        object_ids = tracked_detections[:, 4].astype(int).tolist()
+
+        crossings = []
+        known = [i for i, object_id in enumerate(object_ids) if object_id in self._positions]
+        if len(known) > 0:
+            previous = np.array([self._positions[object_ids[i]] for i in known], dtype=np.float32).reshape(-1, 2)
+            crossings = self._find_crossings(frame_num, [object_ids[i] for i in known], x[known], y[known],
+                                             previous[:, 0], previous[:, 1])
+
+        for object_id, position in zip(object_ids, zip(x.tolist(), y.tolist())):
+            self._positions[object_id] = position
+            self._last_seen[object_id] = frame_num
+        self._evict(frame_num, live_ids)
+
+        for crossing in crossings:
+            self.counts[crossing.name][crossing.direction] += 1
+            if self.on_crossing is not None:
+                self.on_crossing(crossing)
+        return crossings
+
+    def _find_crossings(self, frame_num: int, object_ids: List[int], x: np.ndarray, y: np.ndarray,
+                        previous_x: np.ndarray, previous_y: np.ndarray) -> List[Crossing]:
+        crossings = []
+        if len(self.lines) > 0:
+            all_crosses = mathUtil.lines_cross(self._line_array, x, y, previous_x, previous_y)
+            for (name, line), crosses in zip(self.lines.items(), all_crosses):
+                (x1, y1), (x2, y2) = line
+                for i in np.flatnonzero(crosses):
+                    right_side = (x2 - x1) * (y[i] - y1) - (y2 - y1) * (x[i] - x1) > 0
+                    self._add_crossing(crossings, name, frame_num, object_ids[i], 1 if right_side else -1)
+        for name, polygon in self.gates.items():
+            inside = mathUtil.points_in_polygon(polygon, x, y)
+            was_inside = mathUtil.points_in_polygon(polygon, previous_x, previous_y)
+            for i in np.flatnonzero(inside != was_inside):
+                direction = 1 if inside[i] else -1
+                self._add_crossing(crossings, name, frame_num, object_ids[i], direction, key=(name, direction))
+        return crossings
+
+    def _add_crossing(self, crossings: List[Crossing], name: str, frame_num: int, object_id: int, direction: int,
+                      key=None):
+        """
+        :param key: What the crossing is counted once for, the name by default.
+        """
+        if key is None:
+            key = name
+        crossed = self._crossed.setdefault(object_id, set())
+        if key in crossed:
+            return
+        crossed.add(key)
+        crossings.append(Crossing(name, frame_num, object_id, direction))
+
+    def _evict(self, frame_num: int, live_ids: Optional[np.ndarray]):
+        """
+        Forgets the tracks that the tracker dropped, which happens after max_age frames without a detection.
+        """
+        if live_ids is not None:
+            live_ids = set(live_ids.tolist())
+            expired = [object_id for object_id in self._last_seen if object_id not in live_ids]
+        else:
+            expired = [object_id for object_id, last_seen in self._last_seen.items()
+                       if frame_num - last_seen > self.max_age]
+        for object_id in expired:
+            del self._positions[object_id]
+            del self._last_seen[object_id]
+            self._crossed.pop(object_id, None)
@@ -1,15 +1,24 @@
+import functools
+import os
+
 import cv2
 
 import data_visualize
 import drawingUtil
 import mathUtil
+import metrics
 import paths
 from CarsData import CarsData, ObjectMarker
-from SelectLanes import select_line
-from VideoReader import VideoReader
+from SelectLanes import select_line, select_polygon
+from VideoReader import LiveVideoReader, VideoReader
 from detect_sort import detect_from_video
+from detection_cache import DetectionCache, RawDetections
 from model import load_model
-from paths import video_path, image_path, save_video_path, save_data_path
+from paths import video_path, image_path, save_video_path, save_data_path, roi_path, stream_url, detection_cache_path, \
+    detections_path, metrics_path
+from roi import RegionOfInterest
+from retrack import grid, sweep
+from sharded import detect_from_video_sharded
 
 LINE = ((0.14765625, 0.138671875), (0.00234375, 0.166015625))
 
@@ -21,11 +30,58 @@ def test_image():
 
 
 def track_from_video():
-    video_reader = VideoReader(filename=video_path, frame_jump=1, duration_cutoff=10*60, start_frame=20 * 30)
+    metrics.enable()
+    video_reader = VideoReader(filename=video_path, frame_jump=1, duration_cutoff=10*60, start_frame=20 * 30, prefetch=4)
     model = load_model(confidence_threshold=0.1, iou_threshold=0.3, class_agnostic=True)
-    cars_data = detect_from_video(model, video_reader)
+    roi = RegionOfInterest.from_file(roi_path) if os.path.exists(roi_path) else None
+    cache = DetectionCache(detection_cache_path)
+    cars_data, detections = detect_from_video(model, video_reader, roi=roi, pipelined=True, vectorized_sort=True,
+                                              gated_association=True, cache=cache, return_detections=True)
+    cars_data.save_data(save_data_path)
+    # kept outside of the cache, so that sweep_tracker_settings can find them without loading the model for the key
+    detections.save(detections_path)
+    cars_data.save_video(save_video_path, object_marker=ObjectMarker.RECTANGLE | ObjectMarker.DOT, display_frame=True,
+                         prefetch=4, encode_queue_size=8)
+    # the time spent in every stage, to see which one the run is bound by
+    metrics.current().save_json(metrics_path + ".json")
+    metrics.current().save_prometheus(metrics_path + ".prom")
+
+
+def track_from_video_sharded(num_shards=4):
+    """
+    Same as track_from_video, but tracks num_shards parts of the video in parallel processes.
+    """
+    model_factory = functools.partial(load_model, confidence_threshold=0.1, iou_threshold=0.3, class_agnostic=True,
+                                      num_threads=max(1, os.cpu_count() // num_shards))
+    roi = RegionOfInterest.from_file(roi_path) if os.path.exists(roi_path) else None
+    cars_data = detect_from_video_sharded(model_factory, video_path, num_shards, frame_jump=1, duration_cutoff=10*60,
+                                          start_frame=20 * 30, roi=roi, vectorized_sort=True, gated_association=True)
+    cars_data.save_data(save_data_path)
+
+
+def sweep_tracker_settings():
+    """
+    Compares the number of tracks and of crossings of LINE for many tracker settings, from the detections that
+    track_from_video kept, so that the model isn't loaded or run again.
+    """
+    if not os.path.exists(detections_path):
+        raise ValueError(f"{detections_path} doesn't exist, run track_from_video first")
+    detections = RawDetections.load(detections_path)
+    settings = grid(max_age=[1, 5, 10, 20, 30], min_hits=[1, 2, 3, 5], iou_threshold=[0.1, 0.2, 0.3, 0.5])
+    results = sweep(detections, settings, lines={"line": LINE})
+    print(results.to_string(index=False))
+
+
+def track_from_stream():
+    """
+    Tracks the cars of the live stream directly, instead of a downloaded copy of it.
+    """
+    video_reader = LiveVideoReader(filename=stream_url, duration_cutoff=10*60)
+    model = load_model(confidence_threshold=0.1, iou_threshold=0.3, class_agnostic=True)
+    roi = RegionOfInterest.from_file(roi_path) if os.path.exists(roi_path) else None
+    cars_data = detect_from_video(model, video_reader, roi=roi, pipelined=True, vectorized_sort=True,
+                                  gated_association=True)
     cars_data.save_data(save_data_path)
-    cars_data.save_video(save_video_path, object_marker=ObjectMarker.RECTANGLE | ObjectMarker.DOT, display_frame=True)
 
 
 def save_video():
@@ -42,10 +98,20 @@ def save_video_with_pass_line():
 def graph_pass_line_times():
     cars_data = CarsData.from_file(save_data_path)
     pass_line_times, pass_line_ids = cars_data.pass_line_times(LINE)
-    data_visualize.graph_passing_line_times(pass_line_times, cars_data.fps)
+    data_visualize.graph_passing_line_times(cars_data.frame_seconds(pass_line_times))
 
 
 
+def select_roi():
+    """
+    Lets the user draw the region of interest of the camera on its image, and saves it to roi_path.
+    """
+    img = cv2.imread(image_path)
+    polygon = select_polygon(img, "Draw the region of interest\nPress space to finish", normalize=True)
+    if polygon is not None:
+        RegionOfInterest([polygon]).save(roi_path)
+
+
 def test_lines_cross():
     img = cv2.imread(paths.image_path)
     line1 = select_line(img, normalize=True)
@@ -53,4 +119,6 @@ def test_lines_cross():
     (x21, y21), (x22, y22) = line2
     print(mathUtil.lines_cross(line1, x21, y21, x22, y22))
 
-graph_pass_line_times()
\ No newline at end of file
+
+if __name__ == "__main__":
+    graph_pass_line_times()
@@ -1,25 +1,93 @@
+from typing import Tuple
+
 import numpy as np
 
-from drawingUtil import Line
+Point = Tuple[float, float]
+Line = Tuple[Tuple[float, float], Tuple[float, float]]
 
 
-def lines_cross(line: Line, x21, y21, x22, y22: np.array):
+def lines_cross(line: Line, x21, y21, x22, y22: np.array, include_endpoints=False, out: np.array = None):
     """
     Given two line segments, returns true if they cross.
     The second line may also be passed as a np array of coordinates, in which case an array is returned, which is true in every index where the lines cross.
-    :param line: should be in ((x1, y1), (x2, y2)) format
+    Uses the signs of cross products instead of slopes, so vertical and zero length segments are handled correctly.
+    :param line: should be in ((x1, y1), (x2, y2)) format, or an array of shape (M, 2, 2) of M lines in that format,
+    in which case the result has an extra first axis of size M.
     :param x21:
     :param y21:
     :param x22:
     :param y22: the two endpoints of the second line, or np arrays of endpoints of multiple lines.
+    :param include_endpoints: Also count segments that only touch, at an endpoint or by overlapping along the same line.
+    :param out: A boolean array of the result's shape to write the result into.
     :return: True if the lines cross.
     """
-    (x11, y11), (x12, y12) = line
-    m1 = (y12 - y11) / (x12 - x11)
-    m2 = (y22 - y21) / (x22 - x21)
-    x_cross = (m1 * x11 - m2 * x21 + y21 - y11) / (m1 - m2)
-
-    return (np.minimum(x11, x12) < x_cross) & \
-           (x_cross < np.maximum(x11, x12)) & \
-           (np.minimum(x21, x22) < x_cross) & \
-           (x_cross < np.maximum(x21, x22))
\ No newline at end of file
+    x21, y21, x22, y22 = (np.asarray(coordinate) for coordinate in (x21, y21, x22, y22))
+    # float32 coordinates are kept as float32, anything else is computed in float64
+    dtype = np.result_type(x21.dtype, y21.dtype, x22.dtype, y22.dtype, np.float32)
+    segments_shape = np.broadcast_shapes(x21.shape, y21.shape, x22.shape, y22.shape)
+    lines = np.asarray(line, dtype=dtype)
+    # every line is compared with every segment
+    expand = (...,) + (None,) * len(segments_shape)
+    x11, y11 = lines[..., 0, 0][expand], lines[..., 0, 1][expand]
+    x12, y12 = lines[..., 1, 0][expand], lines[..., 1, 1][expand]
+    shape = lines.shape[:-2] + segments_shape
+    scalar_result = out is None and shape == ()
+    if out is None:
+        out = np.empty(shape, dtype=bool)
+
+    line_dx, line_dy = x12 - x11, y12 - y11
+    segment_dx, segment_dy = x22 - x21, y22 - y21
+    # the first endpoint of the second line relative to the first endpoint of the first line
+    dx = np.subtract(x21, x11, out=np.empty(shape, dtype=dtype))
+    dy = np.subtract(y21, y11, out=np.empty(shape, dtype=dtype))
+    temp = np.empty(shape, dtype=dtype)
+    # the cross product of the two directions, which is 0 when the lines are parallel
+    direction_cross = np.multiply(segment_dx, line_dy, dtype=dtype)
+    direction_cross = direction_cross - segment_dy * line_dx
+
+    # the sides of the first line that the endpoints of the second line are on (the signs of the cross products), and
+    # the other way around.
+    o1 = np.multiply(dy, line_dx, out=np.empty(shape, dtype=dtype))
+    o1 -= np.multiply(dx, line_dy, out=temp)
+    o2 = np.subtract(o1, direction_cross, out=np.empty(shape, dtype=dtype))
+    o3 = np.multiply(dx, segment_dy, out=dx)
+    o3 -= np.multiply(dy, segment_dx, out=temp)
+    o4 = np.add(o3, direction_cross, out=dy)
+    collinear = (o1 == 0) & (o2 == 0) if include_endpoints else None
+
+    # the endpoints of each line are on opposite sides of the other line
+    o1 *= o2
+    o3 *= o4
+    if include_endpoints:
+        np.less_equal(o1, 0, out=out)
+        out &= o3 <= 0
+        # the segments are on the same line (or one of them is a point on the other's line), so they touch only if their
+        # bounding boxes overlap
+        if np.any(collinear):
+            overlap = (np.maximum(np.minimum(x11, x12), np.minimum(x21, x22)) <=
+                       np.minimum(np.maximum(x11, x12), np.maximum(x21, x22)))
+            overlap &= (np.maximum(np.minimum(y11, y12), np.minimum(y21, y22)) <=
+                        np.minimum(np.maximum(y11, y12), np.maximum(y21, y22)))
+            out &= ~collinear | overlap
+    else:
+        np.less(o1, 0, out=out)
+        out &= o3 < 0
+    return out[()] if scalar_result else out
+
+
+def points_in_polygon(polygon, x: np.array, y: np.array) -> np.array:
+    """
+    Returns an array which is true in every index where the point (x, y) is inside the polygon, using the even-odd rule.
+    :param polygon: A list of (x, y) vertices.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    inside = np.zeros(np.broadcast(x, y).shape, dtype=bool)
+    polygon = np.asarray(polygon, dtype=float)
+    for (x1, y1), (x2, y2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        # count the edges that a ray going right from the point crosses
+        crosses_height = (y1 > y) != (y2 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses_height & (x < x_cross)
+    return inside
@@ -0,0 +1,244 @@
+"""
+Counters, gauges and latency histograms that the stages of the pipeline report into, to find out which stage a slow run
+is bound by.
+Nothing is recorded until enable() is called, and until then every call returns right away, so the stages can report
+unconditionally:
+
+    metrics.enable()
+    cars_data = detect_from_video(model, video)
+    metrics.current().save_json("metrics.json")
+
+Only this process is recorded, not the worker processes of sharded runs or of save_video with processes > 1.
+"""
+import bisect
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+"""
+The upper bounds of the buckets of latency histograms, in seconds.
+"""
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+"""
+The upper bounds of the buckets of the detections per frame histogram.
+"""
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        # the number of values in each bucket, and in a last bucket for the values above all the bounds
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        An estimate of the q quantile: the upper bound of the bucket that contains it.
+        """
+        rank = q * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count > 0 else None,
+            "min": self.min if self.count > 0 else None,
+            "max": self.max if self.count > 0 else None,
+            "p50": self.quantile(0.5) if self.count > 0 else None,
+            "p95": self.quantile(0.95) if self.count > 0 else None,
+            # the number of values in each bucket (not cumulative), with the values above all the bounds in "+Inf"
+            "buckets": {**{str(bound): bucket_count for bound, bucket_count in zip(self.buckets, self.bucket_counts)},
+                        "+Inf": self.bucket_counts[-1]},
+        }
+
+
+class Metrics:
+    """
+    The metrics of a run. Stages may report from any thread.
+    """
+    def __init__(self):
+        self.start_time = time.time()
+        self.counters: Dict[str, float] = {}
+        # the last and the largest value of every gauge
+        self.gauges: Dict[str, float] = {}
+        self.gauge_maxima: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+            self.gauge_maxima[name] = max(self.gauge_maxima.get(name, value), value)
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        """
+        Records the duration of the block in the histogram stage + "_seconds".
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage + "_seconds", time.perf_counter() - start_time)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "elapsed_seconds": time.time() - self.start_time,
+                "peak_memory_bytes": peak_memory_bytes(),
+                "counters": dict(self.counters),
+                "gauges": {name: {"last": value, "max": self.gauge_maxima[name]} for name, value in self.gauges.items()},
+                "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()},
+            }
+
+    def save_json(self, filename: str):
+        with open(filename, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def to_prometheus(self, prefix: str = "carstats_") -> str:
+        """
+        The metrics in the Prometheus text format, e.g. for the textfile collector of node_exporter.
+        """
+        summary = self.summary()
+        lines = []
+        if summary["peak_memory_bytes"] is not None:
+            lines += [f"# TYPE {prefix}peak_memory_bytes gauge", f"{prefix}peak_memory_bytes {summary['peak_memory_bytes']}"]
+        for name, value in summary["counters"].items():
+            lines += [f"# TYPE {prefix}{name}_total counter", f"{prefix}{name}_total {value}"]
+        for name, gauge in summary["gauges"].items():
+            lines += [f"# TYPE {prefix}{name} gauge", f"{prefix}{name} {gauge['last']}"]
+            lines += [f"# TYPE {prefix}{name}_max gauge", f"{prefix}{name}_max {gauge['max']}"]
+        with self._lock:
+            histograms = list(self.histograms.items())
+        for name, histogram in histograms:
+            lines.append(f"# TYPE {prefix}{name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{prefix}{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines += [f"{prefix}{name}_sum {histogram.sum}", f"{prefix}{name}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+    def save_prometheus(self, filename: str, prefix: str = "carstats_"):
+        with open(filename, "w") as file:
+            file.write(self.to_prometheus(prefix))
+
+
+def peak_memory_bytes() -> Optional[int]:
+    """
+    The largest resident memory of this process so far, or None if it can't be measured.
+    """
+    try:
+        # only available on unix
+        import resource
+    except ImportError:
+        pass
+    else:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on mac
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory_info = psutil.Process().memory_info()
+    # the peak working set on windows
+    return getattr(memory_info, "peak_wset", memory_info.rss)
+
+
+_metrics: Optional[Metrics] = None
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def enable() -> Metrics:
+    """
+    Starts recording into new metrics.
+    """
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def disable():
+    global _metrics
+    _metrics = None
+
+
+def current() -> Optional[Metrics]:
+    """
+    :return: The metrics being recorded, or None if they are disabled.
+    """
+    return _metrics
+
+
+def count(name: str, value: float = 1):
+    if _metrics is not None:
+        _metrics.count(name, value)
+
+
+def gauge(name: str, value: float):
+    if _metrics is not None:
+        _metrics.gauge(name, value)
+
+
+def observe(name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS):
+    if _metrics is not None:
+        _metrics.observe(name, value, buckets)
+
+
+def timer(stage: str):
+    """
+    A context manager that records the duration of its block, see Metrics.timer.
+    """
+    if _metrics is None:
+        return _NULL_TIMER
+    return _metrics.timer(stage)
+
+
+def timed(stage: str):
+    """
+    A decorator that records the duration of every call of the function, see Metrics.timer.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _metrics is None:
+                return function(*args, **kwargs)
+            with _metrics.timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
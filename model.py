@@ -1,15 +1,40 @@
+import os
 from typing import List, Union
 
 import torch
 
+from detection_cache import file_fingerprint
+
+"""
+The sizes of the yolov5 models, from the smallest and fastest to the largest and most accurate.
+"""
+MODEL_SIZES = ["n", "s", "m", "l", "x"]
+YOLOV5_REPO = "ultralytics/yolov5"
+
+
 class ImprovedModel:
     """
     It seems that
     """
-    def __init__(self, confidence_threshold = None, iou_threshold = None, target_names=None, class_agnostic: Union[bool, None] = True):
+    def __init__(self, confidence_threshold = None, iou_threshold = None, target_names=None, class_agnostic: Union[bool, None] = True,
+                 model_size = "x", device = "auto", weights: Union[str, None] = None, repo_dir: Union[str, None] = None,
+                 num_threads: Union[int, None] = None):
+        """
+        :param model_size: One of MODEL_SIZES.
+        :param device: "cpu", "cuda" (or a specific device like "cuda:1"), or "auto" to use cuda when it is available.
+        :param weights: Path to a local .pt weights file. If not given, the pretrained weights of model_size are used.
+        :param repo_dir: A local checkout of the yolov5 repository. If not given, the copy in the torch.hub cache is used
+        when there is one, so that the network is only needed on the very first run.
+        :param num_threads: The number of threads torch uses for inference on the cpu.
+        """
         if target_names is None:
             target_names = ["car", "bus", "truck"]
-        self.model = torch.hub.load("ultralytics/yolov5", "yolov5x").cuda()
+        if model_size not in MODEL_SIZES:
+            raise ValueError(f"model_size must be one of {MODEL_SIZES}, got {model_size!r}")
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.device = _resolve_device(device)
+        self.model = _load_yolov5(model_size, weights, repo_dir).to(self.device)
         if class_agnostic is not None:
             # class_agnostic makes the model detect objects without looking at ther class
             self.model.agnostic = class_agnostic
@@ -21,13 +46,56 @@ class ImprovedModel:
         # Only look for classes whose name is in target_names
         self.model.classes = _find_indexes(self.model.names, target_names)
 
-    def __call__(self, image):
-        return self.model(image)
+        # everything that affects the detections, used as part of the key of a DetectionCache
+        self.description = {
+            "model": "yolov5",
+            "model_size": model_size,
+            "weights": None if weights is None else file_fingerprint(weights),
+            "confidence_threshold": float(self.model.conf),
+            "iou_threshold": float(self.model.iou),
+            "class_agnostic": bool(self.model.agnostic),
+            "classes": [int(i) for i in self.model.classes],
+        }
+
+    def __call__(self, images):
+        """
+        Runs the model on an image, or on a list of images as a single batch.
+        The detections for images[i] are in result.pred[i].
+        """
+        return self.model(images)
+
 
 
+def load_model(confidence_threshold = None, iou_threshold = None, target_names=None, class_agnostic = None,
+               model_size = "x", device = "auto", weights = None, repo_dir = None, num_threads = None):
+    return ImprovedModel(confidence_threshold, iou_threshold, target_names, class_agnostic,
+                         model_size=model_size, device=device, weights=weights, repo_dir=repo_dir,
+                         num_threads=num_threads)
+
+
+def _resolve_device(device: str) -> torch.device:
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.device(device)
+
+
+def _load_yolov5(model_size: str, weights: Union[str, None], repo_dir: Union[str, None]):
+    """
+    Loads yolov5 through torch.hub, without accessing the network when the repository and weights are available locally.
+    """
+    if repo_dir is None:
+        cached_repo_dir = os.path.join(torch.hub.get_dir(), YOLOV5_REPO.replace("/", "_") + "_master")
+        if os.path.isdir(cached_repo_dir):
+            repo_dir = cached_repo_dir
+    if repo_dir is not None:
+        repo, source = repo_dir, "local"
+    else:
+        repo, source = YOLOV5_REPO, "github"
 
-def load_model(confidence_threshold = None, iou_threshold = None, target_names=None, class_agnostic = None):
-    return ImprovedModel(confidence_threshold, iou_threshold, target_names, class_agnostic)
+    if weights is not None:
+        return torch.hub.load(repo, "custom", path=weights, source=source)
+    # yolov5 looks for the weights file in the working directory before downloading it
+    return torch.hub.load(repo, "yolov5" + model_size, source=source)
 
 
 
@@ -39,4 +107,4 @@ def _find_indexes(l:List, values:List)->List[int]:
     for i, num in enumerate(l):
         if num in values:
             out.append(i)
-    return out
\ No newline at end of file
+    return out
@@ -0,0 +1,189 @@
+import ast
+from typing import List, Tuple, Union
+
+import cv2
+import numpy as np
+import onnxruntime
+
+from detection_cache import file_fingerprint
+
+"""
+The class names of the COCO dataset, which the pretrained yolov5 models are trained on.
+Used when the exported model doesn't store its class names.
+"""
+COCO_NAMES = ["person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat", "traffic light",
+              "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow",
+              "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella", "handbag", "tie", "suitcase", "frisbee",
+              "skis", "snowboard", "sports ball", "kite", "baseball bat", "baseball glove", "skateboard", "surfboard",
+              "tennis racket", "bottle", "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple",
+              "sandwich", "orange", "broccoli", "carrot", "hot dog", "pizza", "donut", "cake", "chair", "couch",
+              "potted plant", "bed", "dining table", "toilet", "tv", "laptop", "mouse", "remote", "keyboard",
+              "cell phone", "microwave", "oven", "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors",
+              "teddy bear", "hair drier", "toothbrush"]
+
+# The same limits as yolov5's non_max_suppression
+_MAX_BOX_SIZE = 7680
+_MAX_NMS_CANDIDATES = 30000
+_MAX_DETECTIONS = 1000
+
+
+class OnnxDetections:
+    """
+    The result of OnnxModel. Like yolov5's Detections, pred[i] holds the detections of the i-th image, as rows of
+    x_min, y_min, x_max, y_max, confidence, class in pixels.
+    """
+    pred: List[np.ndarray]
+
+    def __init__(self, pred: List[np.ndarray]):
+        self.pred = pred
+
+
+class OnnxModel:
+    """
+    A detector with the same interface as ImprovedModel, that runs a yolov5 model exported to onnx with onnxruntime.
+    Export a model with yolov5's export script, e.g. `python export.py --weights yolov5s.pt --include onnx`
+    (add --dynamic to be able to run batches of more than one image).
+    """
+    def __init__(self, onnx_path: str, confidence_threshold = None, iou_threshold = None, target_names=None,
+                 class_agnostic: Union[bool, None] = True, num_threads: Union[int, None] = None, providers=None):
+        if target_names is None:
+            target_names = ["car", "bus", "truck"]
+        # the same defaults as yolov5
+        self.confidence_threshold = 0.25 if confidence_threshold is None else confidence_threshold
+        self.iou_threshold = 0.45 if iou_threshold is None else iou_threshold
+        self.class_agnostic = bool(class_agnostic)
+
+        session_options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            session_options.intra_op_num_threads = num_threads
+        if providers is None:
+            providers = ["CPUExecutionProvider"]
+        self.session = onnxruntime.InferenceSession(onnx_path, session_options, providers=providers)
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch_size, _, input_height, input_width = model_input.shape
+        # dynamic dimensions are given as names instead of numbers
+        self.max_batch_size = batch_size if isinstance(batch_size, int) else None
+        self.input_size = (input_height, input_width) if isinstance(input_height, int) else (640, 640)
+
+        names = self.session.get_modelmeta().custom_metadata_map.get("names")
+        self.names = _parse_names(names) if names is not None else COCO_NAMES
+        # Only look for classes whose name is in target_names
+        self.classes = np.array([i for i, name in enumerate(self.names) if name in target_names])
+
+        # everything that affects the detections, used as part of the key of a DetectionCache
+        self.description = {
+            "model": "onnx",
+            "onnx": file_fingerprint(onnx_path),
+            "input_size": list(self.input_size),
+            "confidence_threshold": self.confidence_threshold,
+            "iou_threshold": self.iou_threshold,
+            "class_agnostic": self.class_agnostic,
+            "classes": self.classes.tolist(),
+        }
+
+    def __call__(self, images) -> OnnxDetections:
+        """
+        Runs the model on an RGB image, or on a list of RGB images.
+        """
+        if not isinstance(images, list):
+            images = [images]
+        batch_size = len(images) if self.max_batch_size is None else self.max_batch_size
+        pred = []
+        for batch_start in range(0, len(images), batch_size):
+            batch = images[batch_start:batch_start + batch_size]
+            letterboxed = [letterbox(image, self.input_size) for image in batch]
+            model_input = np.stack([image for image, _, _ in letterboxed])
+            model_input = np.ascontiguousarray(model_input.transpose((0, 3, 1, 2)), dtype=np.float32) / 255
+            output = self.session.run(None, {self.input_name: model_input})[0]
+            for image_output, (_, gain, padding), image in zip(output, letterboxed, batch):
+                detections = self._non_max_suppression(image_output)
+                pred.append(_scale_boxes(detections, gain, padding, image.shape[:2]))
+        return OnnxDetections(pred)
+
+    def _non_max_suppression(self, output: np.ndarray) -> np.ndarray:
+        """
+        Same as yolov5's non_max_suppression, for a single image with multi_label=False.
+        :param output: rows of x_center, y_center, width, height, objectness, class scores...
+        :return: rows of x_min, y_min, x_max, y_max, confidence, class
+        """
+        output = output[output[:, 4] > self.confidence_threshold]
+        class_scores = output[:, 5:] * output[:, 4:5]
+        classes = class_scores.argmax(axis=1)
+        confidences = class_scores[np.arange(len(classes)), classes]
+        keep = (confidences > self.confidence_threshold) & np.isin(classes, self.classes)
+        output, classes, confidences = output[keep], classes[keep], confidences[keep]
+
+        order = np.argsort(-confidences, kind="stable")[:_MAX_NMS_CANDIDATES]
+        boxes = _xywh_to_xyxy(output[order, :4])
+        classes, confidences = classes[order], confidences[order]
+
+        # moving every class to its own region means that boxes of different classes never overlap
+        offsets = 0 if self.class_agnostic else classes[:, None] * _MAX_BOX_SIZE
+        kept = _nms(boxes + offsets, self.iou_threshold)[:_MAX_DETECTIONS]
+        return np.concatenate((boxes[kept], confidences[kept, None], classes[kept, None]), axis=1).astype(np.float32)
+
+
+def letterbox(image: np.ndarray, size: Tuple[int, int], color=(114, 114, 114)) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Resizes the image to fit in size=(height, width) while keeping its aspect ratio, and pads the rest.
+    :return: The padded image, the resize ratio, and the (left, top) padding.
+    """
+    height, width = image.shape[:2]
+    gain = min(size[0] / height, size[1] / width)
+    new_width, new_height = int(round(width * gain)), int(round(height * gain))
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size[1] - new_width) / 2, (size[0] - new_height) / 2
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return image, gain, (left, top)
+
+
+def _scale_boxes(detections: np.ndarray, gain: float, padding: Tuple[int, int], image_shape) -> np.ndarray:
+    """
+    Maps boxes from the letterboxed image back to the original image.
+    """
+    detections[:, [0, 2]] -= padding[0]
+    detections[:, [1, 3]] -= padding[1]
+    detections[:, :4] /= gain
+    detections[:, [0, 2]] = detections[:, [0, 2]].clip(0, image_shape[1])
+    detections[:, [1, 3]] = detections[:, [1, 3]].clip(0, image_shape[0])
+    return detections
+
+
+def _xywh_to_xyxy(boxes: np.ndarray) -> np.ndarray:
+    half_size = boxes[:, 2:4] / 2
+    return np.concatenate((boxes[:, :2] - half_size, boxes[:, :2] + half_size), axis=1)
+
+
+def _nms(boxes: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy non maximum suppression of boxes that are sorted by decreasing confidence.
+    :return: The indexes of the kept boxes, in order.
+    """
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    remaining = np.arange(len(boxes))
+    kept = []
+    while len(remaining) > 0:
+        best, rest = remaining[0], remaining[1:]
+        kept.append(best)
+        # the overlap of the best box with all the remaining boxes at once
+        width = np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0])
+        height = np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1])
+        intersection = np.maximum(width, 0) * np.maximum(height, 0)
+        iou = intersection / (areas[best] + areas[rest] - intersection)
+        remaining = rest[iou <= iou_threshold]
+    return np.array(kept, dtype=int)
+
+
+def _parse_names(names: str) -> List[str]:
+    """
+    yolov5 stores the class names in the onnx metadata as the string of a {index: name} dict.
+    """
+    names = ast.literal_eval(names)
+    if isinstance(names, dict):
+        return [names[i] for i in sorted(names)]
+    return list(names)
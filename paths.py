@@ -3,4 +3,9 @@ import os
 video_path = os.path.join("media", "traffic_cam", "ahihud_from_12_00.mp4")
 image_path = os.path.join("media", "traffic_cam", "frame_0.png")
 save_video_path = os.path.join("media", "out", "out.mp4")
-save_data_path = os.path.join("media", "data_out", "out.txt")
\ No newline at end of file
+save_data_path = os.path.join("media", "data_out", "out.txt")
+roi_path = os.path.join("media", "traffic_cam", "roi.json")
+detection_cache_path = os.path.join("media", "detection_cache")
+detections_path = os.path.join("media", "data_out", "detections.npz")
+metrics_path = os.path.join("media", "data_out", "metrics")
+stream_url = "https://5d8c50e7b358f.streamlock.net/live/EVLAIM.stream/playlist.m3u8"
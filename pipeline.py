@@ -0,0 +1,175 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+
+class StageStats:
+    """
+    Counters of a single pipeline stage.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._queue_size_sum = 0
+        self._queue_samples = 0
+
+    def record(self, seconds: float, items: int = 1):
+        self.items += items
+        self.busy_seconds += seconds
+
+    def sample_queue(self, queue_size: int):
+        """
+        Records the occupancy of the stage's output queue, right after it added an item.
+        """
+        self._queue_size_sum += queue_size
+        self._queue_samples += 1
+
+    @property
+    def items_per_second(self) -> float:
+        """
+        The throughput the stage would have if it never waited for the other stages.
+        """
+        return self.items / self.busy_seconds if self.busy_seconds > 0 else float("inf")
+
+    @property
+    def mean_queue_occupancy(self) -> float:
+        return self._queue_size_sum / self._queue_samples if self._queue_samples > 0 else 0.0
+
+
+class PipelineStats:
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.stages: List[StageStats] = []
+
+    def add_stage(self, name: str) -> StageStats:
+        stage = StageStats(name)
+        self.stages.append(stage)
+        return stage
+
+    def summary(self) -> str:
+        lines = []
+        for stage in self.stages:
+            line = f"{stage.name}: {stage.items} items, {stage.items_per_second:.2f} items/second"
+            if stage._queue_samples > 0:
+                line += f", output queue {stage.mean_queue_occupancy:.2f}/{self.queue_size} on average"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class Pipeline:
+    """
+    Runs the source iterator and every stage function on its own thread, connected by bounded queues.
+    Iterating over the pipeline yields the output of the last stage, in the same order as the source items.
+    The slowest stage sets the throughput, instead of the sum of all stages, as long as the stages release the GIL
+    (which opencv and torch do).
+    """
+    def __init__(self, source: Iterable, stages: List[Tuple[str, Callable]], queue_size: int = 4,
+                 source_name: str = "source"):
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = PipelineStats(queue_size)
+        self._source_stats = self.stats.add_stage(source_name)
+        self._stage_stats = [self.stats.add_stage(name) for name, _ in stages]
+
+    def __iter__(self) -> Iterator:
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._run_source, args=(queues[0], stop), daemon=True,
+                                    name=f"Pipeline {self._source_stats.name}")]
+        for (name, function), stats, in_queue, out_queue in zip(self.stages, self._stage_stats, queues, queues[1:]):
+            threads.append(threading.Thread(target=self._run_stage, args=(function, stats, in_queue, out_queue, stop),
+                                            daemon=True, name=f"Pipeline {name}"))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exception
+                yield item
+        finally:
+            # the consumer may stop early, in which case all the stages are stopped as well.
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _run_source(self, out_queue: queue.Queue, stop: threading.Event):
+        source = iter(self.source)
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    item = next(source)
+                except StopIteration:
+                    break
+                self._source_stats.record(time.perf_counter() - start_time)
+                if not _put(out_queue, item, stop):
+                    return
+                self._source_stats.sample_queue(out_queue.qsize())
+            _put(out_queue, _END, stop)
+        except BaseException as e:
+            _put(out_queue, _Failure(e), stop)
+        finally:
+            if hasattr(source, "close"):
+                source.close()
+
+    @staticmethod
+    def _run_stage(function: Callable, stats: StageStats, in_queue: queue.Queue, out_queue: queue.Queue,
+                   stop: threading.Event):
+        while True:
+            item = _get(in_queue, stop)
+            if item is _STOPPED:
+                return
+            if item is _END or isinstance(item, _Failure):
+                _put(out_queue, item, stop)
+                return
+            start_time = time.perf_counter()
+            try:
+                result = function(item)
+            except BaseException as e:
+                _put(out_queue, _Failure(e), stop)
+                return
+            stats.record(time.perf_counter() - start_time)
+            if not _put(out_queue, result, stop):
+                return
+            stats.sample_queue(out_queue.qsize())
+
+
+class _Failure:
+    """
+    An exception raised by one of the stages, passed down the pipeline to be raised on the consumer's thread.
+    """
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+_END = object()
+_STOPPED = object()
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Waits until there is room in the queue (backpressure), unless the pipeline is stopped.
+    :return: False if the pipeline was stopped.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _STOPPED
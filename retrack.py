@@ -0,0 +1,87 @@
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from CarsData import CarsData, DetectionBuffer
+from detection_cache import RawDetections
+from mathUtil import Line
+from roi import Polygon
+from sort import Sort, VectorizedSort
+
+
+def track_detections(detections: RawDetections, max_age=10, min_hits=3, iou_threshold=0.3, vectorized_sort=True,
+                     gated_association=False, fps=30, video_path="", frame_jump=1, start_frame=0) -> CarsData:
+    """
+    Tracks stored detections (e.g. from a DetectionCache) the same way as detect_from_video, without the video or the
+    model.
+    :param fps: The metadata of the returned CarsData.
+    """
+    tracker_class = VectorizedSort if vectorized_sort else Sort
+    motion_tracker = tracker_class(max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold,
+                                   gated=gated_association)
+    detection_buffer = DetectionBuffer()
+    for frame_num, frame_detections in enumerate(detections):
+        # rows of x_min, y_min, x_max, y_max, object_id
+        tracked_detections = motion_tracker.update(frame_detections)
+        detection_buffer.append(frame_num, tracked_detections[:, :4], tracked_detections[:, 4],
+                                detections.frame_width, detections.frame_height)
+    return CarsData(
+        df=detection_buffer.to_dataframe(),
+        fps=fps,
+        video_path=video_path,
+        frame_jump=frame_jump,
+        start_frame=start_frame
+    )
+
+
+def grid(**values: List) -> List[dict]:
+    """
+    Every combination of the given values, e.g. grid(max_age=[5, 10], min_hits=[1, 3]) gives 4 settings.
+    """
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def sweep(detections: RawDetections, settings: List[dict], lines: Optional[Dict[str, Line]] = None,
+          gates: Optional[Dict[str, Polygon]] = None, processes: Optional[int] = None) -> pd.DataFrame:
+    """
+    Tracks the detections with each of the settings in parallel processes, to compare them.
+    :param settings: Keyword arguments of track_detections, like the result of grid.
+    :param lines: Lines by name whose crossings are counted, see CarsData.count_crossings.
+    :param gates: Polygons by name whose crossings are counted.
+    :return: A row for each of the settings, with the settings, the number of tracks, and the number of crossings of
+    every line and gate, in total and by direction (the columns "<name>", "<name> forward" and "<name> backward").
+    """
+    # the detections are sent to each process once, instead of with every task
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                             initargs=(detections, lines, gates)) as executor:
+        rows = list(executor.map(_track_and_count, settings))
+    return pd.DataFrame(rows)
+
+
+_worker_detections: Optional[RawDetections] = None
+_worker_lines: Optional[Dict[str, Line]] = None
+_worker_gates: Optional[Dict[str, Polygon]] = None
+
+
+def _init_worker(detections: RawDetections, lines: Optional[Dict[str, Line]], gates: Optional[Dict[str, Polygon]]):
+    global _worker_detections, _worker_lines, _worker_gates
+    _worker_detections = detections
+    _worker_lines = lines
+    _worker_gates = gates
+
+
+def _track_and_count(settings: dict) -> dict:
+    cars_data = track_detections(_worker_detections, **settings)
+    row = {**settings, "tracks": int(np.unique(cars_data.df["object_id"].to_numpy()).size)}
+    for name, crossings in cars_data.count_crossings(_worker_lines, _worker_gates).items():
+        directions = crossings["direction"].to_numpy()
+        row[name] = len(crossings)
+        row[f"{name} forward"] = int(np.sum(directions == 1))
+        row[f"{name} backward"] = int(np.sum(directions == -1))
+    return row
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import json
+from typing import List, Tuple
+
+import numpy as np
+
+import mathUtil
+from mathUtil import Point
+
+Polygon = List[Point]
+
+
+class RegionOfInterest:
+    """
+    The part of a camera's frame where cars should be detected, as one or more polygons in normalized coordinates.
+    Only the bounding box of all the polygons is passed to the model, and detections whose center is outside every
+    polygon are dropped.
+    """
+    polygons: List[Polygon]
+
+    def __init__(self, polygons: List[Polygon]):
+        if len(polygons) == 0:
+            raise ValueError("A region of interest needs at least one polygon")
+        self.polygons = [[(float(x), float(y)) for x, y in polygon] for polygon in polygons]
+
+    @staticmethod
+    def from_rectangles(rectangles: List[Tuple[Point, Point]]) -> RegionOfInterest:
+        """
+        :param rectangles: Rectangles in ((x1, y1), (x2, y2)) format, given by two opposite corners.
+        """
+        return RegionOfInterest([[(x1, y1), (x2, y1), (x2, y2), (x1, y2)] for (x1, y1), (x2, y2) in rectangles])
+
+    @staticmethod
+    def from_file(filename: str) -> RegionOfInterest:
+        """
+        Loads a json file with a list of "polygons" and/or a list of "rectangles".
+        """
+        with open(filename) as file:
+            config = json.load(file)
+        polygons = list(config.get("polygons", []))
+        if "rectangles" in config:
+            polygons += RegionOfInterest.from_rectangles(config["rectangles"]).polygons
+        return RegionOfInterest(polygons)
+
+    def save(self, filename: str):
+        with open(filename, "w") as file:
+            json.dump({"polygons": self.polygons}, file)
+
+    def crop_box(self, frame_width: int, frame_height: int) -> Tuple[int, int, int, int]:
+        """
+        :return: The bounding box of all the polygons in pixels, as (x_min, y_min, x_max, y_max).
+        """
+        points = np.concatenate([np.array(polygon) for polygon in self.polygons])
+        x_min, y_min = np.clip(points.min(axis=0), 0, 1)
+        x_max, y_max = np.clip(points.max(axis=0), 0, 1)
+        return (int(np.floor(x_min * frame_width)), int(np.floor(y_min * frame_height)),
+                int(np.ceil(x_max * frame_width)), int(np.ceil(y_max * frame_height)))
+
+    def crop(self, frame: np.ndarray) -> np.ndarray:
+        """
+        :return: A view of the part of the frame that is passed to the model.
+        """
+        frame_height, frame_width = frame.shape[:2]
+        x_min, y_min, x_max, y_max = self.crop_box(frame_width, frame_height)
+        return frame[y_min:y_max, x_min:x_max]
+
+    def to_frame(self, detections: np.ndarray, frame_width: int, frame_height: int) -> np.ndarray:
+        """
+        Maps detections on the cropped frame back to the full frame, and drops the ones outside the polygons.
+        :param detections: rows of x_min, y_min, x_max, y_max, ... in pixels of the cropped frame.
+        :return: The same rows, in pixels of the full frame.
+        """
+        x_min, y_min, _, _ = self.crop_box(frame_width, frame_height)
+        detections = detections.copy()
+        detections[:, [0, 2]] += x_min
+        detections[:, [1, 3]] += y_min
+        return detections[self.contains((detections[:, 0] + detections[:, 2]) / (2 * frame_width),
+                                        (detections[:, 1] + detections[:, 3]) / (2 * frame_height))]
+
+    def contains(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Returns an array which is true where the normalized point (x, y) is inside at least one of the polygons.
+        """
+        inside = np.zeros(len(x), dtype=bool)
+        for polygon in self.polygons:
+            inside |= mathUtil.points_in_polygon(polygon, x, y)
+        return inside
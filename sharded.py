@@ -0,0 +1,165 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from CarsData import CarsData
+from VideoReader import VideoReader
+from detect_sort import detect_from_video
+
+
+class Shard:
+    """
+    A part of a video that is tracked by one process.
+    The shard reads overlap frames before the frames it owns, so that its tracks are already established at its first
+    owned frame, and can be matched with the tracks of the previous shard.
+    Frame numbers are counted in processed frames (after frame jumps) from the start of the whole run.
+    """
+    def __init__(self, read_start: int, owned_start: int, end: int):
+        self.read_start = read_start
+        self.owned_start = owned_start
+        self.end = end
+
+    def __repr__(self):
+        return f"Shard(read_start={self.read_start}, owned_start={self.owned_start}, end={self.end})"
+
+
+def plan_shards(num_frames: int, num_shards: int, overlap_frames: int) -> List[Shard]:
+    """
+    Splits num_frames frames into num_shards shards of about the same size.
+    """
+    bounds = np.linspace(0, num_frames, num_shards + 1).astype(int)
+    return [Shard(max(0, start - overlap_frames), start, end)
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def detect_from_video_sharded(model_factory: Callable, video_path: str, num_shards: int, overlap_seconds: float = 2,
+                              frame_jump = 1, duration_cutoff = None, start_frame = 0,
+                              processes: Optional[int] = None, match_iou_threshold = 0.5, min_matched_frames = 3,
+                              **detect_kwargs) -> CarsData:
+    """
+    Like detect_from_video, but splits the video into num_shards parts that are tracked by separate processes, and
+    stitches their tracks together into a single CarsData with unique object ids.
+
+    Each shard starts tracking overlap_seconds before the first frame it owns. The tracks of a shard are matched with the
+    tracks of the previous shard by how many frames of the overlap their boxes agree on, and take the previous shard's
+    ids. Tracks that aren't matched get new ids.
+    The result is the same as the serial run, except near the shard boundaries: a track that crosses a boundary but isn't
+    matched in the overlap (e.g. a car that is only detected in a few frames of it) is split into two ids, and the
+    segment between its last frame before the boundary and its first frame after it is lost. So a crossing count may
+    differ from the serial run by about the number of tracks that cross a line right at a shard boundary, which is
+    usually 0 or 1 per boundary.
+
+    :param model_factory: Creates the model in each process, since models can't be sent between processes. It must be
+    picklable, e.g. functools.partial(load_model, confidence_threshold=0.1). Give each model a share of the CPU threads
+    (like load_model's num_threads), or the processes compete for the same cores.
+    :param processes: The number of processes. One per shard by default.
+    :param match_iou_threshold: Boxes of two tracks must overlap by at least this much to agree on a frame.
+    :param min_matched_frames: Two tracks are only matched if they agree on at least this many frames.
+    :param detect_kwargs: Passed on to detect_from_video.
+    """
+    video = VideoReader(video_path, frame_jump=frame_jump, duration_cutoff=duration_cutoff, start_frame=start_frame)
+    # only opened for its frame rate and number of frames, the shards open their own readers
+    video.release()
+    overlap_frames = int(overlap_seconds * video.fps)
+    shards = plan_shards(video.num_frames, num_shards, overlap_frames)
+
+    # processes are spawned, since a forked process can't use the parent's CUDA context
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes or len(shards), mp_context=context) as executor:
+        futures = [executor.submit(_detect_shard, model_factory, video_path, shard, frame_jump, start_frame,
+                                   detect_kwargs)
+                   for shard in shards]
+        shard_results = [future.result() for future in futures]
+
+    df = stitch_shards(shards, [cars_data.df for cars_data in shard_results], match_iou_threshold, min_matched_frames)
+    return CarsData(
+        df=df,
+        fps=shard_results[0].fps,
+        video_path=video_path,
+        frame_jump=frame_jump,
+        start_frame=start_frame
+    )
+
+
+def _detect_shard(model_factory: Callable, video_path: str, shard: Shard, frame_jump: int, start_frame: int,
+                  detect_kwargs: dict) -> CarsData:
+    video = VideoReader(video_path, frame_jump=frame_jump, start_frame=start_frame + shard.read_start * frame_jump,
+                        max_frames=shard.end - shard.read_start)
+    return detect_from_video(model_factory(), video, **detect_kwargs)
+
+
+def stitch_shards(shards: List[Shard], shard_dfs: List[pd.DataFrame], match_iou_threshold = 0.5,
+                  min_matched_frames = 3) -> pd.DataFrame:
+    """
+    Merges the data of the shards into the DataFrame of the whole video. The frame numbers of each shard start from its
+    read_start.
+    """
+    parts = []
+    previous = None
+    next_id = 1
+    for shard, df in zip(shards, shard_dfs):
+        df = df.reset_index(drop=True)
+        df["frame_num"] += shard.read_start
+        object_ids = df["object_id"].to_numpy()
+        id_map: Dict[int, int] = {}
+        if previous is not None:
+            id_map = match_tracks(previous[previous["frame_num"] >= shard.read_start],
+                                  df[df["frame_num"] < shard.owned_start], match_iou_threshold, min_matched_frames)
+        # the ids that weren't matched get new ids, after all the ids of the previous shards
+        unique_ids = np.unique(object_ids)
+        unmatched_ids = unique_ids[~np.isin(unique_ids, list(id_map))]
+        id_map.update(zip(unmatched_ids.tolist(), range(next_id, next_id + len(unmatched_ids))))
+        next_id += len(unmatched_ids)
+        df["object_id"] = pd.Series(object_ids).map(id_map).to_numpy().astype(object_ids.dtype)
+
+        owned = df[df["frame_num"] >= shard.owned_start]
+        parts.append(owned)
+        previous = owned
+
+    df = pd.concat(parts, ignore_index=True)
+    frame_nums = df["frame_num"].to_numpy()
+    # the position of each detection within its frame
+    frame_offsets = np.searchsorted(frame_nums, frame_nums)
+    df.index = pd.MultiIndex.from_arrays([frame_nums, np.arange(len(df)) - frame_offsets], names=["frame", "index"])
+    return df
+
+
+def match_tracks(previous: pd.DataFrame, current: pd.DataFrame, iou_threshold = 0.5,
+                 min_matched_frames = 3) -> Dict[int, int]:
+    """
+    Matches the tracks of two shards over the frames that both of them tracked.
+    Two tracks agree on a frame if their boxes overlap by at least iou_threshold. Each track of the current shard is
+    matched to at most one track of the previous shard, greedily by the number of frames they agree on.
+    :return: The id in the previous shard by id in the current shard.
+    """
+    columns = ["frame_num", "object_id", "x_center", "y_center", "width", "height"]
+    pairs = previous[columns].merge(current[columns], on="frame_num", suffixes=("_previous", "_current"))
+    iou = _iou(*(pairs[f"{column}_previous"].to_numpy() for column in columns[2:]),
+               *(pairs[f"{column}_current"].to_numpy() for column in columns[2:]))
+    agreeing = pairs[iou >= iou_threshold]
+    matched_frames = agreeing.groupby(["object_id_current", "object_id_previous"]).size()
+    matched_frames = matched_frames[matched_frames >= min_matched_frames].sort_values(ascending=False, kind="stable")
+
+    id_map = {}
+    used_previous_ids = set()
+    for (current_id, previous_id), _ in matched_frames.items():
+        if current_id in id_map or previous_id in used_previous_ids:
+            continue
+        id_map[int(current_id)] = int(previous_id)
+        used_previous_ids.add(previous_id)
+    return id_map
+
+
+def _iou(x1: np.ndarray, y1: np.ndarray, w1: np.ndarray, h1: np.ndarray,
+         x2: np.ndarray, y2: np.ndarray, w2: np.ndarray, h2: np.ndarray) -> np.ndarray:
+    """
+    The intersection over union of boxes given by their centers and sizes.
+    """
+    width = np.minimum(x1 + w1 / 2, x2 + w2 / 2) - np.maximum(x1 - w1 / 2, x2 - w2 / 2)
+    height = np.minimum(y1 + h1 / 2, y2 + h2 / 2) - np.maximum(y1 - h1 / 2, y2 - h2 / 2)
+    intersection = np.maximum(width, 0) * np.maximum(height, 0)
+    union = w1 * h1 + w2 * h2 - intersection
+    return intersection / np.maximum(union, 1e-12)
@@ -19,11 +19,6 @@ from __future__ import print_function
 
 import os
 import numpy as np
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from skimage import io
 
 import glob
 import time
@@ -33,15 +28,23 @@ from filterpy.kalman import KalmanFilter
 np.random.seed(0)
 
 
+# look for lap once, instead of retrying the import on every frame
+try:
+  import lap
+except ImportError:
+  lap = None
+  from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
 def linear_assignment(cost_matrix):
-  try:
-    import lap
+  if lap is not None:
     _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-    return np.array([[y[i],i] for i in x if i >= 0]) #
-  except ImportError:
-    from scipy.optimize import linear_sum_assignment
-    x, y = linear_sum_assignment(cost_matrix)
-    return np.array(list(zip(x, y)))
+    assigned_columns = x[x >= 0]
+    return np.stack([y[assigned_columns], assigned_columns], axis=1)
+  x, y = linear_sum_assignment(cost_matrix)
+  return np.stack([x, y], axis=1)
 
 
 def iou_batch(bb_test, bb_gt):
@@ -156,6 +159,8 @@ def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3):
   Assigns detections to tracked object (both represented as bounding boxes)
 
   Returns 3 lists of matches, unmatched_detections and unmatched_trackers
+  The unmatched detections are in increasing order, so that the new tracks (and their ids) don't depend on how the
+  assignment solver breaks ties between the detections that aren't matched.
   """
   if(len(trackers)==0):
     return np.empty((0,2),dtype=int), np.arange(len(detections)), np.empty((0,5),dtype=int)
@@ -193,17 +198,118 @@ def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3):
   else:
     matches = np.concatenate(matches,axis=0)
 
-  return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+  return matches, np.array(sorted(unmatched_detections), dtype=int), np.array(unmatched_trackers)
+
+
+# the number of detection and tracker pairs from which gating is faster than comparing all the pairs
+GATING_MIN_PAIRS = 10000
+
+
+def overlapping_pairs(bb_test, bb_gt):
+  """
+  Sort-and-sweep gating: returns the indexes (i, j) of every pair of boxes bb_test[i], bb_gt[j] that overlap, which are
+  the only pairs with a positive IOU. The cost scales with the number of pairs that overlap along x, instead of
+  len(bb_test) * len(bb_gt).
+  """
+  if len(bb_test) == 0 or len(bb_gt) == 0:
+    return np.empty(0, dtype=int), np.empty(0, dtype=int)
+  order = np.argsort(bb_gt[:, 0], kind='stable')
+  x1_sorted = bb_gt[order, 0]
+  max_width = max(np.max(bb_gt[:, 2] - bb_gt[:, 0]), 0)
+  # a box can only overlap bb_test[i] along x if its x1 is in (x1 - max_width, x2)
+  start = np.searchsorted(x1_sorted, bb_test[:, 0] - max_width, side='right')
+  end = np.searchsorted(x1_sorted, bb_test[:, 2], side='left')
+  counts = np.maximum(end - start, 0)
+  test_indexes = np.repeat(np.arange(len(bb_test)), counts)
+  offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+  gt_indexes = order[np.repeat(start, counts) + offsets]
+
+  test, gt = bb_test[test_indexes], bb_gt[gt_indexes]
+  overlap = (np.minimum(test[:, 2], gt[:, 2]) > np.maximum(test[:, 0], gt[:, 0])) & \
+            (np.minimum(test[:, 3], gt[:, 3]) > np.maximum(test[:, 1], gt[:, 1]))
+  return test_indexes[overlap], gt_indexes[overlap]
+
+
+def iou_pairs(bb_test, bb_gt):
+  """
+  Computes the IOU of bb_test[i] and bb_gt[i] for every i, for boxes in the form [x1,y1,x2,y2]
+  """
+  w = np.maximum(0., np.minimum(bb_test[:, 2], bb_gt[:, 2]) - np.maximum(bb_test[:, 0], bb_gt[:, 0]))
+  h = np.maximum(0., np.minimum(bb_test[:, 3], bb_gt[:, 3]) - np.maximum(bb_test[:, 1], bb_gt[:, 1]))
+  wh = w * h
+  return wh / ((bb_test[:, 2] - bb_test[:, 0]) * (bb_test[:, 3] - bb_test[:, 1])
+    + (bb_gt[:, 2] - bb_gt[:, 0]) * (bb_gt[:, 3] - bb_gt[:, 1]) - wh)
+
+
+def associate_detections_to_trackers_gated(detections,trackers,iou_threshold = 0.3):
+  """
+  Same as associate_detections_to_trackers, but only computes the IOU of overlapping pairs, and solves the assignment
+  separately for every connected group of overlapping detections and trackers.
+  Groups of a single detection and a single tracker are matched directly.
+  The matches are the same (up to ties between equally good assignments), and so is the order of the unmatched detections.
+  Below GATING_MIN_PAIRS pairs, the dense version is faster, so it is used instead. It is also used when iou_threshold
+  isn't positive, since then pairs that don't overlap can be matches too.
+  """
+  num_detections, num_trackers = len(detections), len(trackers)
+  if num_trackers == 0 or num_detections * num_trackers < GATING_MIN_PAIRS or iou_threshold <= 0:
+    return associate_detections_to_trackers(detections, trackers, iou_threshold)
+
+  det_indexes, trk_indexes = overlapping_pairs(detections, trackers)
+  ious = iou_pairs(detections[det_indexes], trackers[trk_indexes])
+
+  above_threshold = ious > iou_threshold
+  if above_threshold.any() and \
+      np.bincount(det_indexes[above_threshold]).max() == 1 and np.bincount(trk_indexes[above_threshold]).max() == 1:
+    # the pairs above the threshold are already one to one
+    matched = np.flatnonzero(above_threshold)
+  else:
+    # connected components of the graph whose nodes are the detections followed by the trackers
+    graph = coo_matrix((np.ones(len(det_indexes)), (det_indexes, num_detections + trk_indexes)),
+                       shape=(num_detections + num_trackers,) * 2)
+    _, labels = connected_components(graph, directed=False)
+    pair_labels = labels[det_indexes]
+    num_labels = labels.max() + 1
+    component_detections = np.bincount(labels[:num_detections], minlength=num_labels)
+    component_trackers = np.bincount(labels[num_detections:], minlength=num_labels)
+    one_to_one = (component_detections == 1) & (component_trackers == 1)
+
+    matched = [np.flatnonzero(one_to_one[pair_labels])]
+    for label in np.unique(pair_labels[~one_to_one[pair_labels]]):
+      pairs = np.flatnonzero(pair_labels == label)
+      rows, row_indexes = np.unique(det_indexes[pairs], return_inverse=True)
+      cols, col_indexes = np.unique(trk_indexes[pairs], return_inverse=True)
+      iou_matrix = np.zeros((len(rows), len(cols)))
+      iou_matrix[row_indexes, col_indexes] = ious[pairs]
+      pair_matrix = np.full((len(rows), len(cols)), -1)
+      pair_matrix[row_indexes, col_indexes] = pairs
+      assignment = linear_assignment(-iou_matrix)
+      assigned_pairs = pair_matrix[assignment[:, 0], assignment[:, 1]]
+      # assignments between boxes that don't overlap are not matches
+      matched.append(assigned_pairs[assigned_pairs >= 0])
+    matched = np.concatenate(matched)
+
+  #filter out matched with low IOU
+  matched = matched[ious[matched] >= iou_threshold]
+  matches = np.stack([det_indexes[matched], trk_indexes[matched]], axis=1).astype(int)
+  matches = matches[np.argsort(matches[:, 0], kind='stable')]
+
+  unmatched_detections = np.ones(num_detections, dtype=bool)
+  unmatched_detections[matches[:, 0]] = False
+  unmatched_trackers = np.ones(num_trackers, dtype=bool)
+  unmatched_trackers[matches[:, 1]] = False
+  return matches, np.flatnonzero(unmatched_detections), np.flatnonzero(unmatched_trackers)
 
 
 class Sort(object):
-  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, gated=False):
     """
     Sets key parameters for SORT
+    gated: use associate_detections_to_trackers_gated, which only compares overlapping boxes
     """
     self.max_age = max_age
     self.min_hits = min_hits
     self.iou_threshold = iou_threshold
+    self.associate = associate_detections_to_trackers_gated if gated else associate_detections_to_trackers
     self.trackers = []
     self.frame_count = 0
 
@@ -229,7 +335,7 @@ class Sort(object):
     trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
     for t in reversed(to_del):
       self.trackers.pop(t)
-    matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets,trks, self.iou_threshold)
+    matched, unmatched_dets, unmatched_trks = self.associate(dets,trks, self.iou_threshold)
 
     # update matched trackers with assigned detections
     for m in matched:
@@ -252,6 +358,169 @@ class Sort(object):
       return np.concatenate(ret)
     return np.empty((0,5))
 
+  def live_ids(self):
+    """
+    Returns the object IDs (as in the output of update) of all the tracks that are still kept, including those that were
+    not output in the last frame.
+    """
+    return np.array([trk.id+1 for trk in self.trackers], dtype=int)
+
+def convert_bboxes_to_z(bboxes):
+  """
+  Vectorized convert_bbox_to_z: takes rows of [x1,y1,x2,y2] and returns rows of [x,y,s,r]
+  """
+  w = bboxes[:, 2] - bboxes[:, 0]
+  h = bboxes[:, 3] - bboxes[:, 1]
+  return np.stack([bboxes[:, 0] + w/2., bboxes[:, 1] + h/2., w * h, w / h], axis=1)
+
+
+def convert_xs_to_bboxes(xs):
+  """
+  Vectorized convert_x_to_bbox: takes rows of states starting with [x,y,s,r] and returns rows of [x1,y1,x2,y2]
+  """
+  w = np.sqrt(xs[:, 2] * xs[:, 3])
+  h = xs[:, 2] / w
+  return np.stack([xs[:, 0]-w/2., xs[:, 1]-h/2., xs[:, 0]+w/2., xs[:, 1]+h/2.], axis=1)
+
+
+class VectorizedSort(object):
+  """
+  Same as Sort, but keeps the Kalman filters of all the tracks as stacked arrays, and runs predict and update for all
+  of them at once instead of one KalmanBoxTracker at a time.
+  Uses the same constant velocity model and the same filterpy equations, so the output matches Sort's.
+  """
+  F = np.array([[1,0,0,0,1,0,0],[0,1,0,0,0,1,0],[0,0,1,0,0,0,1],[0,0,0,1,0,0,0],  [0,0,0,0,1,0,0],[0,0,0,0,0,1,0],[0,0,0,0,0,0,1]], dtype=float)
+  R = np.diag([1., 1., 10., 10.])
+  Q = np.diag([1., 1., 1., 1., 0.01, 0.01, 0.0001])
+  P0 = np.diag([10., 10., 10., 10., 10000., 10000., 10000.])
+
+  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, gated=False):
+    """
+    Sets key parameters for SORT
+    gated: use associate_detections_to_trackers_gated, which only compares overlapping boxes
+    """
+    self.max_age = max_age
+    self.min_hits = min_hits
+    self.iou_threshold = iou_threshold
+    self.associate = associate_detections_to_trackers_gated if gated else associate_detections_to_trackers
+    self.frame_count = 0
+    # the state of every track, in the same order as Sort.trackers
+    self.x = np.empty((0, 7))
+    self.P = np.empty((0, 7, 7))
+    self.ids = np.empty(0, dtype=int)
+    self.time_since_update = np.empty(0, dtype=int)
+    self.hits = np.empty(0, dtype=int)
+    self.hit_streak = np.empty(0, dtype=int)
+    self.age = np.empty(0, dtype=int)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def live_ids(self):
+    """
+    Returns the object IDs (as in the output of update) of all the tracks that are still kept, including those that were
+    not output in the last frame.
+    """
+    return self.ids + 1
+
+  def _predict(self):
+    """
+    Advances all the states, like KalmanBoxTracker.predict, and returns the predicted bounding boxes.
+    """
+    x = self.x
+    x[(x[:, 6] + x[:, 2]) <= 0, 6] *= 0.0
+    self.x = x @ self.F.T
+    self.P = self.F @ self.P @ self.F.T + self.Q
+    self.age += 1
+    self.hit_streak[self.time_since_update > 0] = 0
+    self.time_since_update += 1
+    return convert_xs_to_bboxes(self.x)
+
+  def _update(self, tracks, bboxes):
+    """
+    Updates the states of the given tracks with the observed bboxes, like KalmanBoxTracker.update.
+    """
+    if len(tracks) == 0:
+      return
+    self.time_since_update[tracks] = 0
+    self.hits[tracks] += 1
+    self.hit_streak[tracks] += 1
+
+    x = self.x[tracks]
+    P = self.P[tracks]
+    y = convert_bboxes_to_z(bboxes) - x[:, :4]
+    PHT = P[:, :, :4]
+    S = PHT[:, :4, :] + self.R
+    K = PHT @ np.linalg.inv(S)
+    self.x[tracks] = x + (K @ y[:, :, None])[:, :, 0]
+    I_KH = np.broadcast_to(np.eye(7), P.shape).copy()
+    I_KH[:, :, :4] -= K
+    self.P[tracks] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+
+  def _add(self, bboxes):
+    """
+    Starts a new track for every bbox, like KalmanBoxTracker.__init__.
+    """
+    count = len(bboxes)
+    if count == 0:
+      return
+    x = np.zeros((count, 7))
+    x[:, :4] = convert_bboxes_to_z(bboxes)
+    self.x = np.concatenate((self.x, x))
+    self.P = np.concatenate((self.P, np.broadcast_to(self.P0, (count, 7, 7))))
+    # share the id counter with KalmanBoxTracker, so ids are unique across both trackers
+    ids = np.arange(KalmanBoxTracker.count, KalmanBoxTracker.count + count)
+    KalmanBoxTracker.count += count
+    self.ids = np.concatenate((self.ids, ids))
+    self.time_since_update = np.concatenate((self.time_since_update, np.zeros(count, dtype=int)))
+    self.hits = np.concatenate((self.hits, np.zeros(count, dtype=int)))
+    self.hit_streak = np.concatenate((self.hit_streak, np.zeros(count, dtype=int)))
+    self.age = np.concatenate((self.age, np.zeros(count, dtype=int)))
+
+  def _keep(self, keep):
+    """
+    Removes the tracks where keep is False.
+    """
+    self.x = self.x[keep]
+    self.P = self.P[keep]
+    self.ids = self.ids[keep]
+    self.time_since_update = self.time_since_update[keep]
+    self.hits = self.hits[keep]
+    self.hit_streak = self.hit_streak[keep]
+    self.age = self.age[keep]
+
+  def update(self, dets=np.empty((0, 5))):
+    """
+    Same as Sort.update
+    """
+    self.frame_count += 1
+    # get predicted locations from existing trackers.
+    trks = self._predict()
+    valid = np.all(np.isfinite(trks), axis=1)
+    if not np.all(valid):
+      self._keep(valid)
+      trks = trks[valid]
+    trks = np.concatenate((trks, np.zeros((len(trks), 1))), axis=1)
+    matched, unmatched_dets, unmatched_trks = self.associate(dets,trks, self.iou_threshold)
+
+    # update matched trackers with assigned detections
+    self._update(matched[:, 1], dets[matched[:, 0], :])
+
+    # create and initialise new trackers for unmatched detections
+    self._add(dets[unmatched_dets.astype(int), :])
+
+    # the output is in the reverse order of the tracks, like in Sort.
+    order = np.arange(len(self) - 1, -1, -1)
+    d = convert_xs_to_bboxes(self.x[order])
+    output = (self.time_since_update[order] < 1) & \
+             ((self.hit_streak[order] >= self.min_hits) | (self.frame_count <= self.min_hits))
+    ret = np.concatenate((d[output], self.ids[order][output, None] + 1), axis=1)  # +1 as MOT benchmark requires positive
+    # remove dead tracklets
+    self._keep(self.time_since_update <= self.max_age)
+    if(len(ret)>0):
+      return ret
+    return np.empty((0,5))
+
 def parse_args():
     """Parse input arguments."""
     parser = argparse.ArgumentParser(description='SORT demo')
@@ -269,6 +538,13 @@ def parse_args():
     return args
 
 if __name__ == '__main__':
+  # only needed for the display, and slow to import for the modules that use the trackers
+  import matplotlib
+  matplotlib.use('TkAgg')
+  import matplotlib.pyplot as plt
+  import matplotlib.patches as patches
+  from skimage import io
+
   # all train
   args = parse_args()
   display = args.display
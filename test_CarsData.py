@@ -0,0 +1,161 @@
+import os
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+from CarsData import BINARY_EXTENSION, CarsData, DetectionBuffer, ObjectMarker
+from VideoReader import VideoReader
+from benchmarks import StubModel, _pass_line_times_groupby, synthetic_cars_data, synthetic_tracks, synthetic_traffic, \
+    write_synthetic_video
+from detect_sort import detect_from_video
+
+
+def test_binary_cache_is_only_converted_when_the_csv_changes(tmp_path, monkeypatch):
+    conversions = []
+    convert_to_binary = CarsData.convert_to_binary
+
+    def counting_convert_to_binary(*args):
+        conversions.append(args)
+        return convert_to_binary(*args)
+    monkeypatch.setattr(CarsData, "convert_to_binary", staticmethod(counting_convert_to_binary))
+
+    filename = str(tmp_path / "data.txt")
+    cars_data = synthetic_cars_data(num_frames=50, detections_per_frame=3)
+    cars_data.save_data(filename)
+    for _ in range(3):
+        loaded = CarsData.from_file(filename, use_binary_cache=True)
+    assert len(conversions) == 1
+    assert os.path.isdir(filename + BINARY_EXTENSION)
+    assert len(loaded.df) == len(cars_data.df)
+
+    # the csv is modified after the binary copy was written
+    csv_time = os.path.getmtime(filename)
+    for name in os.listdir(filename + BINARY_EXTENSION):
+        os.utime(os.path.join(filename + BINARY_EXTENSION, name), (csv_time - 10, csv_time - 10))
+    for _ in range(3):
+        CarsData.from_file(filename, use_binary_cache=True)
+    assert len(conversions) == 2
+
+
+def test_timestamps_are_saved_and_used_for_times(tmp_path):
+    cars_data = synthetic_cars_data(num_frames=50, detections_per_frame=3)
+    # frames that were read unevenly, as from a live stream
+    cars_data.timestamps = 1000 + np.cumsum(np.random.default_rng(0).uniform(0.01, 0.2, size=50))
+    for filename in [str(tmp_path / "data.txt"), str(tmp_path / ("data" + BINARY_EXTENSION))]:
+        cars_data.save_data(filename)
+        assert np.array_equal(CarsData.from_file(filename).timestamps, cars_data.timestamps)
+    assert np.allclose(cars_data.frame_seconds([0, 10]), [0, cars_data.timestamps[10] - cars_data.timestamps[0]])
+
+    cars_data.timestamps = None
+    assert np.allclose(cars_data.frame_seconds([0, 60]), [0, 60 / cars_data.fps])
+
+
+def cars_data_of_paths(paths):
+    """
+    A CarsData of objects at the given centers in consecutive frames.
+    :param paths: The first frame and the list of (x, y) centers of every object, by object id.
+    """
+    detection_buffer = DetectionBuffer()
+    last_frame = max(first_frame + len(centers) for first_frame, centers in paths.values())
+    for frame_num in range(last_frame):
+        frame_ids = [object_id for object_id, (first_frame, centers) in paths.items()
+                     if first_frame <= frame_num < first_frame + len(centers)]
+        boxes = np.array([[x - 0.01, y - 0.01, x + 0.01, y + 0.01]
+                          for object_id in frame_ids
+                          for x, y in [paths[object_id][1][frame_num - paths[object_id][0]]]]).reshape(-1, 4)
+        detection_buffer.append(frame_num, boxes, np.array(frame_ids), 1, 1)
+    return CarsData(df=detection_buffer.to_dataframe(), fps=30, video_path="paths.mp4", frame_jump=1, start_frame=0)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("line", [((0.2, 0.3), (0.8, 0.6)), ((0.5, 0.0), (0.5, 1.0)), ((0.0, 0.5), (1.0, 0.5))])
+def test_pass_line_times_is_the_same_as_the_groupby_implementation(seed, line):
+    cars_data = synthetic_tracks(num_tracks=300, num_frames=1000, seed=seed)
+    times, ids = cars_data.pass_line_times(line)
+    expected_times, expected_ids = _pass_line_times_groupby(cars_data, line)
+    assert len(ids) > 0
+    assert np.array_equal(times, expected_times)
+    assert ids == list(expected_ids)
+
+
+def test_pass_line_times_keeps_the_first_crossing_of_every_object():
+    line = ((0.5, 0.0), (0.5, 1.0))
+    cars_data = cars_data_of_paths({
+        # crosses forward, back, and forward again
+        1: (0, [(0.4, 0.5), (0.6, 0.5), (0.4, 0.5), (0.6, 0.5)]),
+        2: (2, [(0.7, 0.2), (0.3, 0.2)]),
+        3: (0, [(0.1, 0.1), (0.2, 0.1)]),
+    })
+    times, ids = cars_data.pass_line_times(line)
+    expected_times, expected_ids = _pass_line_times_groupby(cars_data, line)
+    assert times.tolist() == [1, 3]
+    assert ids == [1, 2]
+    assert np.array_equal(times, expected_times)
+    assert ids == list(expected_ids)
+
+
+def test_gates_count_every_object_in_and_out():
+    gate = [(0.4, 0.4), (0.6, 0.4), (0.6, 0.6), (0.4, 0.6)]
+    cars_data = cars_data_of_paths({
+        # drives through the gate
+        1: (0, [(0.3, 0.5), (0.5, 0.5), (0.5, 0.5), (0.7, 0.5)]),
+        # enters, leaves, and enters again
+        2: (1, [(0.5, 0.3), (0.5, 0.5), (0.5, 0.7), (0.5, 0.5)]),
+        # starts inside and leaves
+        3: (0, [(0.5, 0.45), (0.5, 0.2)]),
+    })
+    crossings = cars_data.count_crossings(gates={"gate": gate})["gate"]
+    assert crossings.values.tolist() == [[1, 1, 1], [1, 3, -1], [2, 2, 1], [3, 1, -1], [3, 2, -1]]
+
+
+@pytest.fixture(scope="module")
+def tracked_video(tmp_path_factory):
+    """
+    The data of a short synthetic video, tracked with StubModel.
+    """
+    path = str(tmp_path_factory.mktemp("video") / "synthetic.mp4")
+    write_synthetic_video(path, synthetic_traffic(num_frames=8, frame_size=(160, 120), num_cars=8),
+                          frame_size=(160, 120))
+    return detect_from_video(StubModel(min_area=4), VideoReader(path), motion_tracker_min_hits=1)
+
+
+def count_frames(path: str) -> int:
+    return sum(1 for _ in VideoReader(path).iter_frames())
+
+
+@pytest.mark.parametrize("processes", [2, 100])
+def test_parallel_rendering_has_the_same_frames(tracked_video, tmp_path, processes):
+    options = {"object_marker": ObjectMarker.RECTANGLE | ObjectMarker.DOT, "display_frame": True,
+               "counting_lines": {"line": ((0.5, 0.0), (0.5, 1.0))}}
+    tracked_video.save_video(str(tmp_path / "sequential.mp4"), **options)
+    # more processes than frames are limited to one per frame
+    tracked_video.save_video(str(tmp_path / "parallel.mp4"), processes=processes, **options)
+    num_frames = count_frames(str(tmp_path / "sequential.mp4"))
+    assert num_frames == int(tracked_video.num_frames())
+    assert count_frames(str(tmp_path / "parallel.mp4")) == num_frames
+
+
+@pytest.mark.parametrize("video_backend", ["opencv", pytest.param("ffmpeg", marks=pytest.mark.skipif(
+    shutil.which("ffmpeg") is None, reason="the ffmpeg backend requires ffmpeg"))])
+def test_the_video_writer_is_closed_when_rendering_fails(tracked_video, tmp_path, monkeypatch, video_backend):
+    import CarsData as CarsData_module
+    from VideoReader import VideoWriter
+
+    writers = []
+    monkeypatch.setattr(VideoWriter, "__enter__", lambda self: writers.append(self) or self)
+    add_caption = CarsData_module.add_caption
+
+    def failing_add_caption(image, text):
+        if text.startswith("Frame: 3"):
+            raise RuntimeError("drawing failed")
+        add_caption(image, text)
+    monkeypatch.setattr(CarsData_module, "add_caption", failing_add_caption)
+
+    with pytest.raises(RuntimeError, match="drawing failed"):
+        tracked_video.save_video(str(tmp_path / "failed.mp4"), object_marker=ObjectMarker.RECTANGLE,
+                                 display_frame=True, video_backend=video_backend, encode_queue_size=2)
+    assert not [thread for thread in threading.enumerate() if thread.name == "VideoWriter encoder"]
+    if video_backend == "ffmpeg":
+        assert writers[0]._encoder.encoder.process.poll() is not None
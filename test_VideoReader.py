@@ -0,0 +1,219 @@
+import shutil
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from VideoReader import VideoReader
+
+NUM_FRAMES = 120
+
+
+@pytest.fixture(scope="module")
+def video_path(tmp_path_factory):
+    """
+    A video whose frames all differ: a square that moves by a few pixels each frame on a noise background.
+    """
+    path = str(tmp_path_factory.mktemp("video") / "synthetic.mp4")
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, size=(96, 128, 3), dtype=np.uint8)
+    video_writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (128, 96))
+    for i in range(NUM_FRAMES):
+        frame = background.copy()
+        cv2.rectangle(frame, (i % 100, 20), (i % 100 + 20, 40), (0, 0, 255), thickness=-1)
+        cv2.putText(frame, str(i), (5, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        video_writer.write(frame)
+    video_writer.release()
+    return path
+
+
+def decode_all(path: str):
+    """
+    Every frame of the video, decoded one by one with read().
+    """
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        found_frame, frame = capture.read()
+        if not found_frame:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+@pytest.mark.parametrize("frame_jump, start_frame, seek_threshold", [
+    (1, 0, 300),
+    (3, 0, 300),
+    (1, 17, 300),
+    (4, 10, 300),
+    # every skip is done by seeking
+    (5, 50, 1),
+    (30, 0, 1),
+    # the start is seeked to, the frame jumps are grabbed
+    (2, 61, 20),
+])
+def test_skipping_returns_the_decoded_frames(video_path, frame_jump, start_frame, seek_threshold):
+    all_frames = decode_all(video_path)
+    # like the loop of read() calls that VideoReader replaced: frame_jump - 1 frames are skipped before every frame
+    expected = all_frames[start_frame + frame_jump - 1::frame_jump][:len(all_frames) // frame_jump]
+    frames = list(VideoReader(video_path, frame_jump=frame_jump, start_frame=start_frame,
+                              seek_threshold=seek_threshold).iter_frames())
+    assert len(frames) == len(expected)
+    for frame, expected_frame in zip(frames, expected):
+        assert np.array_equal(frame, expected_frame)
+
+
+def test_prefetched_frames_are_the_same(video_path):
+    expected = [frame.copy() for frame in VideoReader(video_path, frame_jump=2, start_frame=5).iter_frames()]
+    frames = [frame.copy() for frame in VideoReader(video_path, frame_jump=2, start_frame=5, prefetch=3).iter_frames()]
+    assert len(frames) == len(expected)
+    for frame, expected_frame in zip(frames, expected):
+        assert np.array_equal(frame, expected_frame)
+
+
+def test_seeking_is_used(video_path, monkeypatch):
+    seek_results = []
+    seek = VideoReader._seek
+
+    def recording_seek(self, n):
+        seek_results.append(seek(self, n))
+        return seek_results[-1]
+    monkeypatch.setattr(VideoReader, "_seek", recording_seek)
+    expected = decode_all(video_path)[40 + 9::10]
+    frames = list(VideoReader(video_path, frame_jump=10, start_frame=40, seek_threshold=5).iter_frames())
+    assert any(seek_results)
+    assert len(frames) == len(expected)
+    for frame, expected_frame in zip(frames, expected):
+        assert np.array_equal(frame, expected_frame)
+
+
+def test_grabs_when_seeking_fails(video_path, monkeypatch):
+    """
+    Sources that can't seek fall back to grabbing the frames.
+    """
+    monkeypatch.setattr(VideoReader, "_seek", lambda self, n: False)
+    expected = decode_all(video_path)[40 + 9::10]
+    frames = list(VideoReader(video_path, frame_jump=10, start_frame=40, seek_threshold=5).iter_frames())
+    assert len(frames) == len(expected)
+    for frame, expected_frame in zip(frames, expected):
+        assert np.array_equal(frame, expected_frame)
+
+
+def test_live_reader_without_duration_cutoff(video_path):
+    """
+    A live stream without a duration cutoff is tracked until it ends, and the time of every frame is kept.
+    """
+    from VideoReader import LiveVideoReader
+    from benchmarks import StubModel
+    from detect_sort import detect_from_video
+
+    video = LiveVideoReader(video_path, max_reconnects=0)
+    cars_data = detect_from_video(StubModel(), video)
+    assert 0 < len(video.timestamps) <= NUM_FRAMES
+    assert np.array_equal(cars_data.timestamps, video.timestamps)
+
+
+@pytest.fixture(scope="module")
+def fast_video_path(tmp_path_factory):
+    """
+    A short video with a high frame rate, so that reading it at its frame rate is quick.
+    """
+    path = str(tmp_path_factory.mktemp("video") / "fast.mp4")
+    video_writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 200, (64, 48))
+    for i in range(100):
+        # the index of every frame is its brightness
+        video_writer.write(np.full((48, 64, 3), 2 * i, dtype=np.uint8))
+    video_writer.release()
+    return path
+
+
+def test_live_reader_drops_frames_for_a_slow_consumer(fast_video_path):
+    from VideoReader import LiveVideoReader
+
+    video = LiveVideoReader(fast_video_path, max_reconnects=0, pace=True)
+    frames = []
+    for frame in video.iter_frames():
+        frames.append(round(frame.mean() / 2))
+        # three frames of the stream go by while every frame is processed
+        time.sleep(3 / 200)
+    assert video.frames_read == 100
+    assert video.frames_dropped > 0
+    assert len(frames) + video.frames_dropped == video.frames_read
+    assert video.frame_jump > 1
+    # the frames are always the latest, so they are in order and skip ahead
+    assert all(later > earlier for earlier, later in zip(frames, frames[1:]))
+    assert np.all(np.diff(video.timestamps) > 0)
+
+
+def test_live_reader_keeps_up_with_a_fast_consumer(fast_video_path):
+    from VideoReader import LiveVideoReader
+
+    video = LiveVideoReader(fast_video_path, max_reconnects=0, pace=True)
+    frames = list(video.iter_frames())
+    assert video.frames_read == 100
+    assert len(frames) + video.frames_dropped == 100
+    # paced at 200 fps, a consumer that doesn't do anything gets most of the frames
+    assert video.frames_dropped < 30
+    assert video.frame_jump == 1
+
+
+@pytest.mark.parametrize("max_reconnects", [0, 2])
+def test_live_reader_reconnects_at_most_max_reconnects_times(fast_video_path, max_reconnects):
+    from VideoReader import LiveVideoReader
+
+    # the end of the file stands in for the stream ending, which is reopened
+    video = LiveVideoReader(fast_video_path, max_reconnects=max_reconnects, reconnect_delay=0, pace=True)
+    list(video.iter_frames())
+    assert video.reconnects == max_reconnects
+    assert video.frames_read == 100 * (max_reconnects + 1)
+
+
+def ffmpeg_backend():
+    return pytest.param("ffmpeg", marks=pytest.mark.skipif(shutil.which("ffmpeg") is None,
+                                                          reason="the ffmpeg backend requires ffmpeg"))
+
+
+def writer_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "VideoWriter encoder"]
+
+
+@pytest.mark.parametrize("backend", ["opencv", ffmpeg_backend()])
+@pytest.mark.parametrize("queue_size", [0, 3])
+def test_writer_converts_rgb_but_not_bgr(tmp_path, backend, queue_size):
+    from PIL import Image
+    from VideoReader import VideoWriter
+
+    path = str(tmp_path / "written.mp4")
+    red_rgb = np.zeros((48, 64, 3), dtype=np.uint8)
+    red_rgb[..., 0] = 200
+    with VideoWriter(path, 30, (64, 48), backend=backend, queue_size=queue_size) as video_writer:
+        for _ in range(5):
+            video_writer.write(red_rgb)
+            video_writer.write(Image.fromarray(red_rgb))
+            video_writer.write_bgr(red_rgb[..., ::-1])
+        with pytest.raises(ValueError):
+            video_writer.write_bgr(np.zeros((10, 10, 3), dtype=np.uint8))
+    assert not writer_threads()
+
+    frames = decode_all(path)
+    assert len(frames) == 15
+    for frame in frames:
+        # red in BGR
+        assert np.allclose(frame.mean(axis=(0, 1)), [0, 0, 200], atol=10)
+
+
+@pytest.mark.parametrize("backend", ["opencv", ffmpeg_backend()])
+def test_writer_is_closed_when_writing_fails(tmp_path, backend):
+    from VideoReader import VideoWriter
+
+    with pytest.raises(RuntimeError, match="drawing failed"):
+        with VideoWriter(str(tmp_path / "failed.mp4"), 30, (64, 48), backend=backend, queue_size=3) as video_writer:
+            video_writer.write_bgr(np.zeros((48, 64, 3), dtype=np.uint8))
+            raise RuntimeError("drawing failed")
+    assert not writer_threads()
+    encoder = video_writer._encoder.encoder
+    if backend == "ffmpeg":
+        assert encoder.process.poll() is not None
@@ -0,0 +1,88 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import cli
+import paths
+from benchmarks import StubModel, synthetic_tracks, synthetic_traffic, write_synthetic_video
+from detection_cache import DetectionCache, RawDetections
+
+
+def write_config(path, **settings) -> str:
+    with open(path, "w") as file:
+        json.dump(settings, file)
+    return str(path)
+
+
+def test_config_defaults(tmp_path):
+    config = cli.CameraConfig.from_file(write_config(tmp_path / "camera.json", video="camera.mp4",
+                                                     data="out/data.txt", tracker={"min_hits": 1},
+                                                     lines={"line": [[0.5, 0], [0.5, 1]]}))
+    assert config.video == "camera.mp4"
+    assert config.roi == paths.roi_path
+    assert config.lines == {"line": ((0.5, 0), (0.5, 1))}
+    assert config.gates == {}
+    assert config.tracker == {"max_age": 10, "min_hits": 1, "iou_threshold": 0.3}
+    assert config.model == {"confidence_threshold": 0.1, "iou_threshold": 0.3, "class_agnostic": True}
+    assert config.detections == "out/data.txt.detections.npz"
+    assert (config.frame_jump, config.start_frame, config.duration_cutoff) == (1, 0, None)
+    assert (config.batch_size, config.workers, config.prefetch) == (1, 1, 4)
+
+
+def test_example_config_is_valid():
+    config = cli.CameraConfig.from_file(os.path.join(os.path.dirname(cli.__file__), "camera.example.json"))
+    assert config.model["model_size"] == "x"
+
+
+def test_unknown_settings_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match="frame_skip"):
+        cli.CameraConfig.from_file(write_config(tmp_path / "camera.json", frame_skip=2))
+
+
+def test_count_doesnt_import_torch_or_opencv(tmp_path):
+    data_path = str(tmp_path / "data.txt")
+    synthetic_tracks(num_tracks=200, num_frames=1000).save_data(data_path)
+    config_path = write_config(tmp_path / "camera.json", data=data_path, lines={"line": [[0.5, 0], [0.5, 1]]},
+                               gates={"box": [[0.3, 0.3], [0.7, 0.3], [0.7, 0.7], [0.3, 0.7]]})
+    output_path = str(tmp_path / "crossings.csv")
+    # in a new interpreter, since this one already imported opencv for the other tests
+    script = f"""
+import sys
+sys.argv = ["cli.py", "count", {config_path!r}, "--output", {output_path!r}]
+import cli
+cli.main()
+assert "cv2" not in sys.modules, "cv2 was imported"
+assert "torch" not in sys.modules, "torch was imported"
+"""
+    result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(cli.__file__)),
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert lines[0].startswith("line: ") and lines[1].startswith("box: ")
+    assert os.path.exists(output_path)
+
+
+def test_detect_keeps_the_detections_without_reading_the_video_again(tmp_path, monkeypatch):
+    video_path = str(tmp_path / "synthetic.mp4")
+    write_synthetic_video(video_path, synthetic_traffic(num_frames=30, frame_size=(320, 240), num_cars=10),
+                          frame_size=(320, 240))
+    config = cli.CameraConfig(video=video_path, roi=None, data=str(tmp_path / "new" / "data.txt"),
+                              detection_cache=str(tmp_path / "cache"), tracker={"min_hits": 1})
+    monkeypatch.setattr(cli.CameraConfig, "model_factory", lambda self, num_threads=None: StubModel)
+    keys = []
+    key = DetectionCache.key
+    monkeypatch.setattr(DetectionCache, "key", lambda self, *args: keys.append(key(self, *args)) or keys[-1])
+
+    for _ in range(2):
+        cli.detect(config)
+    # once for each run, whether the detections are in the cache or not
+    assert len(keys) == 2 and keys[0] == keys[1]
+    detections = RawDetections.load(config.detections)
+    cached_detections = DetectionCache(config.detection_cache).load(keys[0])
+    assert len(detections) == len(cached_detections) == 30
+    assert np.array_equal(detections.rows, cached_detections.rows)
+    assert os.path.exists(config.data)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from VideoReader import VideoReader
+from benchmarks import StubModel, synthetic_traffic, write_synthetic_video
+from detect_sort import detect_from_video
+from detection_cache import DetectionCache
+
+
+@pytest.fixture(scope="module")
+def video_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("video") / "synthetic.mp4")
+    write_synthetic_video(path, synthetic_traffic(num_frames=60, frame_size=(320, 240), num_cars=10),
+                          frame_size=(320, 240))
+    return path
+
+
+def test_cache_hit_gives_the_same_data_without_reading_the_video(video_path, tmp_path):
+    cache = DetectionCache(str(tmp_path / "cache"))
+    model = StubModel()
+    first = detect_from_video(model, VideoReader(video_path), cache=cache)
+
+    video = VideoReader(video_path)
+    second = detect_from_video(model, video, cache=cache)
+    assert not video._capture.isOpened()
+    assert len(first.df) == len(second.df)
+    # object ids continue between runs of sort
+    first_ids, second_ids = first.df["object_id"].to_numpy(), second.df["object_id"].to_numpy()
+    assert np.array_equal(first_ids - first_ids.min(), second_ids - second_ids.min())
+    columns = ["x_center", "y_center", "width", "height", "frame_num"]
+    assert np.array_equal(first.df[columns].to_numpy(), second.df[columns].to_numpy())
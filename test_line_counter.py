@@ -0,0 +1,94 @@
+import numpy as np
+
+from CarsData import CarsData, DetectionBuffer
+from benchmarks import synthetic_detections, synthetic_traffic
+from line_counter import LineCounter
+from sort import VectorizedSort
+from test_CarsData import cars_data_of_paths
+
+
+def stream(cars_data, counter: LineCounter):
+    """
+    Gives the counter the detections of every frame of the data, as the tracker would have output them.
+    :return: All the crossings, in the order they were found.
+    """
+    crossings = []
+    for frame_num in range(int(cars_data.num_frames()) + 1):
+        view = cars_data.by_frame(frame_num)
+        tracked_detections = np.stack((view.x_center - view.width / 2, view.y_center - view.height / 2,
+                                       view.x_center + view.width / 2, view.y_center + view.height / 2,
+                                       view.object_id), axis=1).astype(float)
+        crossings += counter.update(frame_num, tracked_detections, 1, 1)
+    return crossings
+
+
+def test_gates_count_every_object_in_and_out():
+    gate = [(0.4, 0.4), (0.6, 0.4), (0.6, 0.6), (0.4, 0.6)]
+    cars_data = cars_data_of_paths({
+        1: (0, [(0.3, 0.5), (0.5, 0.5), (0.5, 0.5), (0.7, 0.5)]),
+        2: (1, [(0.5, 0.3), (0.5, 0.5), (0.5, 0.7), (0.5, 0.5)]),
+    })
+    counter = LineCounter(gates={"gate": gate})
+    crossings = stream(cars_data, counter)
+    assert [(crossing.frame_num, crossing.object_id, crossing.direction) for crossing in crossings] == \
+        [(1, 1, 1), (2, 2, 1), (3, 1, -1), (3, 2, -1)]
+    assert counter.counts == {"gate": {1: 2, -1: 2}}
+
+
+def test_streamed_crossings_are_the_same_as_count_crossings():
+    lines = {"diagonal": ((0.2, 0.3), (0.8, 0.6)), "vertical": ((0.5, 0.0), (0.5, 1.0))}
+    gates = {"box": [(0.3, 0.3), (0.7, 0.3), (0.7, 0.7), (0.3, 0.7)], "triangle": [(0.1, 0.9), (0.5, 0.2), (0.9, 0.9)]}
+    frame_width, frame_height = 1280, 720
+    detections = synthetic_detections(synthetic_traffic(num_frames=300, frame_size=(frame_width, frame_height),
+                                                        num_cars=60), miss_rate=0.1)
+    tracker = VectorizedSort(max_age=5, min_hits=2)
+    counter = LineCounter(lines, gates, max_age=5)
+    detection_buffer = DetectionBuffer()
+    crossings = []
+    for frame_num, frame_detections in enumerate(detections):
+        tracked_detections = tracker.update(frame_detections)
+        detection_buffer.append(frame_num, tracked_detections[:, :4], tracked_detections[:, 4], frame_width,
+                                frame_height)
+        crossings += counter.update(frame_num, tracked_detections, frame_width, frame_height,
+                                    live_ids=tracker.live_ids())
+        # only the tracks that the tracker still keeps are remembered
+        assert set(counter._positions) <= set(tracker.live_ids().tolist())
+        assert set(counter._crossed) <= set(counter._positions)
+    cars_data = CarsData(df=detection_buffer.to_dataframe(), fps=30, video_path="synthetic.mp4", frame_jump=1,
+                         start_frame=0)
+
+    expected = cars_data.count_crossings(lines, gates)
+    for name in [*lines, *gates]:
+        streamed = sorted((crossing.frame_num, crossing.object_id, crossing.direction)
+                          for crossing in crossings if crossing.name == name)
+        assert len(streamed) > 0
+        assert streamed == sorted(map(tuple, expected[name][["frame_num", "object_id", "direction"]].values.tolist()))
+        assert counter.counts[name] == {1: int((expected[name]["direction"] == 1).sum()),
+                                        -1: int((expected[name]["direction"] == -1).sum())}
+
+
+def test_tracks_are_forgotten_when_they_leave_live_ids():
+    counter = LineCounter(lines={"line": ((0.5, 0.0), (0.5, 1.0))})
+    counter.update(0, np.array([[0.3, 0.4, 0.35, 0.45, 1], [0.1, 0.1, 0.2, 0.2, 2]]), 1, 1, live_ids=np.array([1, 2]))
+    assert [crossing.object_id for crossing in
+            counter.update(1, np.array([[0.6, 0.4, 0.65, 0.45, 1]]), 1, 1, live_ids=np.array([1, 2]))] == [1]
+    assert len(counter) == 2
+    # 2 wasn't output, but the tracker still keeps it
+    counter.update(2, np.empty((0, 5)), 1, 1, live_ids=np.array([1, 2]))
+    assert len(counter) == 2
+    counter.update(3, np.empty((0, 5)), 1, 1, live_ids=np.array([2]))
+    assert len(counter) == 1
+    assert 1 not in counter._crossed
+    counter.update(4, np.empty((0, 5)), 1, 1, live_ids=np.empty(0, dtype=int))
+    assert len(counter) == 0
+    assert counter._crossed == {}
+
+
+def test_tracks_are_forgotten_after_max_age_without_live_ids():
+    counter = LineCounter(lines={"line": ((0.5, 0.0), (0.5, 1.0))}, max_age=2)
+    counter.update(0, np.array([[0.3, 0.4, 0.35, 0.45, 1]]), 1, 1)
+    for frame_num in range(1, 3):
+        counter.update(frame_num, np.empty((0, 5)), 1, 1)
+        assert len(counter) == 1
+    counter.update(3, np.empty((0, 5)), 1, 1)
+    assert len(counter) == 0
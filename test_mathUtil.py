@@ -0,0 +1,94 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+import mathUtil
+
+
+def reference_lines_cross(p1, p2, q1, q2, include_endpoints: bool) -> bool:
+    """
+    The textbook orientation test in exact rational arithmetic.
+    """
+    def orientation(a, b, c):
+        a, b, c = ([Fraction(float(value)) for value in point] for point in (a, b, c))
+        value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (value > 0) - (value < 0)
+
+    o1, o2 = orientation(p1, p2, q1), orientation(p1, p2, q2)
+    o3, o4 = orientation(q1, q2, p1), orientation(q1, q2, p2)
+    if not include_endpoints:
+        return o1 * o2 < 0 and o3 * o4 < 0
+    if o1 * o2 > 0 or o3 * o4 > 0:
+        return False
+    if o1 == 0 and o2 == 0:
+        # on the same line: they touch if their bounding boxes overlap
+        return (max(min(p1[0], p2[0]), min(q1[0], q2[0])) <= min(max(p1[0], p2[0]), max(q1[0], q2[0])) and
+                max(min(p1[1], p2[1]), min(q1[1], q2[1])) <= min(max(p1[1], p2[1]), max(q1[1], q2[1])))
+    return True
+
+
+@pytest.mark.parametrize("seed", range(9))
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("include_endpoints", [False, True])
+def test_matches_exact_reference(seed, dtype, include_endpoints):
+    """
+    Points on a coarse grid make vertical, parallel, collinear, touching and zero length segments common. The grid
+    values are exact in binary, so the products of the kernel are exact too.
+    """
+    rng = np.random.default_rng(seed)
+    grid = [2, 4, 8][seed % 3]
+    lines = rng.integers(0, grid + 1, size=(4, 2, 2)).astype(float) / grid
+    segments = (rng.integers(0, grid + 1, size=(4, 200)) / grid).astype(dtype)
+
+    crosses = mathUtil.lines_cross(lines, *segments, include_endpoints=include_endpoints)
+    assert crosses.shape == (4, 200)
+    for m, line in enumerate(lines):
+        single_line_crosses = mathUtil.lines_cross(line.tolist(), *segments, include_endpoints=include_endpoints)
+        assert np.array_equal(single_line_crosses, crosses[m])
+        for n in range(segments.shape[1]):
+            expected = reference_lines_cross(line[0], line[1], segments[:2, n], segments[2:, n], include_endpoints)
+            assert crosses[m, n] == expected, (line, segments[:, n])
+
+
+LINE = ((0.0, 0.0), (1.0, 1.0))
+
+
+@pytest.mark.parametrize("segment, crosses, touches", [
+    # a proper crossing
+    ((0.0, 1.0, 1.0, 0.0), True, True),
+    # parallel and apart
+    ((0.0, 0.5, 0.5, 1.0), False, False),
+    # collinear and overlapping
+    ((0.5, 0.5, 2.0, 2.0), False, True),
+    # collinear and apart
+    ((2.0, 2.0, 3.0, 3.0), False, False),
+    # touching at a shared endpoint
+    ((1.0, 1.0, 2.0, 0.0), False, True),
+    # one endpoint on the middle of the line
+    ((0.5, 0.5, 1.0, 0.0), False, True),
+    # would cross if the line were longer
+    ((2.0, 3.0, 3.0, 2.0), False, False),
+    # a point on the line
+    ((0.5, 0.5, 0.5, 0.5), False, True),
+    # a point off the line
+    ((0.5, 0.2, 0.5, 0.2), False, False),
+])
+def test_special_cases(segment, crosses, touches):
+    assert mathUtil.lines_cross(LINE, *segment) == crosses
+    assert mathUtil.lines_cross(LINE, *segment, include_endpoints=True) == touches
+
+
+def test_vertical_line():
+    vertical = ((0.5, 0.0), (0.5, 1.0))
+    assert mathUtil.lines_cross(vertical, 0.4, 0.5, 0.6, 0.5)
+    assert not mathUtil.lines_cross(vertical, 0.4, 0.5, 0.4, 0.5)
+
+
+def test_result_types():
+    assert isinstance(mathUtil.lines_cross(LINE, 0.0, 1.0, 1.0, 0.0), np.bool_)
+    x = np.random.default_rng(0).uniform(0, 1, size=(4, 1000))
+    lines = [LINE, ((0.5, 0.0), (0.6, 1.0))]
+    out = np.empty((2, 1000), dtype=bool)
+    assert mathUtil.lines_cross(lines, *x, out=out) is out
+    assert np.array_equal(out, mathUtil.lines_cross(lines, *x))
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def disable_metrics():
+    yield
+    metrics.disable()
+
+
+def test_quantiles_are_the_upper_bounds_of_their_buckets():
+    histogram = metrics.Histogram((1, 2, 5, 10))
+    for value in [0.5] * 50 + [1.5] * 30 + [4] * 15 + [20] * 5:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.8) == 2
+    assert histogram.quantile(0.95) == 5
+    # above all the bounds, the largest value is the best estimate
+    assert histogram.quantile(0.99) == 20
+    # and a bound is never above the largest value
+    small = metrics.Histogram((1, 2, 5, 10))
+    small.observe(3)
+    assert small.quantile(0.5) == 3
+
+
+def test_summary_buckets_include_the_values_above_all_bounds():
+    histogram = metrics.Histogram((1, 10))
+    for value in [0.5, 5, 20, 30]:
+        histogram.observe(value)
+    summary = histogram.summary()
+    assert summary["buckets"] == {"1": 1, "10": 1, "+Inf": 2}
+    assert sum(summary["buckets"].values()) == summary["count"] == 4
+    assert (summary["min"], summary["max"], summary["mean"]) == (0.5, 30, 55.5 / 4)
+    assert metrics.Histogram((1,)).summary()["p50"] is None
+
+
+def test_gauges_keep_the_last_and_largest_value():
+    recorded = metrics.enable()
+    for value in [3, 7, 2]:
+        metrics.gauge("live_tracks", value)
+    assert recorded.summary()["gauges"] == {"live_tracks": {"last": 2, "max": 7}}
+
+
+def test_prometheus_text_format():
+    recorded = metrics.enable()
+    metrics.count("frames", 3)
+    metrics.gauge("live_tracks", 5)
+    metrics.gauge("live_tracks", 4)
+    for value in [0, 3, 2000]:
+        metrics.observe("detections_per_frame", value, metrics.COUNT_BUCKETS)
+    lines = recorded.to_prometheus().splitlines()
+
+    assert "# TYPE carstats_frames_total counter" in lines
+    assert "carstats_frames_total 3" in lines
+    assert "# TYPE carstats_live_tracks gauge" in lines
+    assert "carstats_live_tracks 4" in lines
+    assert "carstats_live_tracks_max 5" in lines
+    assert "# TYPE carstats_detections_per_frame histogram" in lines
+    # the buckets are cumulative, and +Inf counts every value
+    assert 'carstats_detections_per_frame_bucket{le="0"} 1' in lines
+    assert 'carstats_detections_per_frame_bucket{le="5"} 2' in lines
+    assert 'carstats_detections_per_frame_bucket{le="1000"} 2' in lines
+    assert 'carstats_detections_per_frame_bucket{le="+Inf"} 3' in lines
+    assert "carstats_detections_per_frame_sum 2003.0" in lines
+    assert "carstats_detections_per_frame_count 3" in lines
+    for line in lines:
+        # every sample is a name, optional labels and a number
+        if not line.startswith("#"):
+            float(line.rsplit(" ", 1)[1])
+    memory_lines = [line for line in lines if line.startswith("carstats_peak_memory_bytes ")]
+    if metrics.peak_memory_bytes() is None:
+        assert memory_lines == []
+    else:
+        assert len(memory_lines) == 1 and int(memory_lines[0].split()[1]) > 0
+
+
+def test_timers_record_seconds():
+    recorded = metrics.enable()
+    with metrics.timer("decode"):
+        time.sleep(0.01)
+
+    @metrics.timed("encode")
+    def encode():
+        return "encoded"
+    assert encode() == "encoded"
+    histograms = recorded.summary()["histograms"]
+    assert histograms["decode_seconds"]["count"] == 1
+    assert histograms["decode_seconds"]["min"] >= 0.01
+    assert histograms["encode_seconds"]["count"] == 1
+
+
+def test_nothing_is_recorded_while_disabled():
+    metrics.disable()
+    assert metrics.current() is None
+    metrics.count("frames")
+    metrics.gauge("live_tracks", 1)
+    metrics.observe("render_seconds", 1)
+    assert metrics.timer("decode") is metrics._NULL_TIMER
+    with metrics.timer("decode"):
+        pass
+
+    @metrics.timed("encode")
+    def encode():
+        return "encoded"
+    assert encode() == "encoded"
+    assert metrics.current() is None
+
+    # enabling starts from nothing
+    assert metrics.enable().summary()["counters"] == {}
@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pytest
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+from onnx_model import COCO_NAMES, OnnxModel, _nms, _scale_boxes, letterbox
+
+CAR = COCO_NAMES.index("car")
+TRUCK = COCO_NAMES.index("truck")
+PERSON = COCO_NAMES.index("person")
+
+
+def fixed_output_model(path: str, rows: np.ndarray, input_size=(640, 640)):
+    """
+    Saves an onnx model that ignores its input and always outputs the rows, in the format of yolov5:
+    x_center, y_center, width, height, objectness, class scores... in pixels of the letterboxed image.
+    """
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper, numpy_helper
+
+    output = np.zeros((1, len(rows), 5 + len(COCO_NAMES)), dtype=np.float32)
+    output[0, :, :rows.shape[1]] = rows
+    graph = helper.make_graph(
+        [helper.make_node("Shape", ["images"], ["shape"]),
+         helper.make_node("Constant", [], ["output"], value=numpy_helper.from_array(output))],
+        "fixed_output",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, [1, 3, *input_size])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, list(output.shape))])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 7
+    onnx.save(model, path)
+    return path
+
+
+def prediction(x_center, y_center, width, height, confidence, class_index):
+    row = np.zeros(5 + len(COCO_NAMES), dtype=np.float32)
+    row[:5] = (x_center, y_center, width, height, 1)
+    row[5 + class_index] = confidence
+    return row
+
+
+def test_letterbox_keeps_the_aspect_ratio():
+    image = np.zeros((480, 960, 3), dtype=np.uint8)
+    padded, gain, (left, top) = letterbox(image, (640, 640))
+    assert padded.shape == (640, 640, 3)
+    assert gain == pytest.approx(640 / 960)
+    assert (left, top) == (0, 160)
+
+
+def test_scale_boxes_inverts_letterbox():
+    rng = np.random.default_rng(0)
+    height, width = 720, 1280
+    gain = 640 / 1280
+    padding = (0, 140)
+    top_left = rng.uniform(0, [width - 200, height - 200], size=(50, 2))
+    boxes = np.concatenate((top_left, top_left + rng.uniform(10, 200, size=(50, 2))), axis=1)
+    letterboxed = boxes * gain + [padding[0], padding[1], padding[0], padding[1]]
+    detections = np.concatenate((letterboxed, np.ones((50, 2))), axis=1)
+    scaled = _scale_boxes(detections, gain, padding, (height, width))
+    assert np.allclose(scaled[:, :4], boxes)
+
+
+def test_nms_matches_a_reference():
+    rng = np.random.default_rng(1)
+    top_left = rng.uniform(0, 200, size=(200, 2))
+    boxes = np.concatenate((top_left, top_left + rng.uniform(10, 60, size=(200, 2))), axis=1)
+
+    def iou(a, b):
+        width = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+        height = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+        intersection = width * height
+        return intersection / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection)
+
+    expected = []
+    for i, box in enumerate(boxes):
+        if all(iou(box, boxes[j]) <= 0.45 for j in expected):
+            expected.append(i)
+    assert _nms(boxes, 0.45).tolist() == expected
+
+
+def test_detections_are_in_pixels_of_the_original_image(tmp_path):
+    rows = np.array([
+        prediction(320, 320, 100, 50, 0.9, CAR),
+        # overlaps the car too much and is less confident
+        prediction(325, 320, 100, 50, 0.8, TRUCK),
+        # not one of the target classes
+        prediction(100, 300, 40, 40, 0.9, PERSON),
+        # below the confidence threshold
+        prediction(500, 300, 40, 40, 0.1, CAR),
+    ])
+    model = OnnxModel(fixed_output_model(str(tmp_path / "fixed.onnx"), rows), confidence_threshold=0.25,
+                      iou_threshold=0.45)
+    # a 1280x720 image is letterboxed with a gain of 0.5 and 140 pixels of padding on top
+    detections = model([np.zeros((720, 1280, 3), dtype=np.uint8)]).pred[0]
+    assert len(detections) == 1
+    assert np.allclose(detections[0, :4], [540, 310, 740, 410])
+    assert detections[0, 4] == pytest.approx(0.9)
+    assert detections[0, 5] == CAR
+
+
+def test_classes_are_suppressed_separately_unless_class_agnostic(tmp_path):
+    rows = np.array([prediction(320, 320, 100, 50, 0.9, CAR), prediction(325, 320, 100, 50, 0.8, TRUCK)])
+    path = fixed_output_model(str(tmp_path / "fixed.onnx"), rows)
+    image = np.zeros((640, 640, 3), dtype=np.uint8)
+    assert len(OnnxModel(path, class_agnostic=True)(image).pred[0]) == 1
+    assert len(OnnxModel(path, class_agnostic=False)(image).pred[0]) == 2
+
+
+@pytest.mark.skipif(not os.environ.get("CARSTATS_ONNX_PATH"),
+                    reason="set CARSTATS_ONNX_PATH to an onnx export of the yolov5 model to compare with it")
+def test_parity_with_torch_model():
+    """
+    The onnx export finds the same boxes as the torch.hub model it was exported from, on frames of the video.
+    CARSTATS_MODEL_SIZE is the size of the exported model, and CARSTATS_TEST_VIDEO the video (paths.video_path by
+    default).
+    """
+    pytest.importorskip("torch")
+    import paths
+    from benchmarks import compare_onnx
+
+    video_path = os.environ.get("CARSTATS_TEST_VIDEO", paths.video_path)
+    if not os.path.exists(video_path):
+        pytest.skip(f"{video_path} doesn't exist")
+    results = compare_onnx(video_path, os.environ["CARSTATS_ONNX_PATH"],
+                           model_size=os.environ.get("CARSTATS_MODEL_SIZE", "x"), num_frames=20)
+    assert results["matched_fraction"] >= 0.95
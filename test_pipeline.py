@@ -0,0 +1,92 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from VideoReader import VideoReader
+from benchmarks import StubModel, synthetic_traffic, write_synthetic_video
+from detect_sort import detect_from_video
+from pipeline import Pipeline
+
+
+def pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith("Pipeline ")]
+
+
+def slow_square(item):
+    # stages that take different times for every item, so that they would reorder the items if they could
+    time.sleep(0.002 * (item % 3))
+    return item * item
+
+
+def test_output_is_in_source_order():
+    pipeline = Pipeline(range(50), [("square", slow_square), ("add", lambda item: item + 1)], queue_size=2)
+    assert list(pipeline) == [item * item + 1 for item in range(50)]
+    assert [stage.items for stage in pipeline.stats.stages] == [50, 50, 50]
+    assert not pipeline_threads()
+
+
+def test_stage_exceptions_are_raised_by_the_consumer():
+    def fail_on_five(item):
+        if item == 5:
+            raise ValueError("five")
+        return item
+
+    outputs = []
+    with pytest.raises(ValueError, match="five"):
+        for item in Pipeline(range(50), [("fail", fail_on_five), ("square", slow_square)]):
+            outputs.append(item)
+    assert outputs == [item * item for item in range(5)]
+    assert not pipeline_threads()
+
+
+def test_source_exceptions_are_raised_by_the_consumer():
+    def source():
+        yield 1
+        raise RuntimeError("source")
+
+    with pytest.raises(RuntimeError, match="source"):
+        list(Pipeline(source(), [("square", slow_square)]))
+    assert not pipeline_threads()
+
+
+def test_threads_stop_when_the_consumer_stops_early():
+    closed = []
+
+    def endless_source():
+        try:
+            item = 0
+            while True:
+                yield item
+                item += 1
+        finally:
+            closed.append(True)
+
+    results = iter(Pipeline(endless_source(), [("square", slow_square)], queue_size=2))
+    assert [next(results) for _ in range(3)] == [0, 1, 4]
+    results.close()
+    assert not pipeline_threads()
+    assert closed == [True]
+
+
+@pytest.fixture(scope="module")
+def video_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("video") / "synthetic.mp4")
+    write_synthetic_video(path, synthetic_traffic(num_frames=90, frame_size=(320, 240), num_cars=15),
+                          frame_size=(320, 240))
+    return path
+
+
+@pytest.mark.parametrize("batch_size, prefetch", [(1, 0), (4, 0), (3, 2)])
+def test_pipelined_detection_is_the_same_as_serial(video_path, batch_size, prefetch):
+    serial = detect_from_video(StubModel(), VideoReader(video_path), motion_tracker_min_hits=1)
+    pipelined = detect_from_video(StubModel(), VideoReader(video_path, prefetch=prefetch), batch_size=batch_size,
+                                  pipelined=True, queue_size=2, motion_tracker_min_hits=1)
+    assert len(serial.df) > 0
+    assert not pipeline_threads()
+    # object ids continue between runs of sort
+    serial_ids, pipelined_ids = serial.df["object_id"].to_numpy(), pipelined.df["object_id"].to_numpy()
+    assert np.array_equal(serial_ids - serial_ids.min(), pipelined_ids - pipelined_ids.min())
+    columns = ["frame_num", "x_center", "y_center", "width", "height"]
+    assert np.array_equal(serial.df[columns].to_numpy(), pipelined.df[columns].to_numpy())
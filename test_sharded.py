@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from CarsData import CarsData
+from benchmarks import synthetic_tracks
+from sharded import plan_shards, stitch_shards
+
+NUM_FRAMES = 600
+
+
+@pytest.mark.parametrize("num_frames, num_shards, overlap_frames", [(600, 3, 30), (10, 4, 5), (3, 5, 2)])
+def test_shards_own_every_frame_once(num_frames, num_shards, overlap_frames):
+    shards = plan_shards(num_frames, num_shards, overlap_frames)
+    assert shards[0].owned_start == 0
+    assert shards[-1].end == num_frames
+    for shard, next_shard in zip(shards, shards[1:]):
+        assert shard.end == next_shard.owned_start
+    for shard in shards:
+        assert shard.owned_start < shard.end
+        assert shard.read_start == max(0, shard.owned_start - overlap_frames)
+
+
+def split_into_shards(cars_data: CarsData, shards, seed: int):
+    """
+    The data of each shard as its process would have tracked it: with its own object ids, frame numbers from its
+    read_start, and boxes that are slightly different in the overlap.
+    """
+    rng = np.random.default_rng(seed)
+    df = cars_data.df.reset_index(drop=True)
+    # the id of the track in the whole video, to check the stitched ids against
+    df["true_id"] = df["object_id"]
+    shard_dfs = []
+    for i, shard in enumerate(shards):
+        shard_df = df[(df["frame_num"] >= shard.read_start) & (df["frame_num"] < shard.end)].copy()
+        shard_df["frame_num"] -= shard.read_start
+        shard_df["object_id"] = (shard_df["object_id"] * 7 + 1000 * i).astype(np.int32)
+        for column in ["x_center", "y_center"]:
+            shard_df[column] += rng.normal(0, 0.001, len(shard_df)).astype(np.float32)
+        shard_dfs.append(shard_df)
+    return shard_dfs
+
+
+@pytest.mark.parametrize("seed", range(2))
+@pytest.mark.parametrize("overlap_frames", [2, 30])
+def test_tracks_are_stitched_across_the_overlap(seed, overlap_frames):
+    min_matched_frames = 3
+    cars_data = synthetic_tracks(num_tracks=300, num_frames=NUM_FRAMES, seed=seed)
+    shards = plan_shards(NUM_FRAMES, 3, overlap_frames)
+    df = stitch_shards(shards, split_into_shards(cars_data, shards, seed), min_matched_frames=min_matched_frames)
+
+    assert len(df) == len(cars_data.df)
+    assert np.array_equal(df["frame_num"].to_numpy(), cars_data.df["frame_num"].to_numpy())
+    # every stitched id belongs to a single track
+    assert (df.groupby("object_id")["true_id"].nunique() == 1).all()
+
+    # a track that crosses a boundary is only split if it wasn't seen in min_matched_frames frames of the overlap
+    true_frames = cars_data.df.groupby("object_id")["frame_num"]
+    first_frames, last_frames = true_frames.min(), true_frames.max()
+    ids_per_track = df.groupby("true_id")["object_id"].nunique()
+    split_tracks = 0
+    for true_id, num_ids in ids_per_track.items():
+        expected_ids = 1
+        for shard in shards[1:]:
+            if first_frames[true_id] < shard.owned_start <= last_frames[true_id]:
+                overlap_start = max(first_frames[true_id], shard.read_start)
+                if shard.owned_start - overlap_start < min_matched_frames:
+                    expected_ids += 1
+        assert num_ids == expected_ids, true_id
+        split_tracks += num_ids - 1
+    if overlap_frames < min_matched_frames:
+        assert split_tracks > 0
+    else:
+        assert split_tracks < 0.1 * len(ids_per_track)
+
+    # so a crossing count differs by at most the number of tracks that were split at a boundary
+    line = ((0.5, 0.0), (0.5, 1.0))
+    stitched = CarsData(df=df, fps=30, video_path="synthetic.mp4", frame_jump=1, start_frame=0)
+    assert abs(len(stitched.pass_line_times(line)[0]) - len(cars_data.pass_line_times(line)[0])) <= split_tracks
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_detections, synthetic_traffic
+import sort
+from sort import KalmanBoxTracker, Sort, VectorizedSort
+
+
+def run_tracker(tracker_class, detections, monkeypatch, **settings):
+    # both trackers share the id counter, so it is reset to compare the ids
+    monkeypatch.setattr(KalmanBoxTracker, "count", 0)
+    tracker = tracker_class(**settings)
+    return [tracker.update(frame_detections) for frame_detections in detections]
+
+
+@pytest.mark.parametrize("seed", range(2))
+@pytest.mark.parametrize("max_age, min_hits", [(1, 3), (10, 1), (5, 2)])
+def test_vectorized_sort_gives_the_same_output(seed, max_age, min_hits, monkeypatch):
+    detections = synthetic_detections(synthetic_traffic(num_frames=150, num_cars=40, seed=seed), miss_rate=0.1,
+                                      seed=seed)
+    # a frame without detections
+    detections[50] = detections[50][:0]
+    expected = run_tracker(Sort, detections, monkeypatch, max_age=max_age, min_hits=min_hits)
+    outputs = run_tracker(VectorizedSort, detections, monkeypatch, max_age=max_age, min_hits=min_hits)
+    assert sum(map(len, expected)) > 0
+    for frame_num, (output, expected_output) in enumerate(zip(outputs, expected)):
+        assert np.array_equal(output, expected_output), frame_num
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_gated_association_gives_the_same_output(seed, monkeypatch):
+    """
+    With VectorizedSort, which gives the same output as Sort and is faster with this many tracks.
+    """
+    # dense enough that most frames have more than GATING_MIN_PAIRS pairs of detections and tracks
+    detections = synthetic_detections(synthetic_traffic(num_frames=40, num_cars=600, seed=seed), miss_rate=0.1,
+                                      seed=seed)
+    gated_calls = []
+    associate_gated = sort.associate_detections_to_trackers_gated
+
+    def counting_associate_gated(detections, trackers, iou_threshold):
+        gated_calls.append(len(detections) * len(trackers) >= sort.GATING_MIN_PAIRS)
+        return associate_gated(detections, trackers, iou_threshold)
+    monkeypatch.setattr(sort, "associate_detections_to_trackers_gated", counting_associate_gated)
+
+    expected = run_tracker(VectorizedSort, detections, monkeypatch, max_age=5, min_hits=1)
+    outputs = run_tracker(VectorizedSort, detections, monkeypatch, max_age=5, min_hits=1, gated=True)
+    assert sum(gated_calls) > len(detections) / 2
+    for frame_num, (output, expected_output) in enumerate(zip(outputs, expected)):
+        assert np.array_equal(output, expected_output), frame_num
+
+
+def test_gated_association_matches_boxes_that_dont_overlap_without_a_threshold(monkeypatch):
+    monkeypatch.setattr(sort, "GATING_MIN_PAIRS", 0)
+    detections = np.array([[0, 0, 10, 10, 1], [100, 100, 110, 110, 1]], dtype=float)
+    trackers = np.array([[50, 50, 60, 60, 0]], dtype=float)
+    for iou_threshold in [0, 0.3]:
+        expected = sort.associate_detections_to_trackers(detections, trackers, iou_threshold)
+        outputs = sort.associate_detections_to_trackers_gated(detections, trackers, iou_threshold)
+        assert len(expected[0]) == (1 if iou_threshold == 0 else 0)
+        for output, expected_output in zip(outputs, expected):
+            assert np.array_equal(output, expected_output)